@@ -0,0 +1,114 @@
+"""Memory benchmark: bytes per monitor held in memory at 10k, 100k and 1M URLs.
+
+Every size runs in a fresh interpreter that loads its monitors the way the engine
+does (unpickled from store rows, kept in a {url: monitor} dict) and reports the
+Python memory traced per monitor, the part of it in MonitorTable columns and the
+size of a stored row.
+
+    python benchmarks/memory.py
+    python benchmarks/memory.py --sizes 10000 100000 --output memory_results.jsonl
+
+The monitors look like checked pages of 500 shops: element selector, digest,
+fingerprint, HTTP validators and counters are all set. With --output, one
+JSON line per invocation is appended so results can be compared across releases.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+URL_FORMAT = "https://shop{:03d}.example.com/products/item-{:07d}"
+ETAG_FORMAT = '"{:07x}-5f3a2b"'
+
+
+def row_template(monitor_engine, now):
+    """A pickled, checked monitor as MonitorStore keeps it. URL and ETag have a fixed
+    width, so rows for other monitors are made by replacing them in the bytes."""
+    import pickle
+    monitor = monitor_engine.URLMonitor(URL_FORMAT.format(0, 0), interval=600, tag="div", selector_type="class",
+                                        selector_value="price", fetch_backend=monitor_engine.FETCH_BACKEND_HTTP)
+    monitor.last_check_time = now - 60
+    monitor.last_change_time = now - 86400
+    monitor.last_digest = monitor_engine.content_digest("price 10")
+    monitor.fingerprint = monitor_engine.simhash("price 10 in stock")
+    monitor.check_count = monitor.monitored_check_count = 100000
+    monitor.conditional_hit_count = 60000
+    monitor.conditional_miss_count = 40000
+    monitor.etag = ETAG_FORMAT.format(0)
+    monitor.last_modified = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(now - 86400))
+    return pickle.dumps(monitor, pickle.HIGHEST_PROTOCOL)
+
+
+def child(count):
+    import io
+    import tracemalloc
+    import monitor_engine
+    template = row_template(monitor_engine, time.time())
+    url, etag = URL_FORMAT.format(0, 0).encode(), ETAG_FORMAT.format(0).encode()
+    tracemalloc.start()
+    monitors = {}
+    for i in range(count):
+        row = template.replace(url, URL_FORMAT.format(i % 500, i).encode()).replace(etag, ETAG_FORMAT.format(i).encode())
+        monitor = monitor_engine.MonitorUnpickler(io.BytesIO(row)).load()
+        monitors[monitor.url] = monitor
+    del row
+    traced = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    table = getattr(monitor_engine, 'MONITOR_TABLE', None) # Releases before the compact representation have none
+    return {'urls': count,
+            'bytes_per_monitor': traced / count,
+            'table_bytes_per_monitor': table.nbytes() / count if table else 0,
+            'row_bytes': len(template)}
+
+
+def run_child(count):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', str(count)],
+                               env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Run with {count} URLs failed:\n{completed.stdout}\n{completed.stderr}")
+    return json.loads(completed.stdout.splitlines()[-1]) # The engine may log before it
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help="numbers of monitors to measure (default: 10000 100000 1000000)")
+    parser.add_argument('--output', help="append a JSON line with the results to this file")
+    parser.add_argument('--label', default=None, help="release label stored with --output (default: git describe)")
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(child(args.child)))
+        return 0
+
+    report = {'label': args.label or git_revision(), 'time': time.strftime("%Y-%m-%d %H:%M:%S"), 'results': []}
+    print(f"{'URLs':>10} {'bytes/monitor':>14} {'in table':>9} {'row bytes':>10}")
+    for count in args.sizes:
+        result = run_child(count)
+        report['results'].append(result)
+        print(f"{count:>10} {result['bytes_per_monitor']:>14.0f} {result['table_bytes_per_monitor']:>9.0f} "
+              f"{result['row_bytes']:>10.0f}")
+
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(report) + "\n")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,310 @@
+"""Check pipeline benchmark against a local synthetic HTTP server.
+
+Starts a server (in its own process, so it does not count towards RSS) serving
+--urls synthetic pages, then runs the real MonitorEngine on them with the http
+fetch backend for --duration seconds: scheduler, should_check, worker pool,
+conditional GET, element extraction, digest comparison and the monitor store.
+
+    python benchmarks/pipeline.py --urls 1000 --interval 2 --duration 20
+    python benchmarks/pipeline.py --urls 200 --latency 50 --size 200000 --element bottom --change-rate 0.5
+    python benchmarks/pipeline.py --urls 1000 --per-page 4   # shared fetches of one page
+    python benchmarks/pipeline.py --urls 500 --fail-rate 0.1  # failed checks (404) among them
+
+Reports checks/sec, p50/p99 check latency (dispatch to recorded result),
+scheduling lag (dispatch time minus the time the check was due), requests
+made and checks served by a shared fetch, per-stage micro timings and peak RSS. With --output, one JSON line per run is appended.
+"""
+import argparse
+import contextlib
+import http.server
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError: # Windows: no peak RSS
+    resource = None
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+import monitor_engine
+
+ELEMENT_PLACEMENTS = ['top', 'middle', 'bottom', 'missing']
+
+
+# --- Synthetic server ---
+
+def make_page(page, version, size, element):
+    """HTML of about size bytes with the monitored div at the requested place."""
+    target = f'<div id="target">page {page} version {version}</div>' if element != 'missing' else ""
+    filler_line = '<p class="filler">Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>\n'
+    filler = filler_line * max(1, size // len(filler_line))
+    if element == 'top':
+        body = target + filler
+    elif element == 'bottom':
+        body = filler + target
+    else:
+        half = len(filler) // 2
+        body = filler[:half] + target + filler[half:]
+    return f"<html><head><title>Page {page}</title></head><body>{body}</body></html>".encode()
+
+
+def serve(port_queue, latency, size, element, change_rate, etags, seed):
+    """Server process: serves /page/<n>; each request bumps the page's version with probability change_rate.
+    /missing/<n> answers 404."""
+    versions = {}
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # Keep-alive, like real servers
+
+        def do_GET(self):
+            if self.path.startswith('/missing/'):
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            page = self.path.split('?', 1)[0].rsplit('/', 1)[-1]
+            with lock:
+                if page in versions and rng.random() < change_rate:
+                    versions[page] += 1
+                version = versions.setdefault(page, 0)
+            if latency:
+                time.sleep(latency / 1000)
+            etag = f'"{page}-{version}"'
+            if etags and self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = make_page(page, version, size, element)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            if etags:
+                self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    class Server(http.server.ThreadingHTTPServer):
+        daemon_threads = True
+
+        def handle_error(self, request, client_address):
+            # Checks that stop reading once their element is in close the connection mid-body
+            if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+                super().handle_error(request, client_address)
+
+    server = Server(('127.0.0.1', 0), Handler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+# --- Instrumented engine ---
+
+class BenchEngine(monitor_engine.MonitorEngine):
+    """MonitorEngine that records dispatch and completion times."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started_at = None
+        self.dispatched_at = {} # {url: time.time() of the dispatch}
+        self.latencies = []     # Seconds from dispatch to recorded result
+        self.lags = []          # Seconds between due time and dispatch
+        self.failures = 0
+
+    def dispatch_check(self, monitor, priority=False):
+        now = time.time()
+        queued = super().dispatch_check(monitor, priority)
+        if queued:
+            if monitor.last_check_time:
+                due = monitor.last_check_time + monitor.current_interval()
+            else: # First checks are spread out by CheckScheduler.reset
+                due = self.started_at + monitor_engine.phase_offset(monitor)
+            self.lags.append(max(0.0, now - due))
+            self.dispatched_at[monitor.url] = now
+        return queued
+
+    def record_completion(self, url):
+        dispatched_at = self.dispatched_at.pop(url, None)
+        if dispatched_at is not None:
+            self.latencies.append(time.time() - dispatched_at)
+
+    def record_check_result(self, url, element_content):
+        super().record_check_result(url, element_content)
+        self.record_completion(url)
+
+    def record_check_failure(self, url, error_desc, status=None, transport=False):
+        super().record_check_failure(url, error_desc, status, transport)
+        self.failures += 1
+        self.record_completion(url)
+
+
+# --- Measurements ---
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024 # bytes on macOS, KiB elsewhere
+
+
+def time_per_call(function, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat
+
+
+def stage_timings(engine, args):
+    """Micro timings of the pipeline stages that do not need the network."""
+    monitors = list(engine.monitors.values())
+    sample = monitors[0]
+    html = make_page('0', 1, args.size, args.element).decode()
+    text = engine.http_fetcher.extract(sample, html) or ""
+    digest = monitor_engine.content_digest(text)
+    return {
+        'should_check_us': time_per_call(lambda: [m.should_check() for m in monitors], 5) / len(monitors) * 1e6,
+        'extract_ms': time_per_call(lambda: engine.http_fetcher.extract(sample, html), 20) * 1000,
+        'compare_us': time_per_call(lambda: monitor_engine.content_digest(text) != digest, 1000) * 1e6,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args):
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, daemon=True,
+                                     args=(port_queue, args.latency, args.size, args.element,
+                                           args.change_rate, not args.no_etags, args.seed))
+    server.start()
+    port = port_queue.get(timeout=10)
+
+    os.chdir(tempfile.mkdtemp(prefix="url_monitor_bench_")) # Data files are relative to the working directory
+    settings = dict(monitor_engine.DEFAULT_SETTINGS, http_max_workers=args.workers,
+                    http_max_per_host=args.per_host, http_host_rate=args.host_rate,
+                    store_snapshots=args.snapshots, parse_processes=args.parse_processes)
+    engine = BenchEngine(settings=settings)
+    engine.load()
+    selector = {'tag': "div", 'selector_type': "id", 'selector_value': "target"}
+    adaptive = {'adaptive': True, 'min_interval': 1, 'max_interval': args.interval * 10} if args.adaptive else {}
+    failing = int(args.urls * args.fail_rate)
+    for i in range(args.urls):
+        # With --per-page > 1, several monitors watch one page through URLs that differ in a tracking parameter
+        url = f"http://127.0.0.1:{port}/{'missing' if i < failing else 'page'}/{i // args.per_page}"
+        if args.per_page > 1:
+            url += f"?utm_source=m{i % args.per_page}"
+        engine.add_monitor(monitor_engine.URLMonitor(url, interval=args.interval,
+                                                     fetch_backend=monitor_engine.FETCH_BACKEND_HTTP,
+                                                     **selector, **adaptive))
+
+    engine.started_at = time.time()
+    engine.start()
+    time.sleep(args.duration)
+    engine.stop()
+    elapsed = time.time() - engine.started_at
+    if failing and not engine.failures:
+        raise RuntimeError(f"None of the {failing} failing URLs had a failed check recorded")
+
+    result = {
+        'checks': len(engine.latencies),
+        'failures': engine.failures,
+        'checks_per_sec': len(engine.latencies) / elapsed,
+        'latency_p50_ms': percentile(engine.latencies, 0.50) * 1000,
+        'latency_p99_ms': percentile(engine.latencies, 0.99) * 1000,
+        'lag_p50_ms': percentile(engine.lags, 0.50) * 1000,
+        'lag_p99_ms': percentile(engine.lags, 0.99) * 1000,
+        'lag_mean_ms': statistics.fmean(engine.lags) * 1000 if engine.lags else 0.0,
+        'not_modified': sum(m.conditional_hit_count for m in engine.monitors.values()),
+        'requests': sum(m.monitored_check_count for m in engine.monitors.values()),
+        'shared_fetches': sum(m.shared_fetch_count for m in engine.monitors.values()),
+    }
+    result.update(stage_timings(engine, args))
+
+    started = time.perf_counter()
+    engine.close(save_all=True) # Writes every row, like on exit
+    result['save_all_ms'] = (time.perf_counter() - started) * 1000
+    result['peak_rss_mb'] = peak_rss_mb()
+    server.terminate()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--urls', type=int, default=500, help="number of monitors (default: 500)")
+    parser.add_argument('--per-page', type=int, default=1,
+                        help="monitors per page, sharing its fetch (default: 1, every monitor has its own page)")
+    parser.add_argument('--interval', type=int, default=2, help="check interval in seconds (default: 2)")
+    parser.add_argument('--duration', type=float, default=15, help="seconds to run the engine (default: 15)")
+    parser.add_argument('--latency', type=float, default=0, help="server delay per request in ms (default: 0)")
+    parser.add_argument('--size', type=int, default=20000, help="approximate page size in bytes (default: 20000)")
+    parser.add_argument('--element', choices=ELEMENT_PLACEMENTS, default='middle',
+                        help="where the monitored element is on the page (default: middle)")
+    parser.add_argument('--change-rate', type=float, default=0.1,
+                        help="probability that a page changed since its last request (default: 0.1)")
+    parser.add_argument('--no-etags', action='store_true', help="server sends no ETag, every check is a full GET")
+    parser.add_argument('--fail-rate', type=float, default=0,
+                        help="fraction of the monitors whose page answers 404 (default: 0)")
+    parser.add_argument('--workers', type=int, default=monitor_engine.HTTP_MAX_WORKERS,
+                        help=f"HTTP parallel checks (default: {monitor_engine.HTTP_MAX_WORKERS})")
+    parser.add_argument('--per-host', type=int, default=None,
+                        help="HTTP checks per host (default: --workers, every page is on one host)")
+    parser.add_argument('--host-rate', type=float, default=0,
+                        help="HTTP requests/sec per host (default: 0 = no limit, every page is on one host)")
+    parser.add_argument('--snapshots', action='store_true', help="enable the compressed snapshot setting")
+    parser.add_argument('--parse-processes', type=int, default=0,
+                        help="parse pages of at least 256 KB in this many processes (default: 0 = in the worker threads)")
+    parser.add_argument('--adaptive', action='store_true',
+                        help="adaptive intervals between 1s and 10x --interval (compare checks with and without)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="append a JSON line with the results to this file")
+    parser.add_argument('--label', default=None, help="label stored with --output (default: git describe)")
+    args = parser.parse_args(argv)
+    if args.per_host is None:
+        args.per_host = args.workers
+
+    label = args.label or git_revision()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        result = run(args) # The engine logs every check; it still pays for that, the terminal does not
+        monitor_engine.flush_log()
+
+    print(f"{args.urls} URLs, interval {args.interval}s, {args.duration:g}s, {args.workers} workers, "
+          f"{args.size} B pages, {args.latency:g} ms latency, element {args.element}, change rate {args.change_rate:g}")
+    for key, value in result.items():
+        print(f"  {key:<16} {value:12.3f}" if isinstance(value, float) else f"  {key:<16} {value}")
+
+    if args.output:
+        report = {'label': label, 'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+                  'params': {key: value for key, value in vars(args).items() if key not in ('output', 'label')},
+                  'result': result}
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(report) + "\n")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
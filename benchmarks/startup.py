@@ -0,0 +1,144 @@
+"""Startup benchmark: time to first paint and time until monitoring can start.
+
+Every run is a fresh interpreter started in a scratch directory holding a data
+file with --urls monitors, so imports and the store load are measured cold.
+Times are from process launch, interpreter startup included.
+
+    python benchmarks/startup.py --urls 1000 --runs 5
+    python benchmarks/startup.py --headless --output startup_results.jsonl
+
+The headless run imports monitor_engine, loads the store and starts the engine;
+the GUI run (needs wxPython and a display) creates the main window and waits for
+AppFrame.finish_startup. With --output, one JSON line per invocation is appended
+so results can be compared across releases.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def elapsed_ms(launched_at):
+    return (time.time() - launched_at) * 1000
+
+
+def child_headless(launched_at):
+    result = {'interpreter_ms': elapsed_ms(launched_at)}
+    import monitor_engine
+    result['import_ms'] = elapsed_ms(launched_at)
+    engine = monitor_engine.MonitorEngine(settings=dict(monitor_engine.DEFAULT_SETTINGS))
+    engine.load()
+    result['loaded_ms'] = elapsed_ms(launched_at)
+    engine.start()
+    result['ready_ms'] = elapsed_ms(launched_at)
+    result['urls'] = len(engine.monitors)
+    engine.close()
+    return result
+
+
+def child_gui(launched_at):
+    result = {'interpreter_ms': elapsed_ms(launched_at)}
+    import wx
+    import url_monitor
+    result['import_ms'] = elapsed_ms(launched_at)
+
+    class BenchFrame(url_monitor.AppFrame):
+        def finish_startup(self):
+            super().finish_startup()
+            result['ready_ms'] = elapsed_ms(launched_at)
+            result['urls'] = len(self.urls_to_monitor)
+            wx.CallAfter(self.Close)
+
+    def on_first_paint(event):
+        result.setdefault('first_paint_ms', elapsed_ms(launched_at))
+        event.Skip()
+
+    app = wx.App(False)
+    frame = BenchFrame(None, title=url_monitor.APP_NAME)
+    result['frame_created_ms'] = elapsed_ms(launched_at)
+    frame.url_list.Bind(wx.EVT_PAINT, on_first_paint)
+    app.MainLoop()
+    return result
+
+
+def make_data_dir(url_count):
+    """Creates a scratch directory with a data file holding url_count monitors."""
+    sys.path.insert(0, REPO_DIR)
+    import monitor_engine
+    directory = tempfile.mkdtemp(prefix="url_monitor_startup_")
+    store = monitor_engine.MonitorStore(os.path.join(directory, monitor_engine.DATA_FILE))
+    store.start()
+    for i in range(url_count):
+        store.save(monitor_engine.URLMonitor(f"http://127.0.0.1:1/page/{i}", interval=300 + i % 600,
+                                             tag="div", selector_type="id", selector_value=f"item{i}",
+                                             fetch_backend=monitor_engine.FETCH_BACKEND_HTTP))
+    store.close()
+    return directory
+
+
+def run_child(mode, data_dir):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+    result_path = os.path.join(data_dir, "startup_result.json") # Not stdout: the app logs there
+    if os.path.exists(result_path):
+        os.remove(result_path)
+    launched_at = time.time()
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode, str(launched_at), result_path],
+                               cwd=data_dir, env=env, capture_output=True, text=True)
+    if completed.returncode != 0 or not os.path.exists(result_path):
+        raise RuntimeError(f"{mode} startup run failed:\n{completed.stdout}\n{completed.stderr}")
+    with open(result_path) as f:
+        return json.load(f)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--urls', type=int, default=1000, help="monitors in the data file (default: 1000)")
+    parser.add_argument('--runs', type=int, default=5, help="cold starts per mode (default: 5)")
+    parser.add_argument('--headless', action='store_true', help="only measure monitor_engine, no GUI")
+    parser.add_argument('--output', help="append a JSON line with the medians to this file")
+    parser.add_argument('--label', default=None, help="release label stored with --output (default: git describe)")
+    parser.add_argument('--child', nargs=3, metavar=('MODE', 'LAUNCHED_AT', 'RESULT_FILE'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        mode, launched_at = args.child[0], float(args.child[1])
+        result = child_gui(launched_at) if mode == 'gui' else child_headless(launched_at)
+        with open(args.child[2], 'w') as f:
+            json.dump(result, f)
+        return 0
+
+    data_dir = make_data_dir(args.urls)
+    modes = ['headless'] if args.headless else ['headless', 'gui']
+    report = {'label': args.label or git_revision(), 'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+              'urls': args.urls, 'runs': args.runs}
+    for mode in modes:
+        runs = [run_child(mode, data_dir) for _ in range(args.runs)]
+        medians = {key: statistics.median(run[key] for run in runs)
+                   for key in runs[0] if key.endswith('_ms')}
+        report[mode] = medians
+        print(f"{mode} ({args.urls} URLs, median of {args.runs} runs):")
+        for key, value in medians.items():
+            print(f"  {key[:-3]:<16} {value:8.1f} ms")
+
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(report) + "\n")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,3149 @@
+"""Monitoring engine for URL Change Monitor: scheduling, HTTP checks, change detection and storage.
+
+Has no wxPython dependency. url_monitor.py is the desktop front end on top of it;
+run this module directly for a headless daemon/CLI that uses the same data files:
+
+    python -m monitor_engine run
+    python -m monitor_engine list
+    python -m monitor_engine add https://example.com --tag div --selector-type id --selector-value price
+    python -m monitor_engine add https://example.com --target "price = span.price" --target "stock = xpath://div[@id='stock']"
+    python -m monitor_engine add https://example.com --noise "regex: \\d+ views" --noise "ignore: .ad" --noise whitespace
+    python -m monitor_engine history https://example.com
+    python -m monitor_engine changed --min-percent 10
+    python -m monitor_engine similar
+    python -m monitor_engine remove https://example.com
+"""
+import sys
+import time
+import threading
+import collections
+import urllib.parse
+import heapq
+import itertools
+import os
+import io
+import pickle
+import json
+import queue
+import atexit
+import hashlib
+import zlib
+import sqlite3
+import contextlib
+import signal
+import bisect
+import email.utils
+import functools
+import re
+import codecs
+import difflib
+import math
+import array
+# requests, bs4, html.parser, argparse and numpy (optional) are imported where first used: together they take longer
+# to import than the rest of the engine, and the GUI wants its window up first.
+
+
+# --- Configuration ---
+DATA_FILE = "url_monitor_data.db"
+LEGACY_DATA_FILE = "url_monitor_data.pkl" # Whole-file pickle used by older versions, migrated on load
+SETTINGS_FILE = "url_monitor_settings.json"
+SNAPSHOT_DIR = "url_monitor_snapshots" # Compressed copies of the last content, if enabled
+HISTORY_FILE = "url_monitor_history.db" # Change history: first version in full, later changes as line diffs
+HISTORY_MAX_ENTRIES = 500 # Changes kept per URL, 0 = no history
+HISTORY_MAX_DAYS = 365    # Changes older than this are dropped (the latest one per URL is always kept), 0 = no limit
+
+# Fetch backends a URLMonitor can be checked with
+FETCH_BACKEND_WEBVIEW = "webview" # Full browser render, runs JavaScript (GUI only)
+FETCH_BACKEND_HTTP = "http"       # Plain HTTP GET + HTML parse, no JavaScript
+FETCH_BACKENDS = [FETCH_BACKEND_WEBVIEW, FETCH_BACKEND_HTTP]
+
+HTTP_POOL_SIZE = 10   # Max keep-alive connections kept per host
+HTTP_CONNECT_TIMEOUT = 10.0 # Seconds to establish a connection
+HTTP_READ_TIMEOUT = 30.0    # Seconds the server may stay silent while we wait for data
+CHECK_TIMEOUT = 120.0       # Seconds a whole HTTP download or WebView load may take
+HTTP_CHUNK_SIZE = 16 * 1024 # Also how often the total timeout is checked during a download
+HTTP_MAX_BODY_MB = 20 # Larger responses fail the check, 0 = no limit
+PARSE_OFFLOAD_MIN_SIZE = 256 * 1024 # Pages at least this large are parsed in the parse process pool, if enabled
+PARSE_TASKS_PER_PROCESS = 200 # Parse processes are replaced after this many pages (bounds leaks and fragmentation)
+BREAKER_FAILURES = 5   # Consecutive failed checks against a host before it is skipped
+BREAKER_COOLDOWN = 300 # Seconds a failing host is skipped before one trial check; doubled while it keeps failing
+BREAKER_COOLDOWN_MAX = 6 * 3600
+HTTP_USER_AGENT = "Mozilla/5.0 (compatible; URLChangeMonitor/1.0)"
+HTTP_MAX_WORKERS = 8  # Global number of HTTP checks run in parallel
+HTTP_MAX_PER_HOST = 2 # Max HTTP checks in flight against one host
+HTTP_HOST_RATE = 1.0  # Max HTTP requests started per second against one host, 0 = no limit
+HOST_BACKOFF_BASE = 30     # Seconds a host is left alone after a 429/503 without Retry-After, doubled per repeat
+HOST_BACKOFF_MAX = 3600    # Upper bound for the backoff and for a server's Retry-After
+STARTUP_SPREAD = 300  # Overdue checks at start, and first checks of added URLs, are spread over up to this many seconds
+SHARED_FETCH_WINDOW = 60 # HTTP monitors of one document due within this many seconds share a single fetch
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'mc_cid', 'mc_eid') # Query parameters that do not change the document
+WEBVIEW_POOL_SIZE = 2 # WebView instances rendering checks in parallel (one visible, the rest hidden)
+NOT_MODIFIED = "<not modified>" # Check result for a 304 response: no change, nothing parsed
+WEBVIEW_UNAVAILABLE_ERROR = "WebView not available (switch this URL to the http fetch backend)"
+
+# Adaptive intervals (URLMonitor.adaptive): checks run about ADAPTIVE_CHECKS_PER_CHANGE times
+# per average gap between changes; every check without a change stretches the interval by
+# ADAPTIVE_GROWTH. Always kept within the monitor's min_interval/max_interval.
+ADAPTIVE_MIN_INTERVAL = 60
+ADAPTIVE_MAX_INTERVAL = 86400
+ADAPTIVE_CHECKS_PER_CHANGE = 2
+ADAPTIVE_GROWTH = 1.25
+ADAPTIVE_GAP_WEIGHT = 0.3 # Weight of the newest gap in the moving average of change gaps
+
+# Defaults for the values editable in the Settings dialog (persisted in SETTINGS_FILE)
+DEFAULT_SETTINGS = {
+    'http_max_workers': HTTP_MAX_WORKERS,
+    'http_max_per_host': HTTP_MAX_PER_HOST,
+    'http_host_rate': HTTP_HOST_RATE,
+    'http_connect_timeout': HTTP_CONNECT_TIMEOUT,
+    'http_read_timeout': HTTP_READ_TIMEOUT,
+    'check_timeout': CHECK_TIMEOUT,
+    'http_max_body_mb': HTTP_MAX_BODY_MB,
+    'breaker_failures': BREAKER_FAILURES,
+    'breaker_cooldown': BREAKER_COOLDOWN,
+    'shared_fetch_window': SHARED_FETCH_WINDOW,
+    'parse_processes': 0, # Processes parsing large HTTP pages, 0 = parse in the worker threads
+    'webview_pool_size': WEBVIEW_POOL_SIZE,
+    'store_snapshots': False,
+    'similarity_fingerprints': False, # Fingerprint every URL for the changed/similar queries, not only those with a min change
+    'history_max_entries': HISTORY_MAX_ENTRIES,
+    'history_max_days': HISTORY_MAX_DAYS,
+    'metrics_port': 0, # Prometheus text endpoint on 127.0.0.1, 0 = off
+}
+
+# Stages timed for every check by CheckMetrics, in pipeline order
+CHECK_STAGES = ['queue_wait', # Queued until a worker/WebView picks it up, host parking included
+                'fetch',      # HTTP GET or WebView page load
+                'parse',      # HTML parse + element lookup, or the WebView script
+                'deliver',    # Result waiting for the thread that records it (the GUI's UI thread)
+                'compare',    # Digest and comparison with the stored state
+                'persist']    # Queueing the monitor's row for the store
+CHECK_RESULTS = ['changed', 'unchanged', 'not_modified', 'not_found', 'failed']
+HISTOGRAM_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60) # Seconds
+
+
+# --- Logging ---
+# print() can block on a slow console; log() hands lines to a background thread so
+# the UI thread and the workers never wait on stdout.
+log_queue = queue.SimpleQueue()
+log_thread = None
+log_thread_lock = threading.Lock()
+
+def log(message):
+    """Non-blocking print() replacement."""
+    global log_thread
+    if log_thread is None:
+        with log_thread_lock:
+            if log_thread is None:
+                log_thread = threading.Thread(target=log_writer, name="log-writer", daemon=True)
+                log_thread.start()
+    log_queue.put(message)
+
+def log_writer():
+    while True:
+        print(log_queue.get())
+
+@atexit.register
+def flush_log():
+    """Prints whatever the daemon log thread did not get to before exit."""
+    while not log_queue.empty():
+        print(log_queue.get_nowait())
+
+
+def content_digest(text):
+    """Fixed-size (16 byte) fingerprint of extracted content, used for change detection."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+FINGERPRINT_BITS = 64
+WORD = re.compile(r"\w+")
+
+
+@functools.lru_cache(maxsize=8192) # About 1.5 MB
+def word_hash(word):
+    """64-bit hash of a word as a string of '0'/'1' digits; cached, as pages mostly repeat the same words."""
+    return format(int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'big'), '064b')
+
+
+def simhash(text):
+    """64-bit SimHash of the words of a text: similar texts differ in few bits.
+
+    Every word is hashed and each fingerprint bit is set if it is set in the
+    majority of the word hashes; see fingerprint_difference for comparing two.
+    """
+    hashes = [word_hash(word) for word in WORD.findall(text.lower())]
+    if not hashes:
+        return 0
+    half = len(hashes) / 2
+    fingerprint = 0
+    for column in zip(*hashes): # One tuple of '0'/'1' per bit, most significant first
+        fingerprint = (fingerprint << 1) | (column.count('1') > half)
+    return fingerprint
+
+
+def fingerprint_difference(bits):
+    """Estimated fraction of the content that changed (0..1) when two fingerprints differ in this many bits.
+
+    SimHash bits differ with probability angle/pi between the word count vectors,
+    so this is 1 - their cosine similarity. That is the share of words replaced
+    when the words are mostly distinct; text that repeats its words reads lower
+    (replacing 10% of a 2000 word text drawn from 5000 words reads as about 7%).
+    """
+    return min(1.0, 1 - math.cos(math.pi * bits / FINGERPRINT_BITS))
+
+
+def local_day(timestamp):
+    """Day number of a timestamp in local time, to group fingerprints by day."""
+    return int((timestamp + time.localtime(timestamp).tm_gmtoff) // 86400)
+
+
+def host_of(url):
+    return urllib.parse.urlsplit(url).hostname or ""
+
+
+def document_key(url):
+    """Identity of the document behind a URL: monitors with the same key can share one fetch.
+
+    Lower-cases scheme and host, drops a default port, the fragment and tracking
+    parameters (utm_*, fbclid, ...) and sorts the remaining query parameters.
+    """
+    parts = urllib.parse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, parts.port) in (('http', 80), ('https', 443)):
+        netloc = netloc.rsplit(':', 1)[0]
+    query = sorted((name, value) for name, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+                   if not name.lower().startswith(TRACKING_PARAMS))
+    return urllib.parse.urlunsplit((scheme, netloc, parts.path or '/', urllib.parse.urlencode(query), ''))
+
+
+# --- Extraction targets ---
+# Every check extracts one or more named targets from a single fetched page. Monitors
+# without explicit targets have one unnamed target built from their tag/selector fields.
+TARGET_CSS = "css"
+TARGET_XPATH = "xpath"
+TARGET_PAGE = "page" # Text of the whole body ("Entire Page")
+SINGLE_TARGET = ""   # Name of the implicit target
+TARGET_LINE = re.compile(r"^\s*([\w.-]+)\s*=\s*(.+?)\s*$") # name = selector
+XPATH_PREFIX = "xpath:"
+XPATH_UNAVAILABLE_ERROR = "XPath targets need lxml on the http fetch backend (pip install lxml)"
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_target(kind, expression):
+    """Compiled selector for a target, cached so each expression is compiled only once.
+
+    CSS compiles with soupsieve (the selector engine behind bs4's select). XPath
+    compiles with lxml, which is optional: without it None is returned and XPath
+    targets only work on the webview backend. Raises ValueError for a bad expression.
+    """
+    if kind == TARGET_PAGE:
+        return None
+    if kind == TARGET_XPATH:
+        try:
+            from lxml import etree
+        except ImportError:
+            return None
+        try:
+            return etree.XPath(expression)
+        except etree.XPathSyntaxError as e:
+            raise ValueError(f"Invalid XPath {expression!r}: {e}") from None
+    import soupsieve
+    try:
+        return soupsieve.compile(expression)
+    except (soupsieve.SelectorSyntaxError, NotImplementedError) as e: # The latter for ::pseudo-elements
+        raise ValueError(f"Invalid CSS selector {expression!r}: {str(e).splitlines()[0]}") from None
+
+
+def parse_targets(text):
+    """Parses 'name = selector' lines into a list of (name, kind, expression) targets.
+
+    Selectors are CSS unless prefixed with 'xpath:'. Raises ValueError for a
+    malformed line, a duplicate name or a selector that does not compile.
+    """
+    targets = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        match = TARGET_LINE.match(line)
+        if not match:
+            raise ValueError(f"Expected 'name = selector', got: {line.strip()}")
+        name, expression = match.groups()
+        kind = TARGET_CSS
+        if expression.startswith(XPATH_PREFIX):
+            kind, expression = TARGET_XPATH, expression[len(XPATH_PREFIX):].strip()
+        if any(name == existing for existing, _, _ in targets):
+            raise ValueError(f"Duplicate target name: {name}")
+        compile_target(kind, expression)
+        targets.append((name, kind, expression))
+    return targets
+
+
+SIMPLE_SELECTOR = re.compile(r"^([a-zA-Z][\w-]*)?(?:#([\w-]+)|\.([\w-]+)|\[(id|class)='((?:[^'\\]|\\.)*)'\])$")
+VOID_ELEMENTS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+                           'param', 'source', 'track', 'wbr'])
+
+
+def simple_selector(kind, expression):
+    """(tag, attribute, value, is_class_token) for a CSS target ElementScanner can recognize, else None.
+
+    Covers what css_selector() builds (tag[id='v'], tag[class='v']) and tag#id / tag.class.
+    """
+    if kind != TARGET_CSS:
+        return None
+    match = SIMPLE_SELECTOR.match(expression)
+    if not match:
+        return None
+    tag, element_id, class_token, attribute, value = match.groups()
+    tag = tag.lower() if tag else None
+    if element_id is not None:
+        return (tag, 'id', element_id, False)
+    if class_token is not None:
+        return (tag, 'class', class_token, True)
+    return (tag, attribute, re.sub(r"\\(.)", r"\1", value), False) # Undo css_selector()'s escaping
+
+
+class ElementScanner:
+    """Incremental tag scanner fed with a page as it downloads.
+
+    complete turns True once the first match of every target has been closed, so
+    the rest of the page can be left unread. It uses the same tokenizer as
+    BeautifulSoup's html.parser builder, so the downloaded prefix extracts to the
+    same text as the whole page would. Only handles simple_selector() targets.
+    """
+    def __init__(self, targets):
+        import html.parser # Like bs4, only needed once checks run
+        self.parser = html.parser.HTMLParser()
+        self.parser.handle_starttag = self.handle_starttag
+        self.parser.handle_startendtag = self.handle_startendtag
+        self.parser.handle_endtag = self.handle_endtag
+        self.targets = frozenset(targets)  # (kind, expression) pairs this scanner covers
+        self.waiting = [simple_selector(kind, expression) for kind, expression in self.targets]
+        self.open = []        # [[tag, depth]] of matched elements not closed yet
+        self.stopped_early = False # Set by HTTPFetcher.fetch when it stopped reading
+
+    @classmethod
+    def for_monitors(cls, monitors):
+        """Scanner for every target of the monitors, or None if one of them cannot be scanned."""
+        targets = {(kind, expression) for monitor in monitors for _, kind, expression in monitor.extraction_targets()}
+        if not all(simple_selector(kind, expression) for kind, expression in targets):
+            return None
+        return cls(targets)
+
+    def feed(self, text):
+        self.parser.feed(text)
+
+    def covers(self, monitor):
+        return all((kind, expression) in self.targets for _, kind, expression in monitor.extraction_targets())
+
+    @property
+    def complete(self):
+        return not self.waiting and not self.open
+
+    def matches(self, selector, tag, attrs):
+        selector_tag, attribute, value, is_class_token = selector
+        if selector_tag and selector_tag != tag:
+            return False
+        actual = dict(attrs).get(attribute)
+        if actual is None:
+            return False
+        if attribute == 'class': # Multi-valued: bs4 stores the whitespace-separated tokens
+            return value in actual.split() if is_class_token else value == " ".join(actual.split())
+        return actual == value
+
+    def handle_starttag(self, tag, attrs):
+        for element in self.open:
+            if element[0] == tag:
+                element[1] += 1
+        found = [selector for selector in self.waiting if self.matches(selector, tag, attrs)]
+        if found:
+            self.waiting = [selector for selector in self.waiting if selector not in found]
+            if tag not in VOID_ELEMENTS:
+                self.open.append([tag, 1])
+
+    def handle_startendtag(self, tag, attrs): # <div/>: bs4 also treats it as an empty element
+        self.waiting = [selector for selector in self.waiting if not self.matches(selector, tag, attrs)]
+
+    def handle_endtag(self, tag):
+        for element in self.open:
+            if element[0] == tag:
+                element[1] -= 1
+        self.open = [element for element in self.open if element[1] > 0]
+
+
+def format_target(target):
+    """The parse_targets line for one (name, kind, expression) target."""
+    name, kind, expression = target
+    return f"{name} = {XPATH_PREFIX if kind == TARGET_XPATH else ''}{expression}"
+
+
+def xpath_text(result):
+    """Stripped text of an XPath result: the first node of a node-set, or a string/number/boolean."""
+    if isinstance(result, list):
+        if not result:
+            return None
+        result = result[0]
+    if hasattr(result, 'text_content'): # Element
+        return result.text_content().strip()
+    if isinstance(result, bool):
+        return "true" if result else "false"
+    if isinstance(result, float) and result.is_integer():
+        return str(int(result)) # count() and friends, formatted like JavaScript does
+    return str(result).strip()
+
+
+# --- Noise filters ---
+# Per-monitor rules that drop timestamps, counters, tokens and ads before content is
+# digested and compared, so they do not count as changes. Text rules run in the given
+# order on the text of every target; ignore rules remove elements before the text is taken.
+RULE_REGEX = "regex"           # Removes every match of a regular expression
+RULE_IGNORE = "ignore"         # CSS selector of elements inside a target whose text is left out
+RULE_WHITESPACE = "whitespace" # Collapses whitespace runs to one space
+NOISE_RULE_LINE = re.compile(r"^\s*(regex|ignore)\s*:\s?(.*?)\s*$|^\s*(whitespace)\s*$")
+
+
+def parse_noise_rules(text):
+    """Parses 'regex: PATTERN', 'ignore: SELECTOR' and 'whitespace' lines into (kind, value) rules.
+
+    Raises ValueError for an unknown line or a pattern/selector that does not compile.
+    """
+    rules = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        match = NOISE_RULE_LINE.match(line)
+        if not match:
+            raise ValueError(f"Expected 'regex: PATTERN', 'ignore: SELECTOR' or 'whitespace', got: {line.strip()}")
+        kind, value, whitespace = match.groups()
+        rule = (RULE_WHITESPACE, "") if whitespace else (kind, value)
+        if not rule[1] and rule[0] != RULE_WHITESPACE:
+            raise ValueError(f"Missing {'pattern' if kind == RULE_REGEX else 'selector'}: {line.strip()}")
+        rules.append(rule)
+    compile_noise_filter(tuple(rules))
+    return rules
+
+
+def format_noise_rule(rule):
+    """The parse_noise_rules line for one (kind, value) rule."""
+    kind, value = rule
+    return kind if kind == RULE_WHITESPACE else f"{kind}: {value}"
+
+
+class NoiseFilter:
+    """Compiled noise rules of a monitor, see compile_noise_filter."""
+    def __init__(self, rules):
+        self.text_rules = [] # (compiled pattern or None for whitespace) in rule order
+        self.ignore = []     # Compiled CSS selectors of ignored elements
+        for kind, value in rules:
+            if kind == RULE_IGNORE:
+                self.ignore.append(compile_target(TARGET_CSS, value))
+            elif kind == RULE_REGEX:
+                try:
+                    self.text_rules.append(re.compile(value))
+                except re.error as e:
+                    raise ValueError(f"Invalid regex {value!r}: {e}") from None
+            else:
+                self.text_rules.append(None)
+
+    def apply(self, text):
+        """The text with the text rules applied, stripped; None stays None."""
+        if text is None or not self.text_rules:
+            return text
+        for pattern in self.text_rules:
+            text = " ".join(text.split()) if pattern is None else pattern.sub("", text)
+        return text.strip()
+
+    def element_text(self, element):
+        """Like element.get_text().strip(), leaving out the text of ignored descendants."""
+        if not self.ignore:
+            return element.get_text().strip()
+        ignored = {id(node) for selector in self.ignore for match in selector.select(element) for node in match.descendants}
+        return "".join(text for text in element.strings if id(text) not in ignored).strip()
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_noise_filter(rules):
+    """NoiseFilter for a tuple of (kind, value) rules, or None without rules.
+
+    Cached, so the rules of a monitor are compiled once and reused by every check
+    (and once per process in a ParseProcessPool). Raises ValueError for a bad rule.
+    """
+    return NoiseFilter(rules) if rules else None
+
+
+class SnapshotStore:
+    """Optional on-disk store of the latest full content per URL, zlib-compressed.
+
+    Keeps page text out of the URLMonitor objects, so their in-memory and pickled
+    size does not depend on how large the monitored element is. save() and delete()
+    only queue the change; a writer thread compresses and writes it, so recording a
+    check (on the GUI's UI thread) never waits on the disk.
+    """
+    def __init__(self, directory=SNAPSHOT_DIR):
+        self.directory = directory
+        self.condition = threading.Condition()
+        self.pending = {} # {url: text, or None to delete the snapshot}
+        self.running = False
+        self.writer_thread = None
+
+    def path_for(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode('utf-8')).hexdigest() + ".z")
+
+    def save(self, url, text):
+        with self.condition:
+            self.pending[url] = text
+            self.condition.notify()
+
+    def delete(self, url):
+        with self.condition:
+            self.pending[url] = None
+            self.condition.notify()
+
+    def load(self, url):
+        """Returns the stored text for a URL, or None if there is no snapshot."""
+        with self.condition:
+            if url in self.pending: # Not written yet
+                return self.pending[url]
+        try:
+            with open(self.path_for(url), 'rb') as f:
+                return zlib.decompress(f.read()).decode('utf-8')
+        except FileNotFoundError:
+            return None
+
+    def start(self):
+        self.running = True
+        self.writer_thread = threading.Thread(target=self.writer, name="snapshot-writer", daemon=True)
+        self.writer_thread.start()
+
+    def close(self):
+        """Stops the writer and writes everything still pending."""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.writer_thread:
+            self.writer_thread.join(timeout=10)
+        self.write_pending() # Anything left if the writer never ran or timed out
+
+    def writer(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    break
+            self.write_pending()
+
+    def write_pending(self):
+        with self.condition:
+            pending, self.pending = self.pending, {}
+        for url, text in pending.items():
+            try:
+                if text is None:
+                    self.remove_file(url)
+                else:
+                    self.write_file(url, text)
+            except Exception as e:
+                log(f"Error saving snapshot for {url}: {e}")
+
+    def write_file(self, url, text):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(url)
+        temp_path = path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(zlib.compress(text.encode('utf-8'), 6))
+        os.replace(temp_path, path) # Never leaves a half-written snapshot behind
+
+    def remove_file(self, url):
+        try:
+            os.remove(self.path_for(url))
+        except FileNotFoundError:
+            pass
+
+
+# --- Compact monitor storage ---
+# Large deployments keep 100k+ monitors in memory. Their numeric state lives in typed
+# arrays (8 bytes per value instead of a 24-36 byte Python object plus a reference),
+# the rest in __slots__, and repeated strings and target tuples are shared.
+class MonitorTable:
+    """Typed-array columns with one row per URLMonitor, see table_field.
+
+    A row is handed out when a monitor is created and reused once it is garbage
+    collected, so the columns are as long as the most monitors alive at once.
+    """
+    def __init__(self):
+        self.columns = [] # (column, blank row) pairs, grown together by allocate()
+        self.free_rows = []
+        self.rows = 0
+        self.lock = threading.Lock()
+
+    def add_column(self, blank):
+        """A new column whose rows start as blank: array.array(typecode, [0]) or bytearray(width)."""
+        column = blank[:0]
+        self.columns.append((column, blank))
+        return column
+
+    def allocate(self):
+        with self.lock:
+            if self.free_rows:
+                return self.free_rows.pop()
+            for column, blank in self.columns:
+                column += blank # In place
+            self.rows += 1
+            return self.rows - 1
+
+    def release(self, row):
+        with self.lock:
+            self.free_rows.append(row)
+
+    def nbytes(self):
+        return sum(len(column) * getattr(column, 'itemsize', 1) for column, _ in self.columns)
+
+
+MONITOR_TABLE = MonitorTable()
+
+
+def table_field(typecode, nullable=False):
+    """A numeric URLMonitor attribute kept in a MONITOR_TABLE column instead of on the object.
+
+    typecode is 'd' (float), 'q' (int) or 'Q' (unsigned 64-bit); nullable fields
+    record None in a one-byte column alongside. A property over closures, which
+    Python calls faster than a descriptor class.
+    """
+    values = MONITOR_TABLE.add_column(array.array(typecode, [0]))
+    convert = float if typecode == 'd' else int
+    if not nullable:
+        def get(monitor):
+            return values[monitor.row]
+
+        def set(monitor, value):
+            values[monitor.row] = convert(value)
+        return property(get, set)
+
+    nulls = MONITOR_TABLE.add_column(array.array('b', [0]))
+
+    def get_nullable(monitor):
+        row = monitor.row
+        return None if nulls[row] else values[row]
+
+    def set_nullable(monitor, value):
+        row = monitor.row
+        if value is None:
+            nulls[row] = 1
+        else:
+            values[row] = convert(value)
+            nulls[row] = 0
+    return property(get_nullable, set_nullable)
+
+
+def digest_field(size=16):
+    """A content_digest() (or None) kept in a MONITOR_TABLE byte column, see table_field."""
+    values = MONITOR_TABLE.add_column(bytearray(size))
+    nulls = MONITOR_TABLE.add_column(array.array('b', [1]))
+
+    def get(monitor):
+        row = monitor.row
+        return None if nulls[row] else bytes(values[row * size:(row + 1) * size])
+
+    def set(monitor, value):
+        row = monitor.row
+        if value is None:
+            nulls[row] = 1
+            return
+        if len(value) != size:
+            raise ValueError(f"Expected a {size} byte digest")
+        values[row * size:(row + 1) * size] = value
+        nulls[row] = 0
+    return property(get, set)
+
+
+SHARED_VALUES = {} # {value: value}, see shared_value
+
+
+def shared_value(value):
+    """The one instance of a hashable value (e.g. a targets tuple) that all monitors share, like sys.intern."""
+    return SHARED_VALUES.setdefault(value, value)
+
+
+class URLMonitor:
+    """Settings and state of one monitored URL.
+
+    Numeric state is stored in MONITOR_TABLE and the rest in __slots__, so a monitor
+    takes a few hundred bytes (see benchmarks/memory.py); attributes read and write
+    as on any object. Pickles as a {name: value} dict, see __getstate__.
+    """
+    __slots__ = ('row', 'url', 'host_name', 'enabled', 'adaptive', 'tag', 'selector_type', 'selector_value',
+                 'fetch_backend', 'etag', 'last_modified', 'target_tuple', 'noise_rule_tuple', 'target_digests')
+    table = MONITOR_TABLE # Kept on the class so __del__ still finds it during interpreter shutdown
+    setters = None # [(name, setter, default)] of STATE, see __setstate__
+
+    interval = table_field('q')         # in seconds; the starting point when adaptive
+    last_check_time = table_field('d')
+    last_change_time = table_field('d', nullable=True)
+    last_digest = digest_field()        # content_digest() of the monitored element, None if not found/never checked
+    min_change_percent = table_field('q') # Smaller changes (by simhash estimate) are not reported, 0 = any change
+    fingerprint = table_field('Q', nullable=True) # simhash() of the content last_digest describes
+    day_fingerprint = table_field('Q', nullable=True) # fingerprint as of the start of fingerprint_day, see set_fingerprint
+    fingerprint_day = table_field('q', nullable=True)
+    ignored_count = table_field('q')    # Count of times a check was skipped due to interval
+    check_count = table_field('q')      # Total times check_for_changes was called (regardless of interval)
+    monitored_check_count = table_field('q') # Total times an actual load request was made
+    conditional_hit_count = table_field('q') # HTTP checks answered with 304 Not Modified (nothing downloaded or parsed)
+    conditional_miss_count = table_field('q') # HTTP checks that downloaded and parsed the full page
+    shared_fetch_count = table_field('q') # HTTP checks served by another monitor's fetch of the same document
+    min_interval = table_field('q')
+    max_interval = table_field('q')
+    effective_interval = table_field('d') # Interval in use when adaptive
+    mean_change_gap = table_field('d', nullable=True) # Moving average of the seconds between detected changes
+
+    # Everything __getstate__ saves
+    STATE = ('url', 'interval', 'enabled', 'last_check_time', 'last_digest', 'min_change_percent', 'fingerprint',
+             'day_fingerprint', 'fingerprint_day', 'tag', 'selector_type', 'selector_value', 'targets', 'target_digests',
+             'noise_rules', 'last_change_time', 'ignored_count', 'check_count', 'monitored_check_count',
+             'conditional_hit_count', 'conditional_miss_count', 'shared_fetch_count', 'fetch_backend', 'etag',
+             'last_modified', 'adaptive', 'min_interval', 'max_interval', 'effective_interval', 'mean_change_gap')
+
+    def __new__(cls, *args, **kwargs):
+        monitor = super().__new__(cls)
+        monitor.row = cls.table.allocate() # Also when unpickling, which skips __init__
+        return monitor
+
+    def __del__(self):
+        self.table.release(self.row)
+
+    def __init__(self, url, interval=300, enabled=True, tag="", selector_type="", selector_value="",
+                 fetch_backend=FETCH_BACKEND_WEBVIEW, adaptive=False, min_interval=ADAPTIVE_MIN_INTERVAL,
+                 max_interval=ADAPTIVE_MAX_INTERVAL, targets=None, noise_rules=None, min_change_percent=0):
+        self.url = url
+        self.host_name = None # See host
+        self.interval = interval
+        self.enabled = enabled
+        self.last_check_time = 0
+        self.last_digest = None
+        self.min_change_percent = min_change_percent
+        self.fingerprint = None
+        self.day_fingerprint = None
+        self.fingerprint_day = None
+        self.tag = sys.intern(tag)           # e.g., 'div', 'span', 'p'
+        self.selector_type = sys.intern(selector_type) # 'id' or 'class'
+        self.selector_value = sys.intern(selector_value) # The actual id or class name
+        self.targets = targets
+        self.target_digests = None # {name: content_digest() or None} of named targets, to report which changed
+        self.noise_rules = noise_rules
+        self.last_change_time = None
+        self.ignored_count = 0
+        self.check_count = 0
+        self.monitored_check_count = 0
+        self.conditional_hit_count = 0
+        self.conditional_miss_count = 0
+        self.shared_fetch_count = 0
+        self.fetch_backend = sys.intern(fetch_backend) # FETCH_BACKEND_WEBVIEW or FETCH_BACKEND_HTTP
+        self.etag = None          # Validators from the last full HTTP response,
+        self.last_modified = None # sent back as If-None-Match / If-Modified-Since
+        self.adaptive = adaptive  # Adjust effective_interval to how often the content changes
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.effective_interval = interval
+        self.mean_change_gap = None
+
+    @property
+    def host(self):
+        """host_of(url), worked out on first use and shared by all monitors of the host."""
+        if self.host_name is None:
+            self.host_name = sys.intern(host_of(self.url))
+        return self.host_name
+
+    @property
+    def targets(self):
+        """Named (name, kind, expression) targets as a shared tuple; replace the selector fields if set."""
+        return self.target_tuple
+
+    @targets.setter
+    def targets(self, targets):
+        self.target_tuple = shared_value(tuple(tuple(target) for target in targets or ()))
+
+    @property
+    def noise_rules(self):
+        """(kind, value) rules applied before digesting, see parse_noise_rules; a shared tuple."""
+        return self.noise_rule_tuple
+
+    @noise_rules.setter
+    def noise_rules(self, rules):
+        self.noise_rule_tuple = shared_value(tuple(tuple(rule) for rule in rules or ()))
+
+    def reset_validators(self):
+        """Forgets the HTTP validators, forcing the next check to download the full page."""
+        self.etag = None
+        self.last_modified = None
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.STATE}
+
+    def __setstate__(self, state):
+        """Restores a pickled monitor, filling in attributes added since it was saved."""
+        if 'last_source' in state: # Data files from before content digests
+            state = dict(state)
+            last_source = state.pop('last_source')
+            state['last_digest'] = content_digest(last_source) if last_source else None
+        setters = URLMonitor.setters
+        if setters is None:
+            defaults = URLMonitor('').__getstate__()
+            setters = URLMonitor.setters = [(name, getattr(URLMonitor, name).__set__, defaults[name]) for name in self.STATE]
+        get = state.get
+        for name, set_value, default in setters: # Called directly, this is most of the time to load a monitor
+            set_value(self, get(name, default))
+        if 'effective_interval' not in state: # Data files from before adaptive intervals: start from its own interval
+            self.effective_interval = min(max(self.interval, self.min_interval), self.max_interval)
+        self.host_name = None
+        for name in ('tag', 'selector_type', 'selector_value', 'fetch_backend'): # Unpickled as separate copies
+            value = getattr(self, name)
+            if isinstance(value, str):
+                setattr(self, name, sys.intern(value))
+        self.target_digests = self.target_digests or None
+
+    def has_element_selector(self):
+        """True if a specific element is monitored rather than the entire page."""
+        return bool(self.tag and self.selector_type and self.selector_value)
+
+    def css_selector(self):
+        """The tag[selector_type='selector_value'] rule shared by all fetch backends."""
+        escaped_value = self.selector_value.replace("\\", "\\\\").replace("'", "\\'")
+        return f"{self.tag}[{self.selector_type}='{escaped_value}']"
+
+    def extraction_targets(self):
+        """The (name, kind, expression) targets extracted by every check, as a hashable tuple."""
+        if self.targets:
+            return self.targets
+        if self.has_element_selector():
+            return ((SINGLE_TARGET, TARGET_CSS, self.css_selector()),)
+        return ((SINGLE_TARGET, TARGET_PAGE, ""),)
+
+    def noise_filter(self):
+        """The compiled NoiseFilter of this monitor's rules (shared, compiled once), or None."""
+        return compile_noise_filter(self.noise_rules)
+
+    def fingerprint_options(self, fingerprint_all=False):
+        """(fingerprint, known_digest) for ExtractedContent: content is only fingerprinted for a
+        minimum change size (or for all monitors with fingerprint_all), and not again when its
+        digest is the one whose fingerprint the monitor already has."""
+        return (fingerprint_all or self.min_change_percent > 0,
+                self.last_digest if self.fingerprint is not None else None)
+
+    def set_fingerprint(self, fingerprint, now):
+        """Stores the fingerprint of new content, first keeping the previous one as the start of a new day."""
+        day = local_day(now)
+        if day != self.fingerprint_day:
+            self.day_fingerprint, self.fingerprint_day = self.fingerprint, day
+        self.fingerprint = fingerprint
+
+    def describe_targets(self):
+        if self.targets:
+            return ", ".join(name for name, _, _ in self.targets)
+        return self.css_selector() if self.has_element_selector() else "Entire Page"
+
+    def update_target_digests(self, digests):
+        """Stores {name: digest or None} of the named targets; returns the names whose content changed."""
+        previous = self.target_digests or {}
+        changed = [name for name, digest in digests.items() if previous.get(name) != digest]
+        self.target_digests = digests
+        return changed
+
+    def current_interval(self):
+        """Seconds between checks: effective_interval in adaptive mode, interval otherwise."""
+        return self.effective_interval if self.adaptive else self.interval
+
+    def reset_adaptation(self):
+        """Restarts adaptation from interval, e.g. after the settings were edited."""
+        self.effective_interval = min(max(self.interval, self.min_interval), self.max_interval)
+        self.mean_change_gap = None
+
+    def adapt_interval(self, changed, previous_change_time, now):
+        """Updates effective_interval after a successful check (no-op unless adaptive).
+
+        A change shortens the interval towards the average gap between changes divided
+        by ADAPTIVE_CHECKS_PER_CHANGE; a check without a change lengthens it.
+        """
+        if not self.adaptive:
+            return
+        if changed:
+            if previous_change_time:
+                gap = now - previous_change_time
+                if self.mean_change_gap is None:
+                    self.mean_change_gap = gap
+                else:
+                    self.mean_change_gap += ADAPTIVE_GAP_WEIGHT * (gap - self.mean_change_gap)
+                target = self.mean_change_gap / ADAPTIVE_CHECKS_PER_CHANGE
+            else:
+                target = self.effective_interval / ADAPTIVE_CHECKS_PER_CHANGE
+            self.effective_interval = min(self.effective_interval, target)
+        else:
+            self.effective_interval *= ADAPTIVE_GROWTH
+        self.effective_interval = min(max(self.effective_interval, self.min_interval), self.max_interval)
+
+    def should_check(self):
+        """Checks if it's time to schedule a check based on the interval."""
+        current_timestamp = time.time()
+        if self.enabled and current_timestamp - self.last_check_time >= self.current_interval():
+            return True
+        else:
+            self.ignored_count += 1
+            return False
+
+
+
+class MonitorUnpickler(pickle.Unpickler):
+    """Resolves URLMonitor wherever it was pickled from: the GUI script (__main__),
+    the url_monitor module, or this module run as the daemon."""
+    def find_class(self, module, name):
+        if name == 'URLMonitor':
+            return URLMonitor
+        return super().find_class(module, name)
+
+
+class MonitorStore:
+    """SQLite storage (WAL mode) holding one pickled URLMonitor per row.
+
+    save() and delete() only record the change; a background writer thread commits
+    pending rows in small batches. A check therefore writes just the monitor it
+    touched, the UI thread never waits on the disk, and a crash mid-write cannot
+    corrupt monitors that were already committed.
+    """
+    FLUSH_INTERVAL = 0.5 # Seconds the writer waits to batch up further changes
+
+    def __init__(self, path=DATA_FILE):
+        self.path = path
+        self.condition = threading.Condition()
+        self.dirty = {} # {url: pickled monitor, or None to delete the row}
+        self.running = False
+        self.writer_thread = None
+        with contextlib.closing(self.connect()) as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS monitors (url TEXT PRIMARY KEY, data BLOB NOT NULL)")
+            connection.commit()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL") # Durable across app crashes; WAL keeps it consistent
+        return connection
+
+    def migrate_from_pickle(self, pickle_path=LEGACY_DATA_FILE):
+        """Imports the old whole-file pickle once, then renames it out of the way."""
+        if not os.path.exists(pickle_path):
+            return 0
+        with open(pickle_path, 'rb') as f:
+            data = MonitorUnpickler(f).load()
+        if not isinstance(data, dict):
+            log(f"Data in {pickle_path} is not a dictionary, not migrating it.")
+            return 0
+        rows = [(url, pickle.dumps(monitor, pickle.HIGHEST_PROTOCOL))
+                for url, monitor in data.items() if isinstance(monitor, URLMonitor)]
+        with contextlib.closing(self.connect()) as connection:
+            connection.executemany("INSERT OR REPLACE INTO monitors (url, data) VALUES (?, ?)", rows)
+            connection.commit()
+        os.replace(pickle_path, pickle_path + ".migrated")
+        log(f"Migrated {len(rows)} URLs from {pickle_path} to {self.path}")
+        return len(rows)
+
+    def load_all(self):
+        """Returns {url: URLMonitor} for every stored row, skipping rows that fail to unpickle."""
+        monitors = {}
+        with contextlib.closing(self.connect()) as connection:
+            for url, data in connection.execute("SELECT url, data FROM monitors"):
+                try:
+                    monitor = MonitorUnpickler(io.BytesIO(data)).load()
+                except Exception as e:
+                    log(f"Skipping unreadable data for {url}: {e}")
+                    continue
+                if isinstance(monitor, URLMonitor):
+                    monitors[url] = monitor
+        return monitors
+
+    def save(self, monitor):
+        """Queues a monitor's current state for writing. Pickled now, so later edits don't race the writer."""
+        data = pickle.dumps(monitor, pickle.HIGHEST_PROTOCOL)
+        with self.condition:
+            self.dirty[monitor.url] = data
+            self.condition.notify()
+
+    def delete(self, url):
+        with self.condition:
+            self.dirty[url] = None
+            self.condition.notify()
+
+    def start(self):
+        self.running = True
+        self.writer_thread = threading.Thread(target=self.writer, name="monitor-store-writer", daemon=True)
+        self.writer_thread.start()
+
+    def close(self):
+        """Stops the writer and commits everything still pending."""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.writer_thread:
+            self.writer_thread.join(timeout=10)
+        with contextlib.closing(self.connect()) as connection:
+            self.write_pending(connection) # Anything left if the writer never ran or timed out
+
+    def writer(self):
+        connection = self.connect()
+        try:
+            while True:
+                with self.condition:
+                    while self.running and not self.dirty:
+                        self.condition.wait()
+                    if not self.running:
+                        break
+                time.sleep(self.FLUSH_INTERVAL) # Let a burst of checks land in one transaction
+                try:
+                    self.write_pending(connection)
+                except Exception as e:
+                    log(f"Error writing to {self.path}: {e}")
+        finally:
+            connection.close()
+
+    def write_pending(self, connection):
+        with self.condition:
+            pending, self.dirty = self.dirty, {}
+        if not pending:
+            return
+        with connection: # One transaction per batch
+            connection.executemany("INSERT OR REPLACE INTO monitors (url, data) VALUES (?, ?)",
+                                   [(url, data) for url, data in pending.items() if data is not None])
+            connection.executemany("DELETE FROM monitors WHERE url = ?",
+                                   [(url,) for url, data in pending.items() if data is None])
+
+
+def line_diff(old, new):
+    """Compact diff turning old into new: a list of ops, n = keep n lines, ["-", lines], ["+", lines].
+
+    Returns (ops, added line count, removed line count).
+    """
+    old_lines, new_lines = old.split('\n'), new.split('\n')
+    ops = []
+    added = removed = 0
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(['-', old_lines[i1:i2]])
+            removed += i2 - i1
+        if j2 > j1:
+            ops.append(['+', new_lines[j1:j2]])
+            added += j2 - j1
+    return ops, added, removed
+
+
+def apply_diff(old, ops):
+    """Rebuilds the new text from the old one and line_diff() ops."""
+    old_lines = old.split('\n')
+    lines = []
+    position = 0
+    for op in ops:
+        if isinstance(op, int):
+            lines.extend(old_lines[position:position + op])
+            position += op
+        elif op[0] == '-':
+            position += len(op[1])
+        else:
+            lines.extend(op[1])
+    return "\n".join(lines)
+
+
+def pack(value):
+    return zlib.compress(json.dumps(value, ensure_ascii=False).encode('utf-8'), 6)
+
+
+def unpack(data):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+class HistoryStore:
+    """Change history per URL in SQLite: the first version in full, every later change as a line diff.
+
+    record() only queues; a background thread computes the diffs and writes them.
+    Every KEYFRAME_INTERVAL-th entry (and any change whose diff would be larger)
+    also stores the full text, so rebuilding a version replays a bounded number of
+    diffs. Once an hour the thread compacts: entries beyond max_entries per URL or
+    older than max_days are dropped, the oldest remaining entry becomes a full copy
+    and the freed pages are returned to the file system.
+    """
+    KEYFRAME_INTERVAL = 50
+    COMPACT_INTERVAL = 3600 # Seconds
+    FLUSH_INTERVAL = 0.5
+
+    def __init__(self, path=HISTORY_FILE, max_entries=HISTORY_MAX_ENTRIES, max_days=HISTORY_MAX_DAYS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_days = max_days
+        self.condition = threading.Condition()
+        self.pending = [] # [(url, time, text or None)] in check order; time None deletes the URL's history
+        self.running = False
+        self.writer_thread = None
+        self.last_compaction = time.time() # The first compaction runs an interval after start
+        with contextlib.closing(sqlite3.connect(self.path, timeout=30)) as connection:
+            # Set before connect() turns on WAL, which creates the file; older files are converted once by VACUUM
+            if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2: # 2 = INCREMENTAL
+                connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                connection.execute("VACUUM")
+        with contextlib.closing(self.connect()) as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY, url TEXT NOT NULL, "
+                               "time REAL NOT NULL, gone INTEGER NOT NULL, added INTEGER NOT NULL, "
+                               "removed INTEGER NOT NULL, text BLOB, diff BLOB)")
+            connection.execute("CREATE INDEX IF NOT EXISTS history_url ON history (url, id)")
+            # Latest text per URL, the base of the next diff
+            connection.execute("CREATE TABLE IF NOT EXISTS heads (url TEXT PRIMARY KEY, text BLOB, since_full INTEGER NOT NULL)")
+            connection.commit()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def record(self, url, when, text):
+        """Queues a change: the new text, or None if the element disappeared."""
+        with self.condition:
+            self.pending.append((url, when, text))
+            self.condition.notify()
+
+    def delete(self, url):
+        with self.condition:
+            self.pending.append((url, None, None))
+            self.condition.notify()
+
+    def start(self):
+        self.running = True
+        self.writer_thread = threading.Thread(target=self.writer, name="history-writer", daemon=True)
+        self.writer_thread.start()
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.writer_thread:
+            self.writer_thread.join(timeout=10)
+        with contextlib.closing(self.connect()) as connection:
+            self.write_pending(connection)
+
+    def writer(self):
+        connection = self.connect()
+        try:
+            while True:
+                with self.condition:
+                    while self.running and not self.pending:
+                        self.condition.wait(max(0, self.last_compaction + self.COMPACT_INTERVAL - time.time()))
+                        if time.time() >= self.last_compaction + self.COMPACT_INTERVAL:
+                            break
+                    if not self.running:
+                        break
+                time.sleep(self.FLUSH_INTERVAL)
+                try:
+                    self.write_pending(connection)
+                    if time.time() >= self.last_compaction + self.COMPACT_INTERVAL:
+                        self.compact(connection)
+                except Exception as e:
+                    log(f"Error writing to {self.path}: {e}")
+        finally:
+            connection.close()
+
+    def write_pending(self, connection):
+        with self.condition:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return
+        with connection: # One transaction per batch
+            for url, when, text in pending:
+                if when is None:
+                    connection.execute("DELETE FROM history WHERE url = ?", (url,))
+                    connection.execute("DELETE FROM heads WHERE url = ?", (url,))
+                    continue
+                head = connection.execute("SELECT text, since_full FROM heads WHERE url = ?", (url,)).fetchone()
+                previous = unpack(head[0]) if head and head[0] is not None else None
+                since_full = head[1] + 1 if head else 0
+                full = diff = None
+                added = removed = 0
+                if text is None: # Gone; the next version is stored in full
+                    removed = len(previous.split('\n')) if previous is not None else 0
+                elif previous is None:
+                    full = pack(text)
+                    added = len(text.split('\n'))
+                    since_full = 0
+                else:
+                    ops, added, removed = line_diff(previous, text)
+                    diff = pack(ops)
+                    if since_full >= self.KEYFRAME_INTERVAL or len(diff) >= len(pack(text)):
+                        full = pack(text)
+                        since_full = 0
+                        if len(diff) >= len(full) and len(diff) > 1024: # Mostly rewritten: the counts say how much
+                            diff = None
+                connection.execute("INSERT INTO history (url, time, gone, added, removed, text, diff) "
+                                   "VALUES (?, ?, ?, ?, ?, ?, ?)", (url, when, int(text is None), added, removed, full, diff))
+                connection.execute("INSERT OR REPLACE INTO heads (url, text, since_full) VALUES (?, ?, ?)",
+                                   (url, None if text is None else pack(text), since_full))
+
+    def compact(self, connection):
+        """Applies the retention limits. Runs on the writer thread."""
+        self.last_compaction = time.time()
+        cutoff = time.time() - self.max_days * 86400 if self.max_days else None
+        dropped = 0
+        with connection:
+            for url, count, oldest in connection.execute("SELECT url, COUNT(*), MIN(time) FROM history GROUP BY url").fetchall():
+                ids = [row[0] for row in connection.execute("SELECT id FROM history WHERE url = ? ORDER BY id", (url,))]
+                keep_from = max(0, len(ids) - self.max_entries) if self.max_entries else 0
+                if cutoff is not None and oldest < cutoff:
+                    old = connection.execute("SELECT COUNT(*) FROM history WHERE url = ? AND time < ?", (url, cutoff)).fetchone()[0]
+                    keep_from = max(keep_from, min(old, len(ids) - 1)) # Never drops the latest change
+                if keep_from == 0:
+                    continue
+                first_kept = ids[keep_from]
+                row = connection.execute("SELECT gone, text FROM history WHERE id = ?", (first_kept,)).fetchone()
+                if not row[0] and row[1] is None: # A diff against a version about to be dropped
+                    text = self.version(url, first_kept, connection)
+                    connection.execute("UPDATE history SET text = ? WHERE id = ?", (pack(text), first_kept))
+                connection.execute("DELETE FROM history WHERE url = ? AND id < ?", (url, first_kept))
+                dropped += keep_from
+        if dropped:
+            # Frees one page per step; execute() would only step once, executescript() runs it to the end
+            connection.executescript("PRAGMA incremental_vacuum")
+            log(f"History compacted: {dropped} old changes dropped")
+
+    def page(self, url, before=None, limit=20):
+        """Up to limit changes of a URL, newest first, older than entry id before (keyset paging).
+
+        Each is a dict with id, time, gone, added, removed and diff (line_diff() ops,
+        None for the first version, after a disappearance or for very large changes).
+        """
+        query = "SELECT id, time, gone, added, removed, diff FROM history WHERE url = ?"
+        parameters = [url]
+        if before is not None:
+            query += " AND id < ?"
+            parameters.append(before)
+        query += " ORDER BY id DESC LIMIT ?"
+        parameters.append(limit)
+        with contextlib.closing(self.connect()) as connection:
+            rows = connection.execute(query, parameters).fetchall()
+        return [{'id': entry_id, 'time': when, 'gone': bool(gone), 'added': added, 'removed': removed,
+                 'diff': unpack(diff) if diff is not None else None}
+                for entry_id, when, gone, added, removed, diff in rows]
+
+    def version(self, url, entry_id, connection=None):
+        """Full text as of a history entry, rebuilt from the nearest full copy; None if it was gone."""
+        if connection is None:
+            with contextlib.closing(self.connect()) as connection:
+                return self.version(url, entry_id, connection)
+        base = connection.execute("SELECT id, text FROM history WHERE url = ? AND id <= ? AND text IS NOT NULL "
+                                  "ORDER BY id DESC LIMIT 1", (url, entry_id)).fetchone()
+        gone = connection.execute("SELECT gone FROM history WHERE id = ? AND url = ?", (entry_id, url)).fetchone()
+        if base is None or gone is None or gone[0]:
+            return None
+        text = unpack(base[1])
+        for (diff,) in connection.execute("SELECT diff FROM history WHERE url = ? AND id > ? AND id <= ? ORDER BY id",
+                                          (url, base[0], entry_id)):
+            text = apply_diff(text, unpack(diff))
+        return text
+
+
+def format_history_entry(entry):
+    """Readable lines for a HistoryStore.page() entry: time and counts, then -/+ lines of the diff."""
+    when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry['time']))
+    if entry['gone']:
+        return [f"#{entry['id']}  {when}  element disappeared"]
+    lines = [f"#{entry['id']}  {when}  +{entry['added']} -{entry['removed']} lines"]
+    if entry['diff'] is None:
+        lines.append("  (stored in full)")
+        return lines
+    for op in entry['diff']:
+        if not isinstance(op, int): # Unchanged runs are left out
+            lines.extend(f"  {op[0]} {line}" for line in op[1])
+    return lines
+
+
+def import_numpy():
+    """numpy if it is installed, else None (FingerprintIndex then loops in Python)."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class FingerprintIndex:
+    """The fingerprints of all monitors in packed arrays, for bulk similarity queries.
+
+    Row i belongs to urls[i]: its current fingerprint, the one it had at the start of
+    day days[i] and flags telling which of the two are known. Queries compare whole
+    arrays at once with numpy when it is installed (about 10 ms per 100,000 URLs for
+    similar_to), else loop over the arrays. Only monitors with a fingerprint take part,
+    see URLMonitor.fingerprint_options. Not thread-safe; MonitorEngine calls it under its lock.
+    """
+    CURRENT = 1   # flags: current fingerprint known (content was found)
+    DAY_START = 2 # flags: fingerprint at the start of the day known
+
+    def __init__(self):
+        self.urls = []
+        self.rows = {} # {url: row}
+        self.current = array.array('Q')
+        self.day_start = array.array('Q')
+        self.days = array.array('i')
+        self.flags = array.array('B')
+
+    def __len__(self):
+        return len(self.urls)
+
+    def update(self, monitor):
+        """Copies the fingerprints of a monitor into its row, adding the row if needed."""
+        row = self.rows.get(monitor.url)
+        if row is None:
+            row = self.rows[monitor.url] = len(self.urls)
+            self.urls.append(monitor.url)
+            for column in (self.current, self.day_start, self.days, self.flags):
+                column.append(0)
+        self.current[row] = monitor.fingerprint or 0
+        self.day_start[row] = monitor.day_fingerprint or 0
+        self.days[row] = monitor.fingerprint_day or 0
+        self.flags[row] = ((self.CURRENT if monitor.fingerprint is not None else 0)
+                           | (self.DAY_START if monitor.day_fingerprint is not None else 0))
+
+    def remove(self, url):
+        """Drops a row by moving the last row into its place, so the arrays stay packed."""
+        row = self.rows.pop(url, None)
+        if row is None:
+            return
+        last = len(self.urls) - 1
+        if row != last:
+            self.urls[row] = self.urls[last]
+            self.rows[self.urls[row]] = row
+            for column in (self.current, self.day_start, self.days, self.flags):
+                column[row] = column[last]
+        self.urls.pop()
+        for column in (self.current, self.day_start, self.days, self.flags):
+            column.pop()
+
+    def differences(self, numpy, fingerprints, others):
+        """fingerprint_difference() of every pair of two equally long uint64 arrays (or one value)."""
+        xor = numpy.bitwise_xor(fingerprints, others)
+        if hasattr(numpy, 'bitwise_count'): # numpy 2.0+
+            bits = numpy.bitwise_count(xor)
+        else:
+            bits = numpy.unpackbits(xor.view(numpy.uint8)).reshape(-1, FINGERPRINT_BITS).sum(axis=1)
+        return numpy.minimum(1.0, 1 - numpy.cos(numpy.pi * bits / FINGERPRINT_BITS))
+
+    def changed_on(self, day, min_difference=0.0):
+        """[(url, difference)] of monitors whose content changed by more than min_difference
+        (0..1) on a local_day(), largest change first. Content that disappeared counts as 1."""
+        numpy = import_numpy()
+        if not self.urls:
+            return []
+        if numpy is not None:
+            days = numpy.frombuffer(self.days, dtype=numpy.int32)
+            flags = numpy.frombuffer(self.flags, dtype=numpy.uint8)
+            rows = numpy.flatnonzero((days == day) & (flags & self.DAY_START != 0))
+            difference = numpy.ones(len(rows))
+            known = flags[rows] & self.CURRENT != 0
+            difference[known] = self.differences(numpy, numpy.frombuffer(self.current, dtype=numpy.uint64)[rows[known]],
+                                                  numpy.frombuffer(self.day_start, dtype=numpy.uint64)[rows[known]])
+            found = difference > min_difference
+            result = zip(rows[found].tolist(), difference[found].tolist())
+        else:
+            result = []
+            for row, (row_day, flags) in enumerate(zip(self.days, self.flags)):
+                if row_day != day or not flags & self.DAY_START:
+                    continue
+                difference = 1.0
+                if flags & self.CURRENT:
+                    difference = fingerprint_difference(bin(self.current[row] ^ self.day_start[row]).count('1'))
+                if difference > min_difference:
+                    result.append((row, difference))
+        return sorted(((self.urls[row], difference) for row, difference in result), key=lambda item: -item[1])
+
+    def similar_to(self, fingerprint, max_difference=0.0):
+        """[(url, difference)] of monitors whose content is within max_difference (0..1) of a fingerprint, closest first."""
+        numpy = import_numpy()
+        if not self.urls:
+            return []
+        if numpy is not None:
+            rows = numpy.flatnonzero(numpy.frombuffer(self.flags, dtype=numpy.uint8) & self.CURRENT != 0)
+            difference = self.differences(numpy, numpy.frombuffer(self.current, dtype=numpy.uint64)[rows],
+                                          numpy.uint64(fingerprint))
+            found = difference <= max_difference
+            result = zip(rows[found].tolist(), difference[found].tolist())
+        else:
+            result = []
+            for row, (current, flags) in enumerate(zip(self.current, self.flags)):
+                if flags & self.CURRENT:
+                    difference = fingerprint_difference(bin(current ^ fingerprint).count('1'))
+                    if difference <= max_difference:
+                        result.append((row, difference))
+        return sorted(((self.urls[row], difference) for row, difference in result), key=lambda item: item[1])
+
+    def duplicates(self):
+        """Groups of URLs (lists of 2 or more) whose current content has the same fingerprint."""
+        numpy = import_numpy()
+        if not self.urls:
+            return []
+        if numpy is None:
+            groups = collections.defaultdict(list)
+            for url, current, flags in zip(self.urls, self.current, self.flags):
+                if flags & self.CURRENT:
+                    groups[current].append(url)
+            return [urls for urls in groups.values() if len(urls) > 1]
+        rows = numpy.flatnonzero(numpy.frombuffer(self.flags, dtype=numpy.uint8) & self.CURRENT != 0)
+        fingerprints = numpy.frombuffer(self.current, dtype=numpy.uint64)[rows]
+        order = numpy.argsort(fingerprints, kind='stable')
+        boundaries = numpy.flatnonzero(numpy.diff(fingerprints[order]) != 0) + 1 # Runs of equal fingerprints
+        starts = numpy.concatenate(([0], boundaries))
+        ends = numpy.concatenate((boundaries, [len(order)]))
+        rows = rows[order]
+        return [[self.urls[row] for row in rows[start:end].tolist()]
+                for start, end in zip(starts.tolist(), ends.tolist()) if end - start > 1]
+
+
+class CheckTimeoutError(Exception):
+    """A check took longer than its total time budget."""
+
+
+class ResponseTooLargeError(Exception):
+    """The response body is larger than the http_max_body_mb setting."""
+
+
+class HostBusyError(Exception):
+    """The server answered 429 Too Many Requests or 503 Service Unavailable."""
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}" + (f", retry after {retry_after:.0f}s" if retry_after else ""))
+        self.status_code = status_code
+        self.retry_after = retry_after # Seconds from the Retry-After header, None if absent
+
+
+class TransportError(Exception):
+    """A check could not reach its host or the host failed to serve it (timeout, connection error, 5xx, 429).
+
+    The only failures counted by the HostCircuitBreaker.
+    """
+
+
+def is_transport_failure(error):
+    """True if an exception raised by HTTPFetcher.fetch means the host is unreachable or failing."""
+    if isinstance(error, (HostBusyError, CheckTimeoutError)):
+        return True
+    import requests # Already imported by the fetch that raised
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else 0
+        return status >= 500 or status == 429
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date), None if missing or invalid."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def decode_body(body, response):
+    """Decodes a downloaded body like requests' Response.text does."""
+    encoding = response.encoding
+    if encoding is None: # No charset in Content-Type: guess, as apparent_encoding would
+        from requests.compat import chardet
+        encoding = chardet.detect(body)['encoding'] or 'utf-8'
+    try:
+        return body.decode(encoding, errors='replace')
+    except LookupError: # Unknown charset name
+        return body.decode('utf-8', errors='replace')
+
+
+class ParsedDocument:
+    """A downloaded page, parsed lazily and at most once per parser, so every monitor
+    sharing the fetch extracts from the same tree."""
+    def __init__(self, html):
+        self.html = html
+        self.soup = None
+        self.tree = None # lxml, only built for XPath targets
+
+    def get_soup(self):
+        if self.soup is None:
+            from bs4 import BeautifulSoup
+            self.soup = BeautifulSoup(self.html, 'html.parser')
+        return self.soup
+
+    def get_tree(self):
+        if self.tree is None:
+            import lxml.html
+            self.tree = lxml.html.document_fromstring(self.html.encode('utf-8'),
+                                                      parser=lxml.html.HTMLParser(encoding='utf-8'))
+        return self.tree
+
+
+class ExtractedContent:
+    """The result of an extraction, digested wherever the extraction ran.
+
+    text is the extracted text, the JSON of all named targets, or None if nothing
+    was found; digest is content_digest(text); target_digests holds the digest of
+    each named target (None for single-element monitors); fingerprint is simhash(text)
+    if one was asked for, see URLMonitor.fingerprint_options. validators are the
+    (ETag, Last-Modified) of the HTTP response, stored on the monitor when the
+    result is recorded.
+    """
+    __slots__ = ('text', 'digest', 'target_digests', 'fingerprint', 'validators')
+
+    def __init__(self, content, noise=None, fingerprint=False, known_digest=None):
+        """content: text, None (not found) or {name: text or None} of named targets.
+        noise is a NoiseFilter whose text rules are applied to every text first.
+        With fingerprint, the text is fingerprinted unless its digest is known_digest."""
+        self.target_digests = None
+        if noise is not None:
+            content = {name: noise.apply(text) for name, text in content.items()} if isinstance(content, dict) else noise.apply(content)
+        if isinstance(content, dict):
+            self.target_digests = {name: None if text is None else content_digest(text) for name, text in content.items()}
+            if all(text is None for text in content.values()):
+                content = None # Not found only if none of the targets is on the page
+            else: # One digest over all targets; the JSON is also what a snapshot stores
+                content = json.dumps(content, ensure_ascii=False, sort_keys=True)
+        self.text = content
+        self.digest = None if content is None else content_digest(content)
+        self.fingerprint = None
+        if fingerprint and content is not None and self.digest != known_digest:
+            self.fingerprint = simhash(content) # Here rather than when recording, which may be the UI thread
+        self.validators = None
+
+
+def extract_targets(targets, named, document, noise=None):
+    """Text of each (name, kind, expression) target in a ParsedDocument, see HTTPFetcher.extract.
+
+    Ignore rules of the NoiseFilter apply to CSS and page targets; its text rules are left to ExtractedContent.
+    """
+    values = {}
+    for name, kind, expression in targets:
+        selector = compile_target(kind, expression)
+        if kind == TARGET_XPATH:
+            if selector is None:
+                raise RuntimeError(XPATH_UNAVAILABLE_ERROR)
+            values[name] = xpath_text(selector(document.get_tree()))
+            continue
+        soup = document.get_soup()
+        element = (soup.body or soup) if kind == TARGET_PAGE else selector.select_one(soup)
+        if element is None:
+            values[name] = None
+        else:
+            values[name] = noise.element_text(element) if noise is not None else element.get_text().strip()
+    return values if named else values[SINGLE_TARGET]
+
+
+def extract_for_targets(html, target_sets):
+    """Parses a page once and extracts it for several monitors.
+
+    target_sets holds (extraction_targets(), has named targets, noise rules tuple,
+    *fingerprint_options()) per monitor. Returns an ExtractedContent or an error message per entry. Runs in the worker threads or,
+    for large pages, in a ParseProcessPool process, so it only takes picklable values.
+    """
+    document = ParsedDocument(html)
+    results = []
+    for targets, named, rules, fingerprint, known_digest in target_sets:
+        try:
+            noise = compile_noise_filter(rules)
+            results.append(ExtractedContent(extract_targets(targets, named, document, noise), noise,
+                                            fingerprint, known_digest))
+        except Exception as e:
+            results.append(str(e) or type(e).__name__)
+    return results
+
+
+class ParseProcessPool:
+    """Optional process pool that parses, extracts and digests large pages.
+
+    BeautifulSoup holds the GIL, so in the worker threads parsing runs on one core
+    at a time; this spreads it over processes. At most max_pending pages are handed
+    over at once (callers block until a slot is free), and each process is replaced
+    after tasks_per_process pages (on Python 3.11+).
+    """
+    def __init__(self, processes, tasks_per_process=PARSE_TASKS_PER_PROCESS, max_pending=None):
+        self.processes = max(1, processes)
+        self.tasks_per_process = tasks_per_process
+        self.slots = threading.BoundedSemaphore(max_pending or 2 * self.processes)
+        self.lock = threading.Lock()
+        self.executor = None # Started by the first page, see get_executor
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+                try:
+                    self.executor = ProcessPoolExecutor(self.processes, max_tasks_per_child=self.tasks_per_process)
+                except TypeError: # Python < 3.11: processes are not recycled
+                    self.executor = ProcessPoolExecutor(self.processes)
+            return self.executor
+
+    def extract(self, html, target_sets, timeout):
+        """extract_for_targets() in a pool process. Raises CheckTimeoutError after timeout seconds."""
+        from concurrent.futures import TimeoutError as FutureTimeoutError
+        from concurrent.futures.process import BrokenProcessPool
+        with self.slots:
+            executor = self.get_executor()
+            try:
+                return executor.submit(extract_for_targets, html, target_sets).result(timeout)
+            except FutureTimeoutError:
+                raise CheckTimeoutError(f"Parsing took longer than {timeout:g}s") from None
+            except BrokenProcessPool: # A process died (e.g. out of memory): start over with a fresh pool
+                with self.lock:
+                    if self.executor is executor:
+                        self.executor = None
+                executor.shutdown(wait=False)
+                raise
+
+    def stop(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            try:
+                executor.shutdown(wait=False, cancel_futures=True)
+            except TypeError: # Python < 3.9
+                executor.shutdown(wait=False)
+
+
+class HTTPFetcher:
+    """Headless fetch backend: one keep-alive GET over a pooled requests.Session, parsed with BeautifulSoup."""
+    def __init__(self, pool_size=HTTP_POOL_SIZE, connect_timeout=HTTP_CONNECT_TIMEOUT,
+                 read_timeout=HTTP_READ_TIMEOUT, total_timeout=CHECK_TIMEOUT, max_body_size=HTTP_MAX_BODY_MB << 20):
+        self.max_body_size = max_body_size # Bytes, 0 = no limit
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout   # Per socket read, so a slow trickle is bounded by total_timeout
+        self.total_timeout = total_timeout
+        self.pool_size = pool_size
+        self.session = None # Created by the first check, see get_session
+        self.session_lock = threading.Lock()
+
+    def get_session(self):
+        """Returns the pooled session, importing requests on first use."""
+        with self.session_lock:
+            if self.session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['User-Agent'] = HTTP_USER_AGENT
+                self.session = session
+            return self.session
+
+    def fetch(self, monitor, conditional=True, scanner=None):
+        """Downloads the page for a monitor. Raises requests.RequestException on failure,
+        CheckTimeoutError if the download takes longer than total_timeout and
+        ResponseTooLargeError if the body is larger than max_body_size.
+
+        Returns (page text, (ETag, Last-Modified) of the response). Sends the monitor's
+        stored validators as a conditional GET (unless conditional is False) and returns
+        (NOT_MODIFIED, None) if the server answers 304. The new validators are not stored
+        on the monitor: record_check_result does that once the page was extracted and
+        recorded, so a failed extraction is retried instead of answered by a 304.
+
+        With an ElementScanner, the body is scanned as it arrives and reading stops
+        once the scanner is complete; only that prefix of the page is returned and
+        scanner.stopped_early is set. The scan runs one chunk behind the download,
+        so pages that arrive in a single chunk are never scanned.
+        """
+        headers = {}
+        if conditional and monitor.etag:
+            headers['If-None-Match'] = monitor.etag
+        if conditional and monitor.last_modified:
+            headers['If-Modified-Since'] = monitor.last_modified
+        deadline = time.monotonic() + self.total_timeout
+        response = self.get_session().get(monitor.url, headers=headers, stream=True,
+                                          timeout=(self.connect_timeout, self.read_timeout))
+        with response: # Returns the connection to the pool, also when the body is abandoned
+            if response.status_code == 304 and headers:
+                monitor.conditional_hit_count += 1
+                return NOT_MODIFIED, None
+            if response.status_code in (429, 503):
+                raise HostBusyError(response.status_code, parse_retry_after(response.headers.get('Retry-After')))
+            response.raise_for_status()
+            length = response.headers.get('Content-Length', '')
+            # With a scanner the element may be in before the limit, so it is only enforced while reading
+            if self.max_body_size and scanner is None and length.isdigit() and int(length) > self.max_body_size:
+                raise ResponseTooLargeError(f"Page is {int(length) / 2**20:.1f} MB, the limit is {self.max_body_size >> 20} MB")
+            decoder = None
+            if scanner is not None: # Only has to find tags, decode_body still decodes the result
+                try:
+                    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+                except LookupError:
+                    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            chunks = []
+            size = 0
+            for chunk in response.iter_content(HTTP_CHUNK_SIZE):
+                if decoder is not None and chunks:
+                    scanner.feed(decoder.decode(chunks[-1]))
+                    if scanner.complete: # The rest is never read; the connection is closed, not reused
+                        scanner.stopped_early = True
+                        break
+                chunks.append(chunk)
+                size += len(chunk)
+                if self.max_body_size and size > self.max_body_size:
+                    raise ResponseTooLargeError(f"Page is larger than {self.max_body_size >> 20} MB")
+                if time.monotonic() > deadline:
+                    raise CheckTimeoutError(f"Download took longer than {self.total_timeout:g}s")
+            monitor.conditional_miss_count += 1
+            validators = (response.headers.get('ETag'), response.headers.get('Last-Modified'))
+            return decode_body(b"".join(chunks), response), validators
+
+    def extract(self, monitor, document):
+        """Returns the stripped text of the monitored element, or None if it is not on the page.
+        Elements matched by the monitor's ignore rules are left out of the text.
+
+        Monitors with named targets get a {name: text or None} dict instead, all
+        extracted from one parse of the page. document is the HTML or a ParsedDocument
+        shared with other monitors of the same page. Mirrors the JavaScript run in the
+        WebView: CSS selectors match like document.querySelector(), "Entire Page" is
+        the whole body.
+        """
+        if not isinstance(document, ParsedDocument):
+            document = ParsedDocument(document)
+        return extract_targets(monitor.extraction_targets(), bool(monitor.targets), document, monitor.noise_filter())
+
+    def check(self, monitor):
+        """Fetches and extracts in one go, storing the new validators. Safe to call from worker threads."""
+        html, validators = self.fetch(monitor)
+        if html is NOT_MODIFIED:
+            return NOT_MODIFIED
+        content = self.extract(monitor, html)
+        monitor.etag, monitor.last_modified = validators
+        return content
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+
+
+class CheckQueue:
+    """Thread-safe FIFO of pending checks with a high-priority lane.
+
+    Each key (URL) is queued at most once: putting a queued key again is a no-op,
+    except that a priority put promotes it to the priority lane. Membership and
+    cancel() are O(1); cancelled or promoted entries are skipped when they reach
+    the front of their lane.
+    """
+    WAIT_SMOOTHING = 0.1 # Weight of the newest sample in average_wait
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.priority_lane = collections.deque() # (key, token), served first
+        self.normal_lane = collections.deque()   # (key, token)
+        self.entries = {}  # {key: (token, item, enqueued_at, priority)}
+        self.tokens = itertools.count()
+        self.priority_count = 0
+        self.average_wait = 0.0 # Smoothed seconds between put() and pop()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def put(self, key, item=None, priority=False):
+        """Queues item (default: the key itself). Returns False if the key was already queued."""
+        with self.condition:
+            entry = self.entries.get(key)
+            if entry is not None and (entry[3] or not priority):
+                return False
+            if entry is not None: # Promote, keeping the original enqueue time
+                item, enqueued_at = entry[1], entry[2]
+            else:
+                item, enqueued_at = (key if item is None else item), time.time()
+            token = next(self.tokens)
+            self.entries[key] = (token, item, enqueued_at, priority)
+            if priority:
+                self.priority_count += 1
+                self.priority_lane.append((key, token))
+            else:
+                self.normal_lane.append((key, token))
+            self.condition.notify()
+            return entry is None
+
+    def pop(self, timeout=0):
+        """Returns the next item, priority lane first, or None if nothing arrives within timeout seconds."""
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                for lane in (self.priority_lane, self.normal_lane):
+                    while lane:
+                        key, token = lane.popleft()
+                        entry = self.entries.get(key)
+                        if entry is not None and entry[0] == token:
+                            self.remove_entry(key)
+                            wait = time.time() - entry[2]
+                            self.average_wait += (wait - self.average_wait) * self.WAIT_SMOOTHING
+                            return entry[1]
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    def cancel(self, key):
+        """Removes a queued key. Returns False if it was not queued."""
+        with self.condition:
+            return self.remove_entry(key) is not None
+
+    def clear(self):
+        with self.condition:
+            self.entries.clear()
+            self.priority_lane.clear()
+            self.normal_lane.clear()
+            self.priority_count = 0
+
+    def remove_entry(self, key):
+        """Caller holds the condition."""
+        entry = self.entries.pop(key, None)
+        if entry is not None and entry[3]:
+            self.priority_count -= 1
+        return entry
+
+    def oldest_wait(self):
+        """Seconds the longest-waiting queued entry has been waiting, 0 if empty."""
+        with self.condition:
+            oldest = None
+            for lane in (self.priority_lane, self.normal_lane):
+                while lane and self.entries.get(lane[0][0], (None,))[0] != lane[0][1]:
+                    lane.popleft() # Drop skipped entries from the front
+                if lane:
+                    enqueued_at = self.entries[lane[0][0]][2]
+                    oldest = enqueued_at if oldest is None else min(oldest, enqueued_at)
+            return time.time() - oldest if oldest is not None else 0.0
+
+    def stats(self):
+        """Depth and wait figures for showing whether checks are falling behind."""
+        return {
+            'depth': len(self),
+            'priority_depth': self.priority_count,
+            'oldest_wait': self.oldest_wait(),
+            'average_wait': self.average_wait,
+        }
+
+
+class HTTPWorkerPool:
+    """Runs HTTP-backend checks on a fixed pool of worker threads.
+
+    The number of threads is the global concurrency limit. A URL whose host already
+    has max_per_host checks in flight is parked and re-queued as soon as one of
+    them finishes, so one slow host cannot occupy every worker.
+
+    Requests to one host are started at most host_rate times a second, and a host
+    that answers 429/503 is left alone for its Retry-After or an exponential backoff.
+    Checks that have to wait for either are delayed, not failed.
+
+    Checks are grouped by document_key(): a monitor submitted while a check of the
+    same document is queued, waiting or running joins that check, and the one
+    downloaded page is extracted for every monitor of the group.
+    """
+    def __init__(self, fetcher, on_completed, on_failed, max_workers=HTTP_MAX_WORKERS, max_per_host=HTTP_MAX_PER_HOST,
+                 metrics=None, host_rate=HTTP_HOST_RATE, parse_pool=None, fingerprint_all=False):
+        self.fetcher = fetcher
+        self.parse_pool = parse_pool # ParseProcessPool for large pages, None = parse in the worker threads
+        self.fingerprint_all = fingerprint_all # Fingerprint every page's content, see URLMonitor.fingerprint_options
+        self.metrics = metrics or CheckMetrics()
+        self.on_completed = on_completed # Called from a worker thread as on_completed(url, content)
+        self.on_failed = on_failed       # Called from a worker thread as on_failed(url, error message or TransportError)
+        self.max_workers = max(1, max_workers)
+        self.max_per_host = max(1, max_per_host)
+        self.queue = CheckQueue() # Of document keys
+        self.lock = threading.Lock()
+        self.pending = set()      # URLs queued, parked or in flight
+        self.groups = {}          # {document key: [monitors sharing its next fetch]}, first one's validators are sent
+        self.fetching = set()     # Document keys whose GET is running
+        self.host_in_flight = {}  # {host: number of checks running}
+        self.host_parked = {}     # {host: deque of document keys waiting for a host slot}
+        self.host_interval = 1.0 / host_rate if host_rate > 0 else 0.0
+        self.host_ready_at = {}   # {host: earliest time.time() the next request may start}
+        self.host_busy_count = {} # {host: consecutive 429/503 answers}
+        self.delayed = []         # [(ready_at, sequence, document key)] heap of checks waiting for host_ready_at
+        self.delay_sequence = itertools.count()
+        self.threads = []
+        self.running = False
+
+    def start(self):
+        self.running = True
+        for i in range(self.max_workers):
+            thread = threading.Thread(target=self.worker, name=f"http-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        rate = f", {1 / self.host_interval:g}/s" if self.host_interval else ""
+        log(f"HTTP worker pool started ({self.max_workers} workers, {self.max_per_host} per host{rate}).")
+
+    def stop(self, timeout=1):
+        """Stops the workers. In-flight GETs finish on their own; their results are ignored once the URL is gone."""
+        self.running = False
+        deadline = time.time() + timeout
+        for thread in self.threads:
+            thread.join(timeout=max(0, deadline - time.time()))
+        self.threads = []
+        with self.lock:
+            self.queue.clear()
+            self.pending.clear()
+            self.groups.clear()
+            self.host_parked.clear()
+            self.delayed = []
+
+    def submit(self, monitor, priority=False):
+        """Queues a check for a monitor. Returns False if one is already pending for its URL.
+
+        A priority submit of a URL that is still queued moves it to the priority lane.
+        """
+        with self.lock:
+            if monitor.url in self.pending:
+                if priority:
+                    self.promote(document_key(monitor.url))
+                return False
+            self.pending.add(monitor.url)
+            self.metrics.begin(monitor.url)
+            self.join_group(monitor, priority)
+        return True
+
+    def join_group(self, monitor, priority):
+        """Adds a monitor to the next check of its document, queueing one if none is pending. Caller holds the lock."""
+        key = document_key(monitor.url)
+        group = self.groups.get(key)
+        if group is None:
+            self.groups[key] = [monitor]
+            self.queue.put(key, priority=priority)
+        else: # Shares the fetch already queued, waiting for its host or running
+            group.append(monitor)
+            if priority:
+                self.promote(key)
+
+    def promote(self, key):
+        """Moves a queued document to the priority lane. Caller holds the lock."""
+        if key in self.queue: # Not if it is parked, delayed or running
+            self.queue.put(key, priority=True)
+
+    def take_group(self, key):
+        """Ends a document's check: returns the monitors still waiting for it, so later submits start a new one."""
+        with self.lock:
+            self.fetching.discard(key)
+            return [monitor for monitor in self.groups.pop(key, []) if monitor.url in self.pending]
+
+    def done(self, url):
+        """Marks a URL's check as fully processed so it can be submitted again."""
+        with self.lock:
+            self.pending.discard(url)
+
+    def cancel(self, url):
+        """Drops a queued or parked URL. Parked copies are skipped via the pending set."""
+        with self.lock:
+            self.pending.discard(url)
+            key = document_key(url)
+            group = self.groups.get(key)
+            if group is not None and key not in self.fetching and not any(m.url in self.pending for m in group):
+                del self.groups[key]
+                self.queue.cancel(key)
+
+    def stats(self):
+        """Queue stats, counting parked and delayed checks as queued."""
+        stats = self.queue.stats()
+        with self.lock:
+            stats['depth'] += sum(len(parked) for parked in self.host_parked.values()) + len(self.delayed)
+        return stats
+
+    def release_delayed(self):
+        """Re-queues delayed checks whose host is ready. Returns the seconds until the next one is."""
+        with self.lock:
+            now = time.time()
+            while self.delayed and self.delayed[0][0] <= now:
+                key = heapq.heappop(self.delayed)[2]
+                if key in self.groups: # Skip cancelled
+                    self.queue.put(key, priority=True)
+            return min(1.0, self.delayed[0][0] - now) if self.delayed else 1.0
+
+    def host_busy(self, host, error):
+        """Backs off from a host that answered 429/503. Called with the lock held."""
+        count = self.host_busy_count.get(host, 0) + 1
+        self.host_busy_count[host] = count
+        delay = error.retry_after if error.retry_after is not None else HOST_BACKOFF_BASE * 2 ** (count - 1)
+        delay = min(delay, HOST_BACKOFF_MAX)
+        self.host_ready_at[host] = max(self.host_ready_at.get(host, 0), time.time() + delay)
+        log(f"{host} answered {error.status_code}, no requests to it for {delay:.0f}s")
+
+    def worker(self):
+        while self.running:
+            key = self.queue.pop(timeout=self.release_delayed())
+            if key is None:
+                continue
+
+            with self.lock:
+                group = self.groups.get(key)
+                if key in self.fetching or group is None:
+                    continue
+                group[:] = [monitor for monitor in group if monitor.url in self.pending]
+                if not group: # Cancelled while queued
+                    del self.groups[key]
+                    continue
+                monitor = group[0]
+                host = monitor.host
+                now = time.time()
+                ready_at = self.host_ready_at.get(host, 0)
+                if ready_at > now: # Rate limit or backoff
+                    heapq.heappush(self.delayed, (ready_at, next(self.delay_sequence), key))
+                    continue
+                if self.host_in_flight.get(host, 0) >= self.max_per_host:
+                    self.host_parked.setdefault(host, collections.deque()).append(key)
+                    continue
+                self.host_in_flight[host] = self.host_in_flight.get(host, 0) + 1
+                if self.host_interval:
+                    self.host_ready_at[host] = now + self.host_interval
+                self.fetching.add(key)
+                # Validators only help if every monitor of the group last saw the same version
+                validators = (monitor.etag, monitor.last_modified)
+                conditional = all((member.etag, member.last_modified) == validators for member in group)
+                scanner = ElementScanner.for_monitors(group) # Stops the download once all their elements are in
+
+            try:
+                monitor.monitored_check_count += 1
+                self.metrics.mark(monitor.url, 'queue_wait')
+                html, new_validators = self.fetcher.fetch(monitor, conditional=conditional, scanner=scanner)
+                if host in self.host_busy_count:
+                    with self.lock:
+                        self.host_busy_count.pop(host, None)
+            except HostBusyError as e:
+                with self.lock:
+                    self.host_busy(host, e)
+                self.fail_group(key, TransportError(f"Host busy: {e}"))
+            except Exception as e:
+                self.fail_group(key, TransportError(str(e)) if is_transport_failure(e) else str(e))
+            else:
+                self.complete_group(key, monitor, html, validators, scanner, new_validators)
+            finally:
+                with self.lock:
+                    self.host_in_flight[host] -= 1
+                    if not self.host_in_flight[host]:
+                        del self.host_in_flight[host]
+                    parked = self.host_parked.get(host)
+                    while parked:
+                        next_key = parked.popleft()
+                        if next_key in self.groups: # Skip cancelled
+                            # It already waited its turn, so it goes ahead of normal checks
+                            self.queue.put(next_key, priority=True)
+                            break
+                    if parked is not None and not parked:
+                        del self.host_parked[host]
+
+    def deliver(self, callback, url, value):
+        """Hands one result to on_completed/on_failed. If that raises, the error is logged
+        and the URL released, so the worker keeps running and the URL is checked again."""
+        try:
+            callback(url, value)
+        except Exception as e:
+            log(f"Error recording the check of {url}: {e!r}")
+            self.done(url)
+
+    def fail_group(self, key, error):
+        for member in self.take_group(key):
+            self.metrics.mark(member.url, 'fetch') # Time until the failure
+            self.deliver(self.on_failed, member.url, error)
+
+    def complete_group(self, key, monitor, html, validators, scanner=None, new_validators=None):
+        """Extracts the fetched page for every monitor of the group from a single parse.
+
+        validators were sent with the request, new_validators came with the page; they
+        are handed on with each extracted result, see ExtractedContent.validators.
+        """
+        truncated = scanner is not None and scanner.stopped_early
+        members = []
+        stale = [] # Joined during the fetch, and the 304 or page prefix does not answer for them
+        for member in self.take_group(key):
+            if member is not monitor:
+                if ((html is NOT_MODIFIED and (member.etag, member.last_modified) != validators)
+                        or (truncated and not scanner.covers(member))):
+                    stale.append(member)
+                    continue
+                member.shared_fetch_count += 1
+            self.metrics.mark(member.url, 'fetch')
+            members.append(member)
+        if stale:
+            with self.lock:
+                for member in stale:
+                    if member.url in self.pending:
+                        self.join_group(member, priority=True)
+
+        results = []
+        if html is NOT_MODIFIED:
+            results = [NOT_MODIFIED] * len(members)
+        elif members:
+            target_sets = [(member.extraction_targets(), bool(member.targets), member.noise_rules,
+                            *member.fingerprint_options(self.fingerprint_all)) for member in members]
+            try:
+                if self.parse_pool is not None and len(html) >= PARSE_OFFLOAD_MIN_SIZE:
+                    results = self.parse_pool.extract(html, target_sets, self.fetcher.total_timeout)
+                else:
+                    results = extract_for_targets(html, target_sets)
+            except Exception as e:
+                results = [str(e) or type(e).__name__] * len(members)
+        for member, content in zip(members, results):
+            if content is not NOT_MODIFIED:
+                self.metrics.mark(member.url, 'parse')
+            if isinstance(content, str) and content is not NOT_MODIFIED: # Error message
+                self.deliver(self.on_failed, member.url, content)
+            else:
+                if content is not NOT_MODIFIED:
+                    content.validators = new_validators
+                self.deliver(self.on_completed, member.url, content)
+
+
+def url_phase(url):
+    """Stable pseudo-random fraction in [0, 1) for a URL."""
+    return int.from_bytes(hashlib.blake2b(url.encode(), digest_size=4).digest(), 'big') / 2**32
+
+
+def phase_offset(monitor, spread=STARTUP_SPREAD):
+    """Seconds to delay a due (never checked or overdue) monitor, within min(interval, spread).
+
+    Derived from its document_key(), so monitors sharing an interval stay spread out
+    and monitors of one document keep the same phase and can share its fetch.
+    """
+    return url_phase(document_key(monitor.url)) * min(monitor.current_interval(), spread)
+
+
+class CheckScheduler:
+    """Min-heap of URLs keyed on their next due time (last_check_time + current_interval()).
+
+    The monitoring thread blocks in wait_for_due() on a condition variable until the
+    earliest entry is due, or until schedule()/remove()/stop() wake it up. Entries
+    superseded by a reschedule or removal stay in the heap and are skipped when popped,
+    so every operation is O(log n).
+    """
+    MAX_WAIT = 600 # Seconds; re-reads the clock at least this often
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.heap = []     # [(due_time, sequence, url)]
+        self.entries = {}  # {url: sequence of its live heap entry}
+        self.sequence = itertools.count()
+        self.stopped = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def reset(self, monitors, spread=STARTUP_SPREAD):
+        """Rebuilds the heap from scratch (O(n)) and re-arms the scheduler.
+
+        Monitors that are already due (never checked, or overdue after a restart) are
+        not all made due at once: each gets its phase_offset().
+        """
+        now = time.time()
+        with self.condition:
+            self.heap = []
+            self.entries = {}
+            for monitor in monitors:
+                if monitor.enabled:
+                    sequence = next(self.sequence)
+                    self.entries[monitor.url] = sequence
+                    due = monitor.last_check_time + monitor.current_interval()
+                    if due <= now:
+                        due = now + phase_offset(monitor, spread)
+                    self.heap.append((due, sequence, monitor.url))
+            heapq.heapify(self.heap)
+            self.stopped = False
+            self.condition.notify_all()
+
+    def schedule(self, url, due_time):
+        """Adds a URL or moves it to a new due time."""
+        with self.condition:
+            sequence = next(self.sequence)
+            self.entries[url] = sequence
+            heapq.heappush(self.heap, (due_time, sequence, url))
+            if len(self.heap) > 2 * len(self.entries) + 64:
+                self.compact()
+            self.condition.notify()
+
+    def schedule_monitor(self, monitor):
+        """Schedules a monitor's next check, or unschedules it if it is disabled.
+
+        A monitor that was never checked (e.g. just added) gets its phase_offset() like
+        in reset(), so adding many URLs at once does not check them all at once.
+        """
+        if monitor.enabled:
+            if monitor.last_check_time:
+                due = monitor.last_check_time + monitor.current_interval()
+            else:
+                due = time.time() + phase_offset(monitor)
+            self.schedule(monitor.url, due)
+        else:
+            self.remove(monitor.url)
+
+    def remove(self, url):
+        with self.condition:
+            if self.entries.pop(url, None) is not None:
+                self.condition.notify()
+
+    def stop(self):
+        """Wakes the waiting thread and makes wait_for_due() return []."""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def compact(self):
+        """Drops superseded entries. Caller holds the condition."""
+        self.heap = [entry for entry in self.heap if self.entries.get(entry[2]) == entry[1]]
+        heapq.heapify(self.heap)
+
+    def wait_for_due(self):
+        """Blocks until at least one URL is due, then pops and returns every due URL.
+
+        A returned URL is no longer scheduled; it is scheduled again once its check
+        has been recorded. Returns [] once stop() has been called.
+        """
+        with self.condition:
+            while not self.stopped:
+                now = time.time()
+                due_urls = []
+                while self.heap and self.heap[0][0] <= now:
+                    due_time, sequence, url = heapq.heappop(self.heap)
+                    if self.entries.get(url) == sequence:
+                        del self.entries[url]
+                        due_urls.append(url)
+                if due_urls:
+                    return due_urls
+
+                timeout = self.heap[0][0] - now if self.heap else self.MAX_WAIT
+                self.condition.wait(min(timeout, self.MAX_WAIT))
+            return []
+
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram of durations in seconds."""
+    def __init__(self):
+        self.bucket_counts = [0] * (len(HISTOGRAM_BUCKETS) + 1) # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(HISTOGRAM_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding quantile q (like histogram_quantile, without interpolation)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(HISTOGRAM_BUCKETS, self.bucket_counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class CheckMetrics:
+    """Per-check stage timings, aggregated into histograms globally and per host.
+
+    A check is timed from the moment it is queued (begin) through one mark() per
+    stage in CHECK_STAGES to finish(); each mark records the time since the previous
+    one. Safe to call from any thread.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}    # {url: (host, last mark time, {stage: seconds})}
+        self.histograms = {}   # {(stage, host): Histogram}; host None is the global histogram
+        self.last_timings = {} # {url: {stage: seconds}} of the last finished check
+        self.results = collections.Counter() # {result: number of finished checks}
+
+    def begin(self, url):
+        with self.lock:
+            host = host_of(url)
+            self.in_flight[url] = (host, time.perf_counter(), {})
+
+    def mark(self, url, stage):
+        """Attributes the time since the previous mark to stage. Ignored if the check was not begun."""
+        with self.lock:
+            entry = self.in_flight.get(url)
+            if entry is None:
+                return
+            host, last_mark, timings = entry
+            now = time.perf_counter()
+            timings[stage] = timings.get(stage, 0.0) + (now - last_mark)
+            self.in_flight[url] = (host, now, timings)
+
+    def finish(self, url, result):
+        """Adds a completed check's stage timings to the histograms. result is one of CHECK_RESULTS."""
+        with self.lock:
+            entry = self.in_flight.pop(url, None)
+            self.results[result] += 1
+            if entry is None:
+                return
+            host, last_mark, timings = entry
+            timings['total'] = sum(timings.values())
+            for stage, seconds in timings.items():
+                for key in ((stage, None), (stage, host)):
+                    histogram = self.histograms.get(key)
+                    if histogram is None:
+                        histogram = self.histograms[key] = Histogram()
+                    histogram.observe(seconds)
+            self.last_timings[url] = timings
+
+    def discard(self, url):
+        with self.lock:
+            self.in_flight.pop(url, None)
+            self.last_timings.pop(url, None)
+
+    def clear_in_flight(self):
+        """Forgets checks abandoned by stopping monitoring."""
+        with self.lock:
+            self.in_flight.clear()
+
+    def summary(self, url=None):
+        """Human-readable timings of a URL's last check, its host and all checks."""
+        def format_histogram(histogram):
+            return (f"n={histogram.count}  mean={histogram.sum / histogram.count * 1000:.1f} ms  "
+                    f"p50<={histogram.quantile(0.5) * 1000:g} ms  p99<={histogram.quantile(0.99) * 1000:g} ms")
+
+        sections = [("All hosts", None)]
+        lines = []
+        with self.lock:
+            if url:
+                host = host_of(url)
+                sections.insert(0, (f"Host {host}", host))
+                timings = self.last_timings.get(url)
+                lines.append(f"Last check of {url}:")
+                if timings:
+                    lines.extend(f"  {stage:<11} {timings[stage] * 1000:9.1f} ms"
+                                 for stage in CHECK_STAGES + ['total'] if stage in timings)
+                else:
+                    lines.append("  not checked since monitoring started")
+            for title, key in sections:
+                lines.append(f"{title}:")
+                for stage in CHECK_STAGES + ['total']:
+                    histogram = self.histograms.get((stage, key))
+                    if histogram:
+                        lines.append(f"  {stage:<11} {format_histogram(histogram)}")
+        return "\n".join(lines)
+
+    def render(self):
+        """Histograms and result counters in the Prometheus text exposition format."""
+        lines = ["# HELP url_monitor_check_stage_seconds Time spent per check stage, all hosts.",
+                 "# TYPE url_monitor_check_stage_seconds histogram"]
+        host_lines = ["# HELP url_monitor_host_check_stage_seconds Time spent per check stage, per host.",
+                      "# TYPE url_monitor_host_check_stage_seconds histogram"]
+        with self.lock:
+            for (stage, host), histogram in sorted(self.histograms.items(), key=lambda item: (item[0][1] or "", item[0][0])):
+                if host is None:
+                    name, labels, target = "url_monitor_check_stage_seconds", f'stage="{stage}"', lines
+                else:
+                    name, labels, target = "url_monitor_host_check_stage_seconds", f'stage="{stage}",host="{prometheus_escape(host)}"', host_lines
+                cumulative = 0
+                for bound, bucket_count in zip(list(HISTOGRAM_BUCKETS) + ['+Inf'], histogram.bucket_counts):
+                    cumulative += bucket_count
+                    target.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                target.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+                target.append(f"{name}_count{{{labels}}} {histogram.count}")
+            lines.extend(host_lines)
+            lines.append("# HELP url_monitor_checks_total Finished checks by result.")
+            lines.append("# TYPE url_monitor_checks_total counter")
+            for result in CHECK_RESULTS:
+                lines.append(f'url_monitor_checks_total{{result="{result}"}} {self.results[result]}')
+        return lines
+
+
+def prometheus_escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsServer:
+    """Serves MonitorEngine.render_metrics() as text on http://127.0.0.1:<port>/metrics."""
+    def __init__(self, engine, port):
+        self.engine = engine
+        self.port = port
+        self.server = None
+
+    def start(self):
+        import http.server
+        engine = self.engine
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = engine.render_metrics().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # One line per scrape is noise
+
+        try:
+            self.server = http.server.ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        except OSError as e:
+            log(f"Could not start metrics endpoint on port {self.port}: {e}")
+            return False
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+        log(f"Metrics available on http://127.0.0.1:{self.port}/metrics")
+        return True
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class HostCircuitBreaker:
+    """Skips hosts whose checks keep failing, so they stop tying up workers and WebViews.
+
+    After max_failures consecutive failed checks a host is open: its checks are
+    skipped for cooldown seconds. Then a single trial check is let through; success
+    closes the breaker, failure re-opens it with a doubled cooldown (at most
+    BREAKER_COOLDOWN_MAX). Failures of checks that were already queued or running
+    when the circuit opened are counted but do not extend the cooldown. Safe to
+    call from any thread.
+    """
+    def __init__(self, max_failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN, trial_timeout=CHECK_TIMEOUT):
+        self.max_failures = max_failures # 0 disables the breaker
+        self.cooldown = cooldown
+        self.trial_timeout = trial_timeout # A trial without result for longer than this is given up
+        self.lock = threading.Lock()
+        self.hosts = {} # {host: {'failures', 'open_until', 'cooldown', 'trial_deadline', 'trial_url'}} of failing hosts only
+        self.skipped = 0
+
+    def allow(self, host, url=None):
+        """Returns (True, None) if a check may run now, else (False, time.time() to try again).
+        A check of an open host that is let through is its trial, see record_failure."""
+        if not self.max_failures:
+            return True, None
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is None or not state['open_until']:
+                return True, None
+            now = time.time()
+            if now < state['open_until']:
+                self.skipped += 1
+                return False, state['open_until']
+            if now < state['trial_deadline']: # Another URL of the host is the trial
+                self.skipped += 1
+                return False, now + min(state['cooldown'], 60)
+            state['trial_deadline'] = now + self.trial_timeout
+            state['trial_url'] = url
+            return True, None
+
+    def record_success(self, host):
+        with self.lock:
+            if self.hosts.pop(host, None):
+                log(f"Circuit closed for {host}")
+
+    def record_failure(self, host, url=None):
+        """Counts a failed check. url tells the trial apart from checks that were in flight when the circuit opened."""
+        if not self.max_failures:
+            return
+        with self.lock:
+            state = self.hosts.setdefault(host, {'failures': 0, 'open_until': 0, 'cooldown': self.cooldown,
+                                                 'trial_deadline': 0, 'trial_url': None})
+            state['failures'] += 1
+            now = time.time()
+            if state['open_until']:
+                if not state['trial_deadline'] or (url is not None and url != state['trial_url']):
+                    return # Started before the circuit opened: the cooldown already covers it
+                state['cooldown'] = min(state['cooldown'] * 2, BREAKER_COOLDOWN_MAX) # The trial failed
+            elif state['failures'] < self.max_failures:
+                return
+            state['open_until'] = now + state['cooldown']
+            state['trial_deadline'] = 0
+            state['trial_url'] = None
+            log(f"Circuit open for {host} after {state['failures']} failures, skipping it for {state['cooldown']:.0f}s")
+
+    def open_hosts(self):
+        with self.lock:
+            return [host for host, state in self.hosts.items() if state['open_until']]
+
+
+def load_settings():
+    """Loads settings from a JSON file, falling back to DEFAULT_SETTINGS for missing keys."""
+    settings = dict(DEFAULT_SETTINGS)
+    if os.path.exists(SETTINGS_FILE):
+        try:
+            with open(SETTINGS_FILE, 'r') as f:
+                data = json.load(f)
+            settings.update({key: data[key] for key in DEFAULT_SETTINGS if key in data})
+            log(f"Loaded settings from {SETTINGS_FILE}")
+        except Exception as e:
+            log(f"Error loading settings from {SETTINGS_FILE}: {e}")
+    return settings
+
+
+def save_settings(settings):
+    """Saves settings to a JSON file."""
+    try:
+        with open(SETTINGS_FILE, 'w') as f:
+            json.dump(settings, f, indent=2)
+    except Exception as e:
+        log(f"Error saving settings to {SETTINGS_FILE}: {e}")
+
+
+def normalize_url(url):
+    """Strips whitespace and adds http:// if no scheme is given."""
+    url = url.strip()
+    if not url.startswith('http://') and not url.startswith('https://'):
+        url = 'http://' + url # Default to http
+    return url
+
+
+class MonitorEngine:
+    """Runs the monitors: schedules due checks, executes HTTP checks, detects changes and saves state.
+
+    A front end plugs in through callbacks:
+      on_status(url, status)   after every recorded result or failure
+      on_change(url)           when a change is detected, before on_status
+      deliver_result(url, content, error)
+                               hands HTTP worker results to the thread that should record
+                               them (the GUI uses its UI thread); by default they are
+                               recorded directly on the worker thread
+      webview_dispatch(monitor, priority)
+                               queues a check for a webview-backend monitor and returns
+                               False if one is already pending; without it (headless)
+                               those monitors are skipped; the front end calls
+                               metrics.begin() when it queues one and
+                               metrics.mark() for the queue_wait, fetch and parse stages
+    """
+    def __init__(self, settings=None, on_status=None, on_change=None, deliver_result=None, webview_dispatch=None):
+        self.settings = settings if settings is not None else load_settings()
+        self.monitors = {}  # {url: URLMonitor}
+        self.documents = {} # {document_key(): set of URLs}, for sharing fetches between monitors of one document
+        self.fingerprints = FingerprintIndex() # Content fingerprints of all monitors, for similarity queries
+        self.store = None   # MonitorStore, opened by load()
+        self.scheduler = CheckScheduler()
+        self.http_fetcher = HTTPFetcher() # Pooled session shared by all HTTP-backend checks
+        self.snapshot_store = SnapshotStore()
+        self.history = None # HistoryStore, opened by load() unless the history_max_entries setting is 0
+        self.http_pool = None # HTTPWorkerPool, created by start()
+        self.parse_pool = None # ParseProcessPool, created by start() if the parse_processes setting is set
+        self.metrics = CheckMetrics() # Stage timings of every check
+        self.breaker = HostCircuitBreaker(0) # Replaced by start() with the configured limits
+        self.metrics_server = None # MetricsServer, started by start() if the metrics_port setting is set
+        self.scheduler_thread = None
+        self.running = False
+        self.lock = threading.RLock() # Serializes result recording when it happens on worker threads
+        self.on_status = on_status or (lambda url, status: None)
+        self.on_change = on_change or (lambda url: None)
+        self.deliver_result = deliver_result or self.record_http_result
+        self.webview_dispatch = webview_dispatch
+
+    # --- Storage ---
+
+    def load(self):
+        """Opens the monitor store, migrating an old pickle file if present, and loads every URL."""
+        self.snapshot_store.start()
+        try:
+            self.store = MonitorStore()
+        except Exception as e:
+            log(f"Error opening {DATA_FILE}, changes will not be saved: {e}")
+            return self.monitors
+
+        try:
+            self.store.migrate_from_pickle()
+        except Exception as e:
+            log(f"Error migrating data from {LEGACY_DATA_FILE}: {e}")
+
+        try:
+            self.monitors = self.store.load_all()
+            log(f"Loaded {len(self.monitors)} URLs from {DATA_FILE}")
+        except Exception as e:
+            log(f"Error loading data from {DATA_FILE}: {e}")
+            self.monitors = {}
+        self.documents = {}
+        self.fingerprints = FingerprintIndex()
+        for url, monitor in self.monitors.items():
+            self.documents.setdefault(document_key(url), set()).add(url)
+            self.fingerprints.update(monitor)
+        self.store.start()
+        if self.settings['history_max_entries'] > 0:
+            try:
+                self.history = HistoryStore(HISTORY_FILE, self.settings['history_max_entries'],
+                                            self.settings['history_max_days'])
+                self.history.start()
+            except Exception as e:
+                log(f"Error opening {HISTORY_FILE}, changes will not be recorded: {e}")
+        return self.monitors
+
+    def save_monitor(self, monitor):
+        """Queues one monitor's state for writing. Only that row is rewritten."""
+        if not self.store:
+            return
+        try:
+            self.store.save(monitor)
+        except Exception as e:
+            log(f"Error saving data for {monitor.url}: {e}")
+
+    def close(self, save_all=False):
+        """Stops monitoring and waits until pending writes are on disk."""
+        self.stop()
+        if self.store:
+            if save_all: # Also persists counters that change without a save, like check_count
+                for monitor in list(self.monitors.values()):
+                    self.save_monitor(monitor)
+            self.store.close()
+            log(f"Saved {len(self.monitors)} URLs to {DATA_FILE}")
+        self.snapshot_store.close()
+        if self.history:
+            self.history.close()
+            self.history = None
+        self.http_fetcher.close()
+
+    # --- Monitor list ---
+
+    def add_monitor(self, monitor):
+        self.monitors[monitor.url] = monitor
+        self.documents.setdefault(document_key(monitor.url), set()).add(monitor.url)
+        with self.lock:
+            self.fingerprints.update(monitor)
+        self.scheduler.schedule_monitor(monitor)
+        self.save_monitor(monitor)
+
+    def update_monitor(self, monitor):
+        """Reschedules and saves a monitor after its settings were edited."""
+        self.scheduler.schedule_monitor(monitor)
+        self.save_monitor(monitor)
+
+    def remove_monitor(self, url):
+        if self.http_pool:
+            self.http_pool.cancel(url)
+        self.scheduler.remove(url)
+        self.snapshot_store.delete(url)
+        if self.history:
+            self.history.delete(url)
+        self.metrics.discard(url)
+        self.monitors.pop(url, None)
+        with self.lock:
+            self.fingerprints.remove(url)
+        key = document_key(url)
+        urls = self.documents.get(key)
+        if urls is not None:
+            urls.discard(url)
+            if not urls:
+                del self.documents[key]
+        if self.store:
+            self.store.delete(url)
+
+    # --- Running ---
+
+    def start(self):
+        """Starts the HTTP worker pool and the scheduler thread. Returns False if already running."""
+        if self.scheduler_thread and self.scheduler_thread.is_alive():
+            return False
+        self.running = True
+        self.http_fetcher.connect_timeout = self.settings['http_connect_timeout']
+        self.http_fetcher.read_timeout = self.settings['http_read_timeout']
+        self.http_fetcher.total_timeout = self.settings['check_timeout']
+        self.http_fetcher.max_body_size = self.settings['http_max_body_mb'] << 20
+        if self.history: # Retention is applied by the next compaction
+            self.history.max_entries = self.settings['history_max_entries']
+            self.history.max_days = self.settings['history_max_days']
+        self.breaker = HostCircuitBreaker(self.settings['breaker_failures'], self.settings['breaker_cooldown'],
+                                          trial_timeout=self.settings['check_timeout'] * 2)
+        self.scheduler.reset(self.monitors.values())
+        if self.settings['parse_processes'] > 0:
+            self.parse_pool = ParseProcessPool(self.settings['parse_processes'])
+        self.http_pool = HTTPWorkerPool(
+            self.http_fetcher,
+            on_completed=lambda url, content: self.deliver_result(url, content, None),
+            on_failed=lambda url, error: self.deliver_result(url, None, error),
+            max_workers=self.settings['http_max_workers'],
+            max_per_host=self.settings['http_max_per_host'],
+            metrics=self.metrics,
+            host_rate=self.settings['http_host_rate'],
+            parse_pool=self.parse_pool,
+            fingerprint_all=self.settings['similarity_fingerprints'])
+        self.http_pool.start()
+        if self.settings['metrics_port']:
+            self.metrics_server = MetricsServer(self, self.settings['metrics_port'])
+            self.metrics_server.start()
+        self.scheduler_thread = threading.Thread(target=self.scheduler_loop, name="scheduler", daemon=True)
+        self.scheduler_thread.start()
+        return True
+
+    def stop(self, timeout=5):
+        """Stops the scheduler thread and worker pool. Returns False if the thread did not exit in time."""
+        self.running = False
+        self.scheduler.stop() # Wake the scheduler thread so it can exit
+        stopped = True
+        if self.scheduler_thread and self.scheduler_thread.is_alive():
+            self.scheduler_thread.join(timeout=timeout)
+            stopped = not self.scheduler_thread.is_alive()
+        if self.http_pool:
+            self.http_pool.stop()
+        if self.parse_pool:
+            self.parse_pool.stop()
+            self.parse_pool = None
+        if self.metrics_server:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        self.metrics.clear_in_flight()
+        return stopped
+
+    def scheduler_loop(self):
+        """Background thread that dispatches checks as the scheduler reports them due."""
+        log("Monitor thread started.")
+        while self.running:
+            # Sleeps until the earliest monitor is due or the schedule changes
+            urls_due_for_check = self.scheduler.wait_for_due()
+
+            for url in urls_due_for_check:
+                 monitor = self.monitors.get(url)
+                 if not monitor or not monitor.should_check():
+                     if monitor:
+                         self.scheduler.schedule_monitor(monitor) # Settings changed since it was scheduled
+                     continue
+                 if self.dispatch_check(monitor):
+                     log(f"Added {url} to {monitor.fetch_backend} check queue.")
+                     self.dispatch_document_siblings(monitor)
+
+            if urls_due_for_check:
+                 log(f"Dispatched {len(urls_due_for_check)} due checks. Scheduled: {len(self.scheduler)}")
+
+        log("Monitor thread stopping cleanly.")
+
+    def dispatch_check(self, monitor, priority=False):
+        """Queues a check on the monitor's fetch backend. Safe to call from any thread.
+
+        Returns False if a check for the URL is already queued or in flight, if
+        its backend is not available here, or if its host's circuit is open (then
+        it is rescheduled for when the host may be tried again). Priority checks
+        (Check Now) ignore the circuit breaker.
+        """
+        if not priority:
+            allowed, retry_at = self.breaker.allow(monitor.host, monitor.url)
+            if not allowed:
+                log(f"Skipping {monitor.url}: circuit open for its host")
+                self.scheduler.schedule(monitor.url, retry_at)
+                return False
+        if monitor.fetch_backend == FETCH_BACKEND_HTTP:
+            queued = self.http_pool is not None and self.http_pool.submit(monitor, priority=priority)
+        elif self.webview_dispatch:
+            queued = self.webview_dispatch(monitor, priority)
+        else:
+            log(f"Skipping {monitor.url}: the webview fetch backend needs the GUI.")
+            queued = False
+        if queued:
+            monitor.check_count += 1
+        return queued
+
+    def dispatch_document_siblings(self, monitor):
+        """Pulls forward the other HTTP monitors of the same document that are due within
+        the shared_fetch_window setting, so they join this check instead of fetching again.
+
+        A monitor is pulled forward by at most half its own interval, so sharing a page
+        with a faster monitor does not make it check much more often than configured.
+        """
+        window = self.settings['shared_fetch_window']
+        if monitor.fetch_backend != FETCH_BACKEND_HTTP or window <= 0:
+            return
+        urls = self.documents.get(document_key(monitor.url))
+        if not urls or len(urls) < 2:
+            return
+        now = time.time()
+        for url in tuple(urls): # The GUI thread may add or remove monitors meanwhile
+            sibling = self.monitors.get(url)
+            if url == monitor.url or sibling is None or not sibling.enabled or sibling.fetch_backend != FETCH_BACKEND_HTTP:
+                continue
+            interval = sibling.current_interval()
+            if sibling.last_check_time + interval > now + min(window, interval / 2):
+                continue
+            self.scheduler.remove(url) # Rescheduled once this check is recorded
+            if self.dispatch_check(sibling):
+                log(f"Added {url} to the shared fetch of {monitor.url}.")
+
+    def check_now(self, url):
+        """Queues a URL in the priority lane, ahead of scheduled checks."""
+        monitor = self.monitors.get(url)
+        if not monitor or not self.running:
+            return False
+        self.scheduler.remove(url) # Rescheduled once this check is recorded
+        return self.dispatch_check(monitor, priority=True)
+
+    def queue_stats(self):
+        return self.http_pool.stats() if self.http_pool else None
+
+    def render_metrics(self):
+        """Prometheus text exposition of the check timings, counters and queue state."""
+        monitors = list(self.monitors.values())
+        lines = self.metrics.render()
+        for name, help_text, attribute in (
+                ("url_monitor_dispatched_checks_total", "Checks queued by the scheduler or Check Now.", 'check_count'),
+                ("url_monitor_loads_total", "Page loads/GETs actually made.", 'monitored_check_count'),
+                ("url_monitor_not_modified_total", "HTTP checks answered with 304.", 'conditional_hit_count'),
+                ("url_monitor_full_fetches_total", "HTTP checks that downloaded the page.", 'conditional_miss_count'),
+                ("url_monitor_shared_fetches_total", "HTTP checks served by another monitor's fetch of the same document "
+                                                     "(requests saved).", 'shared_fetch_count')):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {sum(getattr(monitor, attribute) for monitor in monitors)}")
+        lines.append("# HELP url_monitor_open_circuits Hosts currently skipped by the circuit breaker.")
+        lines.append("# TYPE url_monitor_open_circuits gauge")
+        lines.append(f"url_monitor_open_circuits {len(self.breaker.open_hosts())}")
+        lines.append("# HELP url_monitor_circuit_skips_total Checks skipped because their host's circuit was open.")
+        lines.append("# TYPE url_monitor_circuit_skips_total counter")
+        lines.append(f"url_monitor_circuit_skips_total {self.breaker.skipped}")
+        lines.append("# HELP url_monitor_monitors Monitored URLs.")
+        lines.append("# TYPE url_monitor_monitors gauge")
+        lines.append(f"url_monitor_monitors {len(monitors)}")
+        stats = self.queue_stats()
+        if stats:
+            for key in ('depth', 'oldest_wait', 'average_wait'):
+                lines.append(f"# TYPE url_monitor_http_queue_{key} gauge")
+                lines.append(f"url_monitor_http_queue_{key} {stats[key]}")
+        return "\n".join(lines) + "\n"
+
+    # --- Similarity queries (over the fingerprints of all monitors at once) ---
+
+    def changed_today(self, min_percent=0):
+        """[(url, percent)] of monitors whose content changed by more than min_percent today, largest first."""
+        with self.lock:
+            changed = self.fingerprints.changed_on(local_day(time.time()), min_percent / 100)
+        return [(url, difference * 100) for url, difference in changed]
+
+    def similar_monitors(self, url, max_percent=0):
+        """[(url, percent)] of other monitors whose content differs from url's by at most max_percent."""
+        with self.lock:
+            monitor = self.monitors.get(url)
+            if monitor is None or monitor.fingerprint is None:
+                return []
+            similar = self.fingerprints.similar_to(monitor.fingerprint, max_percent / 100)
+        return [(other, difference * 100) for other, difference in similar if other != url]
+
+    def duplicate_content(self):
+        """Groups of URLs that currently show the same content (equal fingerprints)."""
+        with self.lock:
+            return self.fingerprints.duplicates()
+
+    # --- Results (shared by all fetch backends) ---
+
+    def record_http_result(self, url, content, error):
+        """Records one HTTP worker result on the calling thread."""
+        if self.http_pool:
+            self.http_pool.done(url)
+        if error is None:
+            self.record_check_result(url, content)
+        else:
+            log(f"HTTP check failed for {url} - Error: {error}")
+            self.record_check_failure(url, str(error), transport=isinstance(error, TransportError))
+
+    def record_check_result(self, url, element_content):
+        """Compares freshly extracted content (None = element not found) with the stored state.
+
+        element_content is a {name: text or None} dict for monitors with named targets;
+        those count as not found only if none of the targets is on the page. HTTP
+        checks deliver an ExtractedContent, already filtered, digested and fingerprinted
+        off this thread.
+
+        Monitors with min_change_percent only report a change when the fingerprints say
+        at least that much of the content changed since the last reported change: the
+        64-bit simhash() of the new content is compared with the one of the last reported
+        content, so small changes add up. See fingerprint_difference for what the estimate
+        means; any change to a text of a few words counts as large. Fingerprints are only
+        computed when asked for, see URLMonitor.fingerprint_options.
+        """
+        monitor = self.monitors.get(url)
+        if (monitor is not None and element_content is not NOT_MODIFIED
+                and not isinstance(element_content, ExtractedContent)): # WebView text
+            element_content = ExtractedContent(element_content, monitor.noise_filter(),
+                                               *monitor.fingerprint_options(self.settings['similarity_fingerprints']))
+        with self.lock:
+            if url not in self.monitors or self.monitors[url] is not monitor:
+                 log(f"Check completed for unknown or deleted URL: {url}")
+                 return
+
+            self.metrics.mark(url, 'deliver')
+            first_check = not monitor.last_check_time # Its "change" is just the baseline
+            if element_content is not NOT_MODIFIED and element_content.validators is not None:
+                # Only now, so a page whose extraction failed is downloaded again next time
+                monitor.etag, monitor.last_modified = element_content.validators
+            previous_change_time = monitor.last_change_time
+            monitor.last_check_time = time.time()
+
+            if element_content is NOT_MODIFIED: # 304: same page as last time, so same content
+                log(f"Not modified (304) for {url}")
+                status = "Not modified (304)"
+                result = 'not_modified'
+
+            elif element_content.text is None: # Element not found
+                log(f"Element {monitor.describe_targets()} not found on {url}")
+                if element_content.target_digests is not None:
+                    monitor.update_target_digests(element_content.target_digests)
+                if monitor.last_digest is not None:
+                    log(f"Change detected (element disappeared) for {url}")
+                    monitor.last_digest = None # Element has disappeared
+                    monitor.set_fingerprint(None, monitor.last_check_time)
+                    monitor.last_change_time = monitor.last_check_time # Timestamp of the change
+                    status = "Change Detected: Element Disappeared!"
+                    result = 'changed'
+                    self.snapshot_store.delete(url)
+                    self.record_history(monitor, None)
+                    self.on_change(url) # Trigger notification
+                else:
+                    status = "Element not found"
+                    result = 'not_found'
+
+            else:
+                digest = element_content.digest
+                changed_targets = []
+                if element_content.target_digests is not None:
+                    changed_targets = monitor.update_target_digests(element_content.target_digests)
+                difference = None # Estimated fraction changed, for monitors with a minimum
+                if (monitor.min_change_percent and monitor.last_digest is not None and monitor.last_digest != digest
+                        and monitor.fingerprint is not None and element_content.fingerprint is not None):
+                    difference = fingerprint_difference(bin(monitor.fingerprint ^ element_content.fingerprint).count('1'))
+                if difference is not None and difference * 100 < monitor.min_change_percent:
+                    # Compared with the last reported content, so small changes still add up
+                    log(f"Minor change ({difference:.0%}) for {url}")
+                    status = f"Ok (minor change, {difference:.0%})"
+                    result = 'unchanged'
+                elif monitor.last_digest != digest:
+                    log(f"Change detected for {url}")
+                    monitor.last_digest = digest # Only the fingerprint of the NEW content is kept in memory
+                    # None if not asked for (or extracted before the last change): nothing stale is kept
+                    monitor.set_fingerprint(element_content.fingerprint, monitor.last_check_time)
+                    monitor.last_change_time = monitor.last_check_time # Timestamp of the change
+                    status = f"Change Detected: {', '.join(changed_targets)}" if changed_targets else "Change Detected!"
+                    result = 'changed'
+                    if self.settings['store_snapshots']: # Compressed and written by the snapshot writer thread
+                        self.snapshot_store.save(url, element_content.text)
+                    self.record_history(monitor, element_content.text)
+                    self.on_change(url) # Trigger notification
+                else:
+                    log(f"No change detected for {url}")
+                    status = "Ok"
+                    result = 'unchanged'
+                    if monitor.fingerprint is None: # Data from before fingerprints
+                        monitor.set_fingerprint(element_content.fingerprint, monitor.last_check_time)
+            self.fingerprints.update(monitor)
+            self.metrics.mark(url, 'compare')
+            if not first_check:
+                monitor.adapt_interval(result == 'changed', previous_change_time, monitor.last_check_time)
+            self.scheduler.schedule_monitor(monitor)
+
+            self.save_monitor(monitor) # Save state after a check completes
+            self.metrics.mark(url, 'persist')
+        self.metrics.finish(url, result)
+        self.breaker.record_success(host_of(url))
+        # Always report the FINAL determined status, overwriting "Loading..."/"Processing..."
+        self.on_status(url, status)
+
+    def record_history(self, monitor, text):
+        """Adds a change to the history; named targets are stored one per line so diffs show which changed."""
+        if not self.history:
+            return
+        if text is not None and monitor.targets:
+            text = json.dumps(json.loads(text), ensure_ascii=False, sort_keys=True, indent=0)
+        self.history.record(monitor.url, monitor.last_check_time, text)
+
+    def record_check_failure(self, url, error_desc, status=None, transport=False):
+        """Records a failed load/fetch attempt for a URL. The next attempt waits a full interval.
+
+        Only transport failures (see TransportError) count towards opening the host's
+        circuit; a monitor's own problem, like a bad selector, says nothing about the host.
+        """
+        with self.lock:
+            if url not in self.monitors:
+                 log(f"Load failed for unknown or deleted URL: {url}")
+                 return
+            self.metrics.mark(url, 'deliver')
+            monitor = self.monitors[url]
+            monitor.last_check_time = time.time() # Record the attempt time
+            self.scheduler.schedule_monitor(monitor)
+            if status is None:
+                status = f"Load Failed: {error_desc[:100]}..." # Truncate error message
+            self.save_monitor(monitor) # Save state after an attempt
+            self.metrics.mark(url, 'persist')
+        self.metrics.finish(url, 'failed')
+        if transport:
+            self.breaker.record_failure(host_of(url), url)
+        self.on_status(url, status)
+
+
+# --- Headless daemon / CLI ---
+
+def format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)) if timestamp else "Never"
+
+
+def run_daemon(engine):
+    """Monitors until SIGINT/SIGTERM."""
+    stop_requested = threading.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda signum, frame: stop_requested.set())
+
+    engine.start()
+    log(f"Monitoring {len(engine.monitors)} URLs. Press Ctrl+C to stop.")
+    while not stop_requested.wait(1):
+        pass
+    log("Stopping...")
+    engine.close(save_all=True)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog="python -m monitor_engine",
+        description="Headless URL change monitor. Uses the same data files as the GUI; "
+                    "only URLs on the http fetch backend are checked.")
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help="monitor until interrupted (default)")
+    run_parser.add_argument('--metrics-port', type=int, default=None,
+                            help="serve Prometheus metrics on 127.0.0.1:PORT/metrics (default: metrics_port setting)")
+    run_parser.add_argument('--fingerprints', action='store_true', default=None,
+                            help="fingerprint every URL's content for 'changed' and 'similar' (default: "
+                                 "similarity_fingerprints setting; otherwise only URLs with --min-change)")
+    commands.add_parser('list', help="show the monitored URLs")
+    add_parser = commands.add_parser('add', help="add or update a URL")
+    add_parser.add_argument('url')
+    add_parser.add_argument('--interval', type=int, default=3600, help="seconds between checks (default: 3600)")
+    add_parser.add_argument('--tag', default="", help="tag of the monitored element, e.g. div")
+    add_parser.add_argument('--selector-type', choices=['id', 'class'], default="")
+    add_parser.add_argument('--selector-value', default="")
+    add_parser.add_argument('--target', action='append', default=[], metavar="'NAME = SELECTOR'",
+                            help="named CSS target, or XPath with an xpath: prefix; repeat for several "
+                                 "targets extracted from one fetch (replaces --tag/--selector-*)")
+    add_parser.add_argument('--noise', action='append', default=[], metavar="RULE",
+                            help="content that does not count as a change: 'regex: PATTERN' (removed), "
+                                 "'ignore: SELECTOR' (elements left out) or 'whitespace' (runs collapsed); repeatable")
+    add_parser.add_argument('--min-change', type=int, default=0, metavar="PERCENT",
+                            help="only report changes of at least this much of the content, estimated "
+                                 "from similarity fingerprints (default: 0, every change)")
+    add_parser.add_argument('--fetch', choices=FETCH_BACKENDS, default=FETCH_BACKEND_HTTP)
+    add_parser.add_argument('--adaptive', action='store_true',
+                            help="adjust the interval to how often the content changes, starting from --interval")
+    add_parser.add_argument('--min-interval', type=int, default=ADAPTIVE_MIN_INTERVAL,
+                            help=f"shortest adaptive interval (default: {ADAPTIVE_MIN_INTERVAL})")
+    add_parser.add_argument('--max-interval', type=int, default=ADAPTIVE_MAX_INTERVAL,
+                            help=f"longest adaptive interval (default: {ADAPTIVE_MAX_INTERVAL})")
+    history_parser = commands.add_parser('history', help="show what changed and when")
+    history_parser.add_argument('url')
+    history_parser.add_argument('--limit', type=int, default=10, help="changes per page (default: 10)")
+    history_parser.add_argument('--before', type=int, default=None, metavar='ID',
+                                help="show changes older than entry ID (the next page)")
+    history_parser.add_argument('--version', type=int, default=None, metavar='ID',
+                                help="print the full text as of entry ID instead")
+    changed_parser = commands.add_parser('changed', help="show the pages whose content changed today "
+                                                         "(URLs with fingerprints, see run --fingerprints)")
+    changed_parser.add_argument('--min-percent', type=float, default=0,
+                                help="only pages that changed by more than this (default: 0)")
+    similar_parser = commands.add_parser('similar', help="show URLs with the same or similar content "
+                                                         "(URLs with fingerprints, see run --fingerprints)")
+    similar_parser.add_argument('url', nargs='?', help="list the URLs similar to this one (default: all groups "
+                                                       "of URLs showing the same content)")
+    similar_parser.add_argument('--max-percent', type=float, default=10,
+                                help="with URL, the largest difference still shown (default: 10)")
+    remove_parser = commands.add_parser('remove', help="stop monitoring a URL")
+    remove_parser.add_argument('url')
+    args = parser.parse_args(argv)
+
+    engine = MonitorEngine(on_status=lambda url, status: log(f"{url}: {status}"),
+                           on_change=lambda url: log(f"CHANGE DETECTED: {url}"))
+    engine.load()
+    command = args.command or 'run'
+
+    if command == 'run':
+        if getattr(args, 'metrics_port', None) is not None: # Not set when no command is given
+            engine.settings['metrics_port'] = args.metrics_port
+        if getattr(args, 'fingerprints', None):
+            engine.settings['similarity_fingerprints'] = True
+        run_daemon(engine)
+        return 0
+
+    if command == 'list':
+        for monitor in engine.monitors.values():
+            if monitor.targets:
+                element = "; ".join(format_target(target) for target in monitor.targets)
+            else:
+                element = monitor.describe_targets()
+            interval = f"{monitor.interval}s (adaptive, now {monitor.effective_interval:.0f}s)" if monitor.adaptive else f"{monitor.interval}s"
+            shared = f"  shared fetches: {monitor.shared_fetch_count}" if monitor.shared_fetch_count else ""
+            noise = f"  noise: {'; '.join(format_noise_rule(rule) for rule in monitor.noise_rules)}" if monitor.noise_rules else ""
+            noise += f"  min change: {monitor.min_change_percent}%" if monitor.min_change_percent else ""
+            log(f"{monitor.url}  every {interval}  {element}{noise}  [{monitor.fetch_backend}]{shared}"
+                f"  last check: {format_time(monitor.last_check_time)}  last change: {format_time(monitor.last_change_time)}")
+
+    elif command == 'add':
+        if bool(args.tag) != bool(args.selector_type) or bool(args.tag) != bool(args.selector_value):
+            parser.error("--tag, --selector-type and --selector-value must be given together")
+        if args.min_interval > args.max_interval:
+            parser.error("--min-interval must not be larger than --max-interval")
+        if args.target and args.tag:
+            parser.error("use either --target or --tag/--selector-type/--selector-value")
+        if not 0 <= args.min_change <= 100:
+            parser.error("--min-change must be between 0 and 100")
+        try:
+            targets = parse_targets("\n".join(args.target))
+            noise_rules = parse_noise_rules("\n".join(args.noise))
+        except ValueError as e:
+            parser.error(str(e))
+        url = normalize_url(args.url)
+        monitor = engine.monitors.get(url) or URLMonitor(url)
+        monitor.interval = args.interval
+        monitor.tag = args.tag
+        monitor.selector_type = args.selector_type
+        monitor.selector_value = args.selector_value
+        monitor.targets = targets
+        monitor.noise_rules = noise_rules
+        monitor.min_change_percent = args.min_change
+        monitor.fetch_backend = args.fetch
+        monitor.adaptive = args.adaptive
+        monitor.min_interval = args.min_interval
+        monitor.max_interval = args.max_interval
+        monitor.reset_adaptation()
+        monitor.enabled = True
+        monitor.reset_validators()
+        engine.add_monitor(monitor)
+        log(f"URL saved: {url}")
+
+    elif command == 'history':
+        url = normalize_url(args.url)
+        if not engine.history:
+            log("Error: the change history is turned off (history_max_entries is 0)")
+            engine.close()
+            return 1
+        if args.version is not None:
+            text = engine.history.version(url, args.version)
+            log(text if text is not None else f"No content as of entry {args.version}")
+        else:
+            entries = engine.history.page(url, before=args.before, limit=args.limit)
+            for entry in entries:
+                log("\n".join(format_history_entry(entry)))
+            if len(entries) == args.limit:
+                log(f"More: --before {entries[-1]['id']}")
+
+    elif command == 'changed':
+        changed = engine.changed_today(args.min_percent)
+        for url, percent in changed:
+            log(f"{percent:5.1f}%  {url}")
+        log(f"{len(changed)} pages changed today" + (f" by more than {args.min_percent:g}%" if args.min_percent else ""))
+
+    elif command == 'similar':
+        if args.url:
+            url = normalize_url(args.url)
+            for other, percent in engine.similar_monitors(url, args.max_percent):
+                log(f"{percent:5.1f}%  {other}")
+        else:
+            for urls in engine.duplicate_content():
+                log("Same content: " + "  ".join(urls))
+
+    elif command == 'remove':
+        url = normalize_url(args.url)
+        if url not in engine.monitors:
+            log(f"Error: URL not found: {url}")
+            engine.close()
+            return 1
+        engine.remove_monitor(url)
+        log(f"URL deleted: {url}")
+
+    engine.close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
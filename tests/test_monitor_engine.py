@@ -0,0 +1,109 @@
+"""Tests of the headless engine's scheduling and failure handling. Run with python -m pytest or python -m unittest."""
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import monitor_engine
+
+
+class HostCircuitBreakerTest(unittest.TestCase):
+    HOST = "example.com"
+
+    def open_breaker(self):
+        breaker = monitor_engine.HostCircuitBreaker(max_failures=3, cooldown=60)
+        for i in range(3):
+            breaker.record_failure(self.HOST, f"https://example.com/{i}")
+        self.assertEqual(breaker.open_hosts(), [self.HOST])
+        return breaker
+
+    def end_cooldown(self, breaker):
+        breaker.hosts[self.HOST]['open_until'] = time.time() - 1
+
+    def test_failures_while_open_do_not_extend_the_cooldown(self):
+        breaker = self.open_breaker()
+        for i in range(12): # Checks queued or running when the circuit opened
+            breaker.record_failure(self.HOST, f"https://example.com/late/{i}")
+        self.assertEqual(breaker.hosts[self.HOST]['cooldown'], 60)
+
+    def test_cooldown_doubles_once_per_failed_trial(self):
+        breaker = self.open_breaker()
+        for expected in (120, 240):
+            self.end_cooldown(breaker)
+            self.assertEqual(breaker.allow(self.HOST, "https://example.com/trial"), (True, None))
+            self.assertFalse(breaker.allow(self.HOST, "https://example.com/other")[0]) # One trial at a time
+            breaker.record_failure(self.HOST, "https://example.com/late") # In flight before the trial
+            self.assertEqual(breaker.hosts[self.HOST]['cooldown'], 60 if expected == 120 else 120)
+            breaker.record_failure(self.HOST, "https://example.com/trial")
+            for i in range(5):
+                breaker.record_failure(self.HOST, f"https://example.com/late/{i}")
+            self.assertEqual(breaker.hosts[self.HOST]['cooldown'], expected)
+            self.assertFalse(breaker.allow(self.HOST, "https://example.com/trial")[0])
+
+    def test_successful_trial_closes_the_circuit(self):
+        breaker = self.open_breaker()
+        self.end_cooldown(breaker)
+        self.assertTrue(breaker.allow(self.HOST, "https://example.com/trial")[0])
+        breaker.record_success(self.HOST)
+        self.assertEqual(breaker.open_hosts(), [])
+        self.assertEqual(breaker.allow(self.HOST, "https://example.com/1"), (True, None))
+
+
+class CheckSchedulerTest(unittest.TestCase):
+    def test_monitors_added_while_running_are_spread_out(self):
+        scheduler = monitor_engine.CheckScheduler()
+        scheduler.reset([])
+        dispatched = []
+        thread = threading.Thread(target=lambda: [dispatched.extend(urls) for urls in iter(scheduler.wait_for_due, [])])
+        thread.start()
+        try:
+            started = time.time()
+            for i in range(200): # Like a bulk add in the GUI or the CLI
+                scheduler.schedule_monitor(monitor_engine.URLMonitor(f"https://example{i}.com/", interval=600))
+            offsets = sorted(due - started for due, _, url in scheduler.heap)
+            time.sleep(0.5)
+        finally:
+            scheduler.stop()
+            thread.join()
+        self.assertEqual(len(offsets), 200)
+        self.assertGreaterEqual(offsets[0], 0)
+        self.assertLessEqual(offsets[-1], monitor_engine.STARTUP_SPREAD + 1)
+        self.assertGreater(offsets[-1] - offsets[0], monitor_engine.STARTUP_SPREAD / 2)
+        self.assertLess(len(dispatched), 10) # Not all due at once
+
+    def test_monitors_of_one_document_share_a_phase(self):
+        scheduler = monitor_engine.CheckScheduler()
+        for url in ("https://example.com/page?utm_source=a", "https://example.com/page?utm_source=b"):
+            scheduler.schedule_monitor(monitor_engine.URLMonitor(url, interval=600))
+        first, second = (due for due, _, _ in scheduler.heap)
+        self.assertAlmostEqual(first, second, delta=1)
+
+    def test_checked_monitor_is_due_after_its_interval(self):
+        scheduler = monitor_engine.CheckScheduler()
+        monitor = monitor_engine.URLMonitor("https://example.com/", interval=600)
+        monitor.last_check_time = 1000
+        scheduler.schedule_monitor(monitor)
+        self.assertEqual(scheduler.heap[0][0], 1600)
+
+
+class URLMonitorStateTest(unittest.TestCase):
+    def load_legacy(self, **kwargs):
+        """A monitor restored from data saved before adaptive intervals."""
+        state = monitor_engine.URLMonitor("https://example.com/", **kwargs).__getstate__()
+        del state['effective_interval']
+        monitor = monitor_engine.URLMonitor.__new__(monitor_engine.URLMonitor)
+        monitor.__setstate__(state)
+        return monitor
+
+    def test_legacy_effective_interval_starts_from_own_interval(self):
+        self.assertEqual(self.load_legacy(interval=900).effective_interval, 900)
+
+    def test_legacy_effective_interval_is_clamped(self):
+        self.assertEqual(self.load_legacy(interval=10, min_interval=60).effective_interval, 60)
+        self.assertEqual(self.load_legacy(interval=100000, max_interval=86400).effective_interval, 86400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,21 +1,72 @@
 import wx
-import wx.adv
-import wx.html2
-import wx.grid
-import requests # Keep requests for fallbacks or initial checks if needed, though we'll pivot to webview
 import time
-import threading
-import os
-import pickle
-import re
-from bs4 import BeautifulSoup
+import collections
 import json
+import functools
 import wx.lib.newevent
+# wx.html2 (WebView) and wx.adv (notifications) are imported when first needed so the
+# main window can appear before they are loaded, see AppFrame.finish_startup.
+from monitor_engine import (
+    FETCH_BACKEND_WEBVIEW, FETCH_BACKEND_HTTP, FETCH_BACKENDS, WEBVIEW_UNAVAILABLE_ERROR,
+    ADAPTIVE_MIN_INTERVAL, ADAPTIVE_MAX_INTERVAL, DEFAULT_SETTINGS, SINGLE_TARGET,
+    RULE_IGNORE, log, URLMonitor, parse_targets, format_target, parse_noise_rules, format_noise_rule, format_history_entry, CheckQueue, MonitorEngine, save_settings, normalize_url)
 
 
 # --- Configuration ---
 APP_NAME = "URL Change Monitor (WebView)"
-DATA_FILE = "url_monitor_data.pkl"
+UI_REFRESH_FPS = 10   # Max repaints per second of changed list rows
+
+
+@functools.lru_cache(maxsize=1024)
+def webview_script(targets, ignore=()):
+    """JavaScript that extracts all (name, kind, expression) targets in one pass over the loaded page.
+
+    Built once per distinct target tuple (see URLMonitor.extraction_targets) and tuple of
+    ignored CSS selectors instead of on every load. Like the http backend, elements matching
+    an ignore selector are left out of CSS and page targets; the engine applies the text rules.
+    Returns JSON: {values: {name: text or null}} or {error, message}.
+    """
+    return """
+    (function() {
+        try {
+            var targets = %s;
+            var ignore = %s;
+            var textOf = function(element) {
+                if (!ignore.length) return (element.textContent || '').trim();
+                var copy = element.cloneNode(true);
+                ignore.forEach(function(selector) {
+                    copy.querySelectorAll(selector).forEach(function(node) { node.remove(); });
+                });
+                return (copy.textContent || '').trim();
+            };
+            var values = {};
+            for (var i = 0; i < targets.length; i++) {
+                var name = targets[i][0], kind = targets[i][1], expression = targets[i][2];
+                var text = null;
+                if (kind === 'page') {
+                    text = document.body ? textOf(document.body) : null;
+                } else if (kind === 'xpath') {
+                    var result = document.evaluate(expression, document, null, XPathResult.ANY_TYPE, null);
+                    if (result.resultType === XPathResult.STRING_TYPE) text = result.stringValue.trim();
+                    else if (result.resultType === XPathResult.NUMBER_TYPE) text = String(result.numberValue);
+                    else if (result.resultType === XPathResult.BOOLEAN_TYPE) text = String(result.booleanValue);
+                    else {
+                        var node = result.iterateNext();
+                        text = node ? (node.textContent || '').trim() : null;
+                    }
+                } else {
+                    var element = document.querySelector(expression);
+                    text = element ? textOf(element) : null;
+                }
+                values[name] = text;
+            }
+            return JSON.stringify({ values: values });
+        } catch(e) {
+            return JSON.stringify({ error: true, message: e.message });
+        }
+    })();
+    """ % (json.dumps([list(target) for target in targets]), json.dumps(list(ignore)))
+
 
 # --- Custom Events for inter-thread communication ---
 RequestWebViewLoadEvent, EVT_REQUEST_WEBVIEW_LOAD = wx.lib.newevent.NewEvent()
@@ -23,64 +74,254 @@ WebViewLoadCompletedEvent, EVT_WEBVIEW_LOAD_COMPLETED = wx.lib.newevent.NewEvent
 WebViewLoadFailedEvent, EVT_WEBVIEW_LOAD_FAILED = wx.lib.newevent.NewEvent()
 
 
+class WebViewSlot:
+    """One WebView instance of the render pool and the URL it is currently loading."""
+    def __init__(self, webview):
+        self.webview = webview
+        self.loading_url = None # None while the slot is free
+        self.load_started_at = 0
+        self.resetting_since = 0 # Set while a timed-out slot loads about:blank; its events are ignored until then
+
+    def is_free(self):
+        return self.loading_url is None and not self.resetting_since
+
+
+class SettingsDialog(wx.Dialog):
+    """Edits the values in DEFAULT_SETTINGS."""
+    # (settings key, label, min, max); min/max are None for on/off settings
+    FIELDS = [
+        ('http_max_workers', "HTTP parallel checks:", 1, 256),
+        ('http_max_per_host', "HTTP checks per host:", 1, 64),
+        ('http_host_rate', "HTTP requests/sec per host (0 = no limit):", 0, 100),
+        ('shared_fetch_window', "Share one HTTP fetch per page between URLs due within (sec, 0 = off):", 0, 3600),
+        ('parse_processes', "Processes parsing large HTTP pages (0 = in the HTTP threads):", 0, 64),
+        ('webview_pool_size', "WebView parallel loads:", 1, 16),
+        ('store_snapshots', "Keep compressed snapshot of changed content:", None, None),
+        ('similarity_fingerprints', "Fingerprint all content for the changed/similar queries:", None, None),
+        ('history_max_entries', "Changes kept in the history per URL (0 = no history):", 0, 100000),
+        ('history_max_days', "Drop history older than (days, 0 = never):", 0, 36500),
+        ('http_connect_timeout', "HTTP connect timeout (sec):", 1, 300),
+        ('http_read_timeout', "HTTP read timeout (sec):", 1, 600),
+        ('check_timeout', "Total time per check, HTTP or WebView (sec):", 5, 3600),
+        ('http_max_body_mb', "Max HTTP page size (MB, 0 = no limit):", 0, 1024),
+        ('breaker_failures', "Skip a host after N failed checks in a row (0 = never):", 0, 100),
+        ('breaker_cooldown', "Skip a failing host for (sec):", 10, 86400),
+        ('metrics_port', "Prometheus metrics port (0 = off):", 0, 65535),
+    ]
+
+    def __init__(self, parent, settings):
+        super(SettingsDialog, self).__init__(parent, title="Settings")
+        self.controls = {}
+
+        grid = wx.FlexGridSizer(cols=2, vgap=5, hgap=10)
+        for key, label, min_value, max_value in self.FIELDS:
+            grid.Add(wx.StaticText(self, label=label), 0, wx.ALIGN_CENTER_VERTICAL)
+            if min_value is None:
+                control = wx.CheckBox(self)
+                control.SetValue(bool(settings[key]))
+            elif isinstance(DEFAULT_SETTINGS[key], float):
+                control = wx.SpinCtrlDouble(self, min=min_value, max=max_value, initial=settings[key], inc=0.5)
+                control.SetDigits(1)
+            else:
+                control = wx.SpinCtrl(self, min=min_value, max=max_value, initial=settings[key])
+            grid.Add(control, 0, wx.EXPAND)
+            self.controls[key] = control
+
+        note = wx.StaticText(self, label="Worker and pool sizes, timeouts, host limits and the metrics port take effect the next time monitoring starts.")
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(grid, 0, wx.ALL, 10)
+        sizer.Add(note, 0, wx.LEFT | wx.RIGHT, 10)
+        sizer.Add(self.CreateButtonSizer(wx.OK | wx.CANCEL), 0, wx.EXPAND | wx.ALL, 10)
+        self.SetSizerAndFit(sizer)
+
+    def get_settings(self):
+        return {key: control.GetValue() for key, control in self.controls.items()}
+
+
+class HistoryDialog(wx.Dialog):
+    """Pages through the change history of one URL, newest first."""
+    PAGE_SIZE = 20
 
-class URLMonitor:
-    def __init__(self, url, interval=300, enabled=True, tag="", selector_type="", selector_value=""):
+    def __init__(self, parent, history, url):
+        super(HistoryDialog, self).__init__(parent, title=f"History: {url}", size=(700, 500),
+                                            style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
+        self.history = history
         self.url = url
-        self.interval = interval  # in seconds
-        self.enabled = enabled
-        self.last_check_time = 0
-        self.last_source = ""     # Will store the content of the monitored element
-        self.tag = tag            # e.g., 'div', 'span', 'p'
-        self.selector_type = selector_type # 'id' or 'class'
-        self.selector_value = selector_value # The actual id or class name
-        self.last_change_time = None 
-        self.ignored_count = 0 # Count of times a check was skipped due to interval
-        self.check_count = 0 # Total times check_for_changes was called (regardless of interval)
-        self.monitored_check_count = 0 # Total times an actual load request was made
-
-    def should_check(self):
-        """Checks if it's time to schedule a check based on the interval."""
-        current_timestamp = time.time()
-        if self.enabled and current_timestamp - self.last_check_time >= self.interval:
-            return True
-        else:
-            self.ignored_count += 1
-            return False
+        self.cursors = [None] # 'before' entry id of each page shown so far; the last one is on screen
+        self.next_cursor = None
 
-    # This method still exists but primarily manages the check timing.
-    def schedule_check(self, app_frame):
-         """Schedules a check by sending an event to the UI thread."""
-         if self.should_check():
-             print(f"Scheduling webview check for {self.url}")
-             self.check_count += 1
-             event = RequestWebViewLoadEvent(url=self.url)
-             wx.PostEvent(app_frame, event) # Post event to the frame (UI thread)
+        self.text = wx.TextCtrl(self, style=wx.TE_MULTILINE | wx.TE_READONLY | wx.HSCROLL)
+        self.text.SetFont(wx.Font(9, wx.FONTFAMILY_TELETYPE, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL))
+        self.newer_button = wx.Button(self, label="< Newer")
+        self.Bind(wx.EVT_BUTTON, self.on_newer, self.newer_button)
+        self.older_button = wx.Button(self, label="Older >")
+        self.Bind(wx.EVT_BUTTON, self.on_older, self.older_button)
+
+        button_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        button_sizer.Add(self.newer_button, 0, wx.RIGHT, 10)
+        button_sizer.Add(self.older_button, 0)
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.text, 1, wx.EXPAND | wx.ALL, 10)
+        sizer.Add(button_sizer, 0, wx.ALIGN_CENTER | wx.LEFT | wx.RIGHT, 10)
+        sizer.Add(self.CreateButtonSizer(wx.OK), 0, wx.EXPAND | wx.ALL, 10)
+        self.SetSizer(sizer)
+        self.show_page()
+
+    def show_page(self):
+        entries = self.history.page(self.url, before=self.cursors[-1], limit=self.PAGE_SIZE)
+        lines = [line for entry in entries for line in format_history_entry(entry)]
+        self.text.ChangeValue("\n".join(lines) if lines else "No changes recorded yet.")
+        self.next_cursor = entries[-1]['id'] if len(entries) == self.PAGE_SIZE else None
+        self.older_button.Enable(self.next_cursor is not None)
+        self.newer_button.Enable(len(self.cursors) > 1)
+
+    def on_older(self, event):
+        self.cursors.append(self.next_cursor)
+        self.show_page()
+
+    def on_newer(self, event):
+        self.cursors.pop()
+        self.show_page()
+
+
+class MonitorListCtrl(wx.ListCtrl):
+    """Virtual (LC_VIRTUAL) URL list drawn on demand from the frame's URLMonitor objects.
+
+    Only the row order, a url -> row index and the transient status text are kept
+    here, so a status change costs one dict lookup and repaints one row, and only
+    if that row is visible.
+    """
+    COLUMNS = [('URL', 180), ('Interval (sec)', 80), ('Enabled', 60), ('Monitored Element', 120),
+               ('Last Check', 90), ('Last Change', 90), ('Status', 140), ('Fetch', 60)]
+
+    def __init__(self, parent, monitors):
+        super(MonitorListCtrl, self).__init__(parent, style=wx.LC_REPORT | wx.LC_SINGLE_SEL | wx.LC_VIRTUAL)
+        self.monitors = monitors # The frame's {url: URLMonitor}, shared not copied
+        self.urls = []           # URL shown in each row
+        self.row_of = {}         # {url: row}
+        self.statuses = {}       # {url: status text}
+        self.dirty_urls = set()  # Rows changed since the last repaint
+        for column, (label, width) in enumerate(self.COLUMNS):
+            self.InsertColumn(column, label, width=width)
+
+        # Changed rows are repainted together at most UI_REFRESH_FPS times a second
+        self.refresh_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_refresh_timer, self.refresh_timer)
+
+    def OnGetItemText(self, item, column):
+        url = self.urls[item]
+        monitor = self.monitors.get(url)
+        if column == 0 or monitor is None:
+            return url if column == 0 else ""
+        if column == 1:
+            if monitor.adaptive: # Effective interval, followed by the configured starting point
+                return f"{monitor.effective_interval:.0f} (auto, {monitor.interval})"
+            return str(monitor.interval)
+        if column == 2:
+            return "Yes" if monitor.enabled else "No"
+        if column == 3:
+            if monitor.targets:
+                return monitor.describe_targets()
+            if monitor.has_element_selector():
+                return f"{monitor.selector_type}={monitor.selector_value} ({monitor.tag})"
+            return "Entire Page"
+        if column == 4:
+            return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(monitor.last_check_time)) if monitor.last_check_time else "Never"
+        if column == 5:
+            return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(monitor.last_change_time)) if monitor.last_change_time else "None"
+        if column == 6:
+            return self.statuses.get(url, "Idle")
+        if column == 7:
+            return monitor.fetch_backend
+        return ""
+
+    def set_monitors(self, monitors):
+        """Rebinds the list to a new {url: URLMonitor} dict and shows all of its rows."""
+        self.monitors = monitors
+        self.urls = list(monitors)
+        self.row_of = {url: row for row, url in enumerate(self.urls)}
+        self.statuses = {url: status for url, status in self.statuses.items() if url in self.row_of}
+        self.SetItemCount(len(self.urls))
+        self.Refresh()
+
+    def add_url(self, url):
+        if url in self.row_of:
+            self.refresh_url(url)
+            return
+        self.row_of[url] = len(self.urls)
+        self.urls.append(url)
+        self.SetItemCount(len(self.urls))
+
+    def remove_url(self, url):
+        """Removes a row. Later rows shift up, so the index is rebuilt (O(n), deletes are rare)."""
+        row = self.row_of.pop(url, None)
+        if row is None:
+            return
+        del self.urls[row]
+        for shifted_row in range(row, len(self.urls)):
+            self.row_of[self.urls[shifted_row]] = shifted_row
+        self.statuses.pop(url, None)
+        self.dirty_urls.discard(url)
+        self.SetItemCount(len(self.urls))
+        self.Refresh()
+
+    def set_status(self, url, status_text):
+        self.statuses[url] = status_text
+        self.refresh_url(url)
+
+    def refresh_url(self, url):
+        """Marks a row for the next coalesced repaint."""
+        if url in self.row_of:
+            self.dirty_urls.add(url)
+            if not self.refresh_timer.IsRunning():
+                self.refresh_timer.StartOnce(1000 // UI_REFRESH_FPS)
+
+    def on_refresh_timer(self, event):
+        """Repaints the changed rows that are on screen in one go."""
+        dirty_urls, self.dirty_urls = self.dirty_urls, set()
+        first_visible = self.GetTopItem()
+        last_visible = min(first_visible + self.GetCountPerPage(), len(self.urls) - 1)
+        rows = [self.row_of[url] for url in dirty_urls
+                if url in self.row_of and first_visible <= self.row_of[url] <= last_visible]
+        if rows:
+            self.RefreshItems(min(rows), max(rows)) # Rows off screen are drawn fresh when scrolled to
+
+    def url_at(self, row):
+        return self.urls[row] if 0 <= row < len(self.urls) else None
+
+    def selected_url(self):
+        return self.url_at(self.GetFirstSelected())
 
 
 class AppFrame(wx.Frame):
     def __init__(self, parent, title):
         super(AppFrame, self).__init__(parent, title=title, size=(1200, 700)) # Increased size
 
-        self.urls_to_monitor = {}  # Dictionary to store URLMonitor objects {url: URLMonitor}
-        self.monitoring_thread = None
-        self.monitoring_running = False
+        # Scheduling, HTTP checks, change detection and storage; results are recorded on the UI thread
+        self.engine = MonitorEngine(on_status=self.update_url_status,
+                                    on_change=self.on_change_detected,
+                                    deliver_result=self.post_result,
+                                    webview_dispatch=self.queue_webview_check)
+        self.settings = self.engine.settings
+        self.urls_to_monitor = self.engine.monitors # Same dict as the engine's {url: URLMonitor}
         self.webview_panel = None
-        self.webview = None
-        self.webview_loading_url = None # Track the URL currently being loaded in WebView
-        self.check_queue = [] # Use a list as a simple queue for URLs to check
+        self.webview = None # The visible WebView, also the first slot of the pool
+        self.webview_slots = [] # WebViewSlot per WebView instance, each with its own in-flight URL
+        self.check_queue = CheckQueue() # URLs waiting for a free WebView slot
+        self.webview_drain_scheduled = False
+        self.result_inbox = collections.deque() # HTTP results waiting for the UI thread
+        self.result_drain_scheduled = False
 
         self.create_ui()
-        self.load_data()
-        self.update_list_ctrl()
 
         self.Centre()
         self.Show()
+        # The window paints first; the WebView and saved URLs are loaded right after
+        wx.CallAfter(self.finish_startup)
 
        
         self.Bind(EVT_REQUEST_WEBVIEW_LOAD, self.on_request_webview_load)
-        self.Bind(EVT_WEBVIEW_LOAD_COMPLETED, self.on_webview_load_completed)
-        self.Bind(EVT_WEBVIEW_LOAD_FAILED, self.on_webview_load_failed)
 
         
         self.Bind(wx.EVT_CLOSE, self.on_close)
@@ -107,7 +348,18 @@ class AppFrame(wx.Frame):
         url_input_sizer.Add(interval_label, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, 5)
         self.interval_spin = wx.SpinCtrlDouble(left_panel, value="3600", min=10, max=86400, inc=10)
         self.interval_spin.SetDigits(0)
-        url_input_sizer.Add(self.interval_spin, 0, wx.ALIGN_CENTER_VERTICAL)
+        url_input_sizer.Add(self.interval_spin, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, 10)
+
+        # Adaptive mode starts at the interval above and moves within min..max
+        self.adaptive_check = wx.CheckBox(left_panel, label="Adaptive")
+        self.adaptive_check.SetToolTip("Check stable pages less often and frequently changing pages more often")
+        url_input_sizer.Add(self.adaptive_check, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, 5)
+        url_input_sizer.Add(wx.StaticText(left_panel, label="Min:"), 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, 5)
+        self.min_interval_spin = wx.SpinCtrl(left_panel, min=10, max=86400, initial=ADAPTIVE_MIN_INTERVAL, size=(80, -1))
+        url_input_sizer.Add(self.min_interval_spin, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, 5)
+        url_input_sizer.Add(wx.StaticText(left_panel, label="Max:"), 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, 5)
+        self.max_interval_spin = wx.SpinCtrl(left_panel, min=10, max=30 * 86400, initial=ADAPTIVE_MAX_INTERVAL, size=(80, -1))
+        url_input_sizer.Add(self.max_interval_spin, 0, wx.ALIGN_CENTER_VERTICAL)
         
         vbox_left.Add(url_input_sizer, 0, wx.EXPAND | wx.ALL, 10)
         
@@ -125,9 +377,43 @@ class AppFrame(wx.Frame):
         selector_input_sizer.Add(selector_value_label, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, 5)
         self.selector_value_text = wx.TextCtrl(left_panel, size=(120, -1))
         
-        selector_input_sizer.Add(self.selector_value_text, 1, wx.EXPAND )
+        selector_input_sizer.Add(self.selector_value_text, 1, wx.EXPAND | wx.RIGHT, 10)
+
+        fetch_backend_label = wx.StaticText(left_panel, label="Fetch:")
+        selector_input_sizer.Add(fetch_backend_label, 0, wx.ALIGN_CENTER_VERTICAL | wx.RIGHT, 5)
+        self.fetch_backend_combo = wx.ComboBox(left_panel, choices=FETCH_BACKENDS, style=wx.CB_READONLY, size=(80,-1))
+        self.fetch_backend_combo.SetValue(FETCH_BACKEND_WEBVIEW)
+        selector_input_sizer.Add(self.fetch_backend_combo, 0, wx.ALIGN_CENTER_VERTICAL)
         
         vbox_left.Add(selector_input_sizer, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, 10)
+
+        # Named targets, all extracted from one fetch; used instead of the selector above
+        targets_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        targets_label = wx.StaticText(left_panel, label="Targets:")
+        targets_sizer.Add(targets_label, 0, wx.RIGHT, 5)
+        self.targets_text = wx.TextCtrl(left_panel, style=wx.TE_MULTILINE, size=(-1, 48))
+        self.targets_text.SetToolTip("One 'name = selector' per line, e.g. 'price = span.price'.\n"
+                                     "CSS selectors, or XPath with an xpath: prefix ('stock = xpath://div[@id=\"stock\"]').\n"
+                                     "Leave empty to use Tag/Selector above.")
+        targets_sizer.Add(self.targets_text, 1, wx.EXPAND)
+        vbox_left.Add(targets_sizer, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, 10)
+
+        # Noise rules: content that should not count as a change
+        noise_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        noise_label = wx.StaticText(left_panel, label="Ignore:")
+        noise_sizer.Add(noise_label, 0, wx.RIGHT, 5)
+        self.noise_text = wx.TextCtrl(left_panel, style=wx.TE_MULTILINE, size=(-1, 48))
+        self.noise_text.SetToolTip("Content that does not count as a change, one rule per line, applied in order:\n"
+                                   "'regex: PATTERN' removes every match (e.g. 'regex: \\d+ views'),\n"
+                                   "'ignore: SELECTOR' leaves out the text of matching elements (e.g. 'ignore: .ad'),\n"
+                                   "'whitespace' collapses runs of whitespace.")
+        noise_sizer.Add(self.noise_text, 1, wx.EXPAND | wx.RIGHT, 10)
+        noise_sizer.Add(wx.StaticText(left_panel, label="Min change %:"), 0, wx.RIGHT, 5)
+        self.min_change_spin = wx.SpinCtrl(left_panel, min=0, max=100, initial=0, size=(60, -1))
+        self.min_change_spin.SetToolTip("Only report changes of at least this much of the content, estimated from\n"
+                                        "similarity fingerprints; smaller changes add up until they reach it. 0 = every change")
+        noise_sizer.Add(self.min_change_spin, 0)
+        vbox_left.Add(noise_sizer, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, 10)
         
         button_sizer = wx.BoxSizer(wx.HORIZONTAL)
         self.add_button = wx.Button(left_panel, label="Add/Update URL")
@@ -137,6 +423,10 @@ class AppFrame(wx.Frame):
         self.delete_button = wx.Button(left_panel, label="Delete Selected")
         self.Bind(wx.EVT_BUTTON, self.on_delete_url, self.delete_button)
         button_sizer.Add(self.delete_button, 0, wx.RIGHT, 10)
+
+        self.check_now_button = wx.Button(left_panel, label="Check Now")
+        self.Bind(wx.EVT_BUTTON, self.on_check_now, self.check_now_button)
+        button_sizer.Add(self.check_now_button, 0, wx.RIGHT, 10)
         
         self.start_button = wx.Button(left_panel, label="Start Monitoring")
         self.Bind(wx.EVT_BUTTON, self.on_start_monitoring, self.start_button)
@@ -145,25 +435,35 @@ class AppFrame(wx.Frame):
         self.stop_button = wx.Button(left_panel, label="Stop Monitoring")
         self.Bind(wx.EVT_BUTTON, self.on_stop_monitoring, self.stop_button)
         self.stop_button.Enable(False)
-        button_sizer.Add(self.stop_button, 0)
+        button_sizer.Add(self.stop_button, 0, wx.RIGHT, 10)
+
+        self.settings_button = wx.Button(left_panel, label="Settings...")
+        self.Bind(wx.EVT_BUTTON, self.on_settings, self.settings_button)
+        button_sizer.Add(self.settings_button, 0, wx.RIGHT, 10)
+
+        self.details_button = wx.ToggleButton(left_panel, label="Details")
+        self.Bind(wx.EVT_TOGGLEBUTTON, self.on_toggle_details, self.details_button)
+        button_sizer.Add(self.details_button, 0, wx.RIGHT, 10)
+
+        self.history_button = wx.Button(left_panel, label="History...")
+        self.Bind(wx.EVT_BUTTON, self.on_history, self.history_button)
+        button_sizer.Add(self.history_button, 0)
         
         vbox_left.Add(button_sizer, 0, wx.ALIGN_CENTER | wx.ALL, 10)
         
-        self.url_list = wx.ListCtrl(left_panel, style=wx.LC_REPORT | wx.LC_SINGLE_SEL)
-        
-        self.url_list.InsertColumn(0, 'URL', width=180) # Adjusted width for splitter
-        self.url_list.InsertColumn(1, 'Interval (sec)', width=80)
-        self.url_list.InsertColumn(2, 'Enabled', width=60)
-        self.url_list.InsertColumn(3, 'Monitored Element', width=120)
-        self.url_list.InsertColumn(4, 'Last Check', width=90)
-        self.url_list.InsertColumn(5, 'Last Change', width=90)
-        self.url_list.InsertColumn(6, 'Status', width=140)
+        self.url_list = MonitorListCtrl(left_panel, self.urls_to_monitor)
         
         self.Bind(wx.EVT_LIST_ITEM_SELECTED, self.on_url_selected, self.url_list)
         self.Bind(wx.EVT_LIST_ITEM_DESELECTED, self.on_url_deselected, self.url_list)
         self.Bind(wx.EVT_LIST_ITEM_ACTIVATED, self.on_url_activated, self.url_list) # Keep this for now
         
         vbox_left.Add(self.url_list, 1, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, 10)
+
+        # Per-check stage timings of the selected URL, its host and all checks
+        self.details_text = wx.TextCtrl(left_panel, style=wx.TE_MULTILINE | wx.TE_READONLY | wx.HSCROLL, size=(-1, 180))
+        self.details_text.SetFont(wx.Font(9, wx.FONTFAMILY_TELETYPE, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL))
+        self.details_text.Hide()
+        vbox_left.Add(self.details_text, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.BOTTOM, 10)
         left_panel.SetSizer(vbox_left)
         
         
@@ -173,40 +473,69 @@ class AppFrame(wx.Frame):
         
         webview_label = wx.StaticText(self.webview_panel, label="Monitored Page View:")
         webview_sizer.Add(webview_label, 0, wx.ALL | wx.EXPAND, 5)
-        
-        if hasattr(wx.html2, 'WebView'):
-             self.webview = wx.html2.WebView.New(self.webview_panel)
-             if not self.webview:
-                 wx.MessageBox("WebView could not be created. Ensure you have a compatible backend installed (e.g., WebKitGTK, Edge, etc.).", "WebView Error", wx.OK | wx.ICON_ERROR)
-                 print("FATAL: WebView could not be created. Please check your wxPython installation and environment.")
-                 self.disable_webview_features()
-             else:
-                  self.webview.Bind(wx.html2.EVT_WEBVIEW_LOADED, self.on_webview_load_completed)
-                  self.webview.Bind(wx.html2.EVT_WEBVIEW_ERROR, self.on_webview_load_failed)
-             webview_sizer.Add(self.webview, 1, wx.EXPAND | wx.ALL, 5)
-        else:
-            placeholder = wx.StaticText(self.webview_panel, label="wx.html2.WebView is not available in this wxPython build or environment.")
-            webview_sizer.Add(placeholder, 1, wx.EXPAND | wx.ALL, 5)
-            print("Warning: wx.html2.WebView is not available. Monitoring disabled.")
-            self.disable_webview_features()
+        # Replaced by the WebView in create_webview
+        self.webview_placeholder = wx.StaticText(self.webview_panel, label="Loading page view...")
+        webview_sizer.Add(self.webview_placeholder, 1, wx.EXPAND | wx.ALL, 5)
             
         self.webview_panel.SetSizer(webview_sizer)
         splitter.SplitVertically(left_panel, self.webview_panel)
         initial_sash_position = 600 # Start with the left panel about 600 pixels wide
         splitter.SetSashPosition(initial_sash_position)
-      main_sizer.Add(splitter, 1, wx.EXPAND | wx.ALL, 0) # Splitter takes all available space
+        main_sizer.Add(splitter, 1, wx.EXPAND | wx.ALL, 0) # Splitter takes all available space
         
         panel.SetSizer(main_sizer)
         main_sizer.Fit(self) # Fit the frame to the sizers
         # --- Status Bar ---
-        self.CreateStatusBar()
-        self.GetStatusBar().SetStatusText("Ready")
+        self.CreateStatusBar(2)
+        self.GetStatusBar().SetStatusWidths([-3, -2]) # Messages | queue depth and wait
+        self.GetStatusBar().SetStatusText("Loading...")
+        self.start_button.Enable(False) # Until finish_startup has loaded the saved URLs
+
+        # Refreshes the queue stats in the status bar
+        self.stats_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_stats_timer, self.stats_timer)
+        self.stats_timer.Start(1000)
 
 
+    def finish_startup(self):
+        """Second startup phase, run once the window is on screen."""
+        if not self: # Closed before the first idle
+            return
+        self.create_webview()
+        self.urls_to_monitor = self.engine.load()
+        self.update_list_ctrl()
+        self.start_button.Enable(True)
+        if self.webview:
+            self.GetStatusBar().SetStatusText("Ready")
+
+    def create_webview(self):
+        """Creates the visible WebView (and the hidden pool) in place of the placeholder."""
+        try:
+            import wx.html2 as html2
+        except ImportError:
+            html2 = None
+        sizer = self.webview_panel.GetSizer()
+        if html2 and hasattr(html2, 'WebView'):
+             self.webview = html2.WebView.New(self.webview_panel)
+             if not self.webview:
+                 wx.MessageBox("WebView could not be created. Ensure you have a compatible backend installed (e.g., WebKitGTK, Edge, etc.).", "WebView Error", wx.OK | wx.ICON_ERROR)
+                 log("FATAL: WebView could not be created. Please check your wxPython installation and environment.")
+                 self.disable_webview_features()
+             else:
+                  sizer.Replace(self.webview_placeholder, self.webview)
+                  self.webview_placeholder.Destroy()
+                  self.add_webview_slot(self.webview)
+                  self.resize_webview_pool()
+                  sizer.Layout()
+        else:
+            self.webview_placeholder.SetLabel("wx.html2.WebView is not available in this wxPython build or environment.")
+            log("Warning: wx.html2.WebView is not available. Monitoring disabled.")
+            self.disable_webview_features()
+
     def disable_webview_features(self):
         """Helper to disable WebView-dependent features if it fails to create."""
-        self.start_button.Enable(False)
-        self.GetStatusBar().SetStatusText("WebView not available. Monitoring disabled.")
+        self.fetch_backend_combo.SetValue(FETCH_BACKEND_HTTP) # Only the HTTP backend can work
+        self.GetStatusBar().SetStatusText("WebView not available. Only HTTP fetch monitors will be checked.")
         if self.webview_panel:
             sizer = self.webview_panel.GetSizer()
             if sizer:
@@ -216,10 +545,90 @@ class AppFrame(wx.Frame):
                  sizer.Layout() # Update layout after hiding
                  self.Layout() # Update frame layout
                  
-    def escape_attribute_value(self, value):
-        """Escape single quotes in the attribute value for use in JavaScript."""
-        return value.replace("'", "\\'")
+    def add_webview_slot(self, webview):
+        """Adds a WebView to the pool, routing its load events back to its own slot."""
+        slot = WebViewSlot(webview)
+        webview.Bind(wx.html2.EVT_WEBVIEW_LOADED, lambda event, slot=slot: self.on_webview_load_completed(event, slot))
+        webview.Bind(wx.html2.EVT_WEBVIEW_ERROR, lambda event, slot=slot: self.on_webview_load_failed(event, slot))
+        self.webview_slots.append(slot)
+        return slot
+
+    def resize_webview_pool(self):
+        """Creates or destroys hidden WebViews so the pool matches the webview_pool_size setting.
+
+        Only called while no loads are in flight (at startup and when monitoring starts).
+        """
+        if not self.webview:
+            return
+        target_size = max(1, self.settings['webview_pool_size'])
+        while len(self.webview_slots) < target_size:
+            hidden_webview = wx.html2.WebView.New(self.webview_panel)
+            if not hidden_webview:
+                log(f"Could not create additional WebView, pool size limited to {len(self.webview_slots)}")
+                break
+            hidden_webview.Hide()
+            self.add_webview_slot(hidden_webview)
+        while len(self.webview_slots) > target_size:
+            self.webview_slots.pop().webview.Destroy() # Never removes slot 0, the visible WebView
+        log(f"WebView pool size: {len(self.webview_slots)}")
+
+    def free_webview_slot(self):
+        """Returns a WebViewSlot that is not loading anything, or None if all are busy."""
+        for slot in self.webview_slots:
+            if slot.is_free():
+                return slot
+        return None
+
+    def is_webview_loading(self, url):
+        return any(slot.loading_url == url for slot in self.webview_slots)
+
+    def stop_webview_loads(self):
+        """Stops every in-flight WebView load and frees its slot."""
+        for slot in self.webview_slots:
+            if slot.loading_url:
+                 log(f"Stopping WebView load of {slot.loading_url}")
+                 slot.loading_url = None
+                 if hasattr(slot.webview, 'Stop'):
+                      try:
+                          slot.webview.Stop()
+                      except Exception as e:
+                           log(f"Error stopping webview: {e}")
+
+    def check_webview_timeouts(self):
+        """Watchdog, run every second: fails WebView loads that ran past check_timeout and frees their slot.
+
+        A timed-out slot is stopped and loads about:blank before it is reused, so a
+        late event from the stuck page cannot be taken for the next URL's result.
+        """
+        timeout = self.settings['check_timeout']
+        now = time.time()
+        slot_freed = False
+        for slot in self.webview_slots:
+            if slot.loading_url and now - slot.load_started_at > timeout:
+                url = slot.loading_url
+                log(f"WebView load of {url} timed out after {timeout:g}s")
+                slot.loading_url = None
+                slot.resetting_since = now
+                try:
+                    slot.webview.Stop()
+                    slot.webview.LoadURL("about:blank")
+                except Exception as e:
+                    log(f"Error resetting webview: {e}")
+                self.engine.metrics.mark(url, 'fetch')
+                self.engine.record_check_failure(url, f"Timed out after {timeout:g}s", status=f"Timed out after {timeout:g}s",
+                                                 transport=True)
+            elif slot.resetting_since and now - slot.resetting_since > timeout:
+                log("WebView did not load about:blank after a timeout, reusing it anyway")
+                slot.resetting_since = 0
+                slot_freed = True
+        if slot_freed:
+            self.process_next_webview_load()
 
+    def finish_slot_reset(self, slot, url):
+        """Frees a timed-out slot once its about:blank load finished; other events are the stuck page's."""
+        if url and url.startswith("about:blank"):
+            slot.resetting_since = 0
+            self.process_next_webview_load()
 
     def on_add_url(self, event):
         url = self.url_text.GetValue().strip()
@@ -227,11 +636,32 @@ class AppFrame(wx.Frame):
         tag = self.tag_text.GetValue().strip()
         selector_type = self.selector_type_combo.GetValue()
         selector_value = self.selector_value_text.GetValue().strip()
+        fetch_backend = self.fetch_backend_combo.GetValue() or FETCH_BACKEND_WEBVIEW
+        adaptive = self.adaptive_check.GetValue()
+        min_interval = self.min_interval_spin.GetValue()
+        max_interval = self.max_interval_spin.GetValue()
+        min_change_percent = self.min_change_spin.GetValue()
 
         if not url:
             wx.MessageBox("Please enter a URL.", "Input Error", wx.OK | wx.ICON_ERROR)
             return
 
+        try:
+            targets = parse_targets(self.targets_text.GetValue())
+        except ValueError as e:
+            wx.MessageBox(f"Invalid target: {e}", "Input Error", wx.OK | wx.ICON_ERROR)
+            return
+
+        try:
+            noise_rules = parse_noise_rules(self.noise_text.GetValue())
+        except ValueError as e:
+            wx.MessageBox(f"Invalid ignore rule: {e}", "Input Error", wx.OK | wx.ICON_ERROR)
+            return
+
+        if targets and tag:
+             wx.MessageBox("Use either Targets or Tag/Selector, not both.", "Input Error", wx.OK | wx.ICON_ERROR)
+             return
+
         if tag and (not selector_type or not selector_value):
              wx.MessageBox("If you specify a Tag, you must also specify a Selector Type (id/class) and Selector Value.", "Input Error", wx.OK | wx.ICON_ERROR)
              return
@@ -240,9 +670,11 @@ class AppFrame(wx.Frame):
              wx.MessageBox("If you specify a Selector Type (id/class), you must also specify a Tag and Selector Value.", "Input Error", wx.OK | wx.ICON_ERROR)
              return
 
-        # Add http:// if not present, simple check
-        if not url.startswith('http://') and not url.startswith('https://'):
-            url = 'http://' + url # Default to http
+        if adaptive and min_interval > max_interval:
+             wx.MessageBox("The adaptive Min interval must not be larger than Max.", "Input Error", wx.OK | wx.ICON_ERROR)
+             return
+
+        url = normalize_url(url)
 
         if url in self.urls_to_monitor:
             # Ask user if they want to update
@@ -252,25 +684,39 @@ class AppFrame(wx.Frame):
                  monitor_to_update.tag = tag
                  monitor_to_update.selector_type = selector_type
                  monitor_to_update.selector_value = selector_value
+                 monitor_to_update.targets = targets
+                 monitor_to_update.noise_rules = noise_rules
+                 monitor_to_update.min_change_percent = min_change_percent
+                 monitor_to_update.fetch_backend = fetch_backend
+                 monitor_to_update.reset_validators() # A 304 says nothing about a different selector
+                 monitor_to_update.adaptive = adaptive
+                 monitor_to_update.min_interval = min_interval
+                 monitor_to_update.max_interval = max_interval
+                 monitor_to_update.reset_adaptation()
                  monitor_to_update.enabled = True # Assume update means enabling
 
                  # Optional: If important URL updated, maybe reset its state?
                  # monitor_to_update.last_check_time = 0
-                 # monitor_to_update.last_source = ""
+                 # monitor_to_update.last_digest = None
                  # monitor_to_update.last_change_time = None
 
+                 self.engine.update_monitor(monitor_to_update)
                  self.GetStatusBar().SetStatusText(f"URL settings updated for {url}")
             else:
                  return # User cancelled update
 
         else:
             # Add new URL
-            new_monitor = URLMonitor(url, interval, tag=tag, selector_type=selector_type, selector_value=selector_value)
-            self.urls_to_monitor[url] = new_monitor
+            new_monitor = URLMonitor(url, interval, tag=tag, selector_type=selector_type, selector_value=selector_value,
+                                     fetch_backend=fetch_backend, adaptive=adaptive,
+                                     min_interval=min_interval, max_interval=max_interval, targets=targets,
+                                     noise_rules=noise_rules, min_change_percent=min_change_percent)
+            new_monitor.reset_adaptation()
+            self.engine.add_monitor(new_monitor)
+            self.url_list.add_url(url)
             self.GetStatusBar().SetStatusText(f"URL added: {url}")
 
-        self.update_list_ctrl()
-        self.save_data()
+        self.update_list_ctrl_row(url)
 
 
     def on_delete_url(self, event):
@@ -279,15 +725,14 @@ class AppFrame(wx.Frame):
             wx.MessageBox("Please select a URL to delete.", "Delete Error", wx.OK | wx.ICON_ERROR)
             return
 
-        url_to_delete = self.url_list.GetItemText(selected_index, 0)
+        url_to_delete = self.url_list.url_at(selected_index)
 
         if wx.MessageBox(f"Are you sure you want to delete '{url_to_delete}'?", "Confirm Delete", wx.YES_NO | wx.ICON_QUESTION) == wx.YES:
             if url_to_delete in self.urls_to_monitor:
                 # Remove from check queue if present
-                self.check_queue = [u for u in self.check_queue if u != url_to_delete]
-                del self.urls_to_monitor[url_to_delete]
-                self.update_list_ctrl()
-                self.save_data()
+                self.check_queue.cancel(url_to_delete)
+                self.engine.remove_monitor(url_to_delete)
+                self.url_list.remove_url(url_to_delete)
                 self.GetStatusBar().SetStatusText(f"URL deleted: {url_to_delete}")
             else:
                  self.GetStatusBar().SetStatusText(f"Error: URL not found in internal list: {url_to_delete}")
@@ -296,15 +741,23 @@ class AppFrame(wx.Frame):
     def on_url_selected(self, event):
         selected_index = self.url_list.GetFirstSelected()
         if selected_index != -1:
-            url = self.url_list.GetItemText(selected_index, 0)
+            url = self.url_list.url_at(selected_index)
             if url in self.urls_to_monitor:
                 monitor = self.urls_to_monitor[url]
                 self.url_text.SetValue(monitor.url)
                 self.interval_spin.SetValue(monitor.interval)
+                self.adaptive_check.SetValue(monitor.adaptive)
+                self.min_interval_spin.SetValue(monitor.min_interval)
+                self.max_interval_spin.SetValue(monitor.max_interval)
                 self.tag_text.SetValue(monitor.tag)
                 self.selector_type_combo.SetValue(monitor.selector_type)
                 self.selector_value_text.SetValue(monitor.selector_value)
+                self.targets_text.SetValue("\n".join(format_target(target) for target in monitor.targets))
+                self.noise_text.SetValue("\n".join(format_noise_rule(rule) for rule in monitor.noise_rules))
+                self.min_change_spin.SetValue(monitor.min_change_percent)
+                self.fetch_backend_combo.SetValue(monitor.fetch_backend)
                 self.add_button.SetLabel("Update Selected URL")
+                self.update_details()
 
     def on_url_deselected(self, event):
         if self.url_list.GetFirstSelected() == -1:
@@ -314,64 +767,110 @@ class AppFrame(wx.Frame):
     def on_url_activated(self, event):
         selected_index = self.url_list.GetFirstSelected()
         if selected_index != -1:
-            url = self.url_list.GetItemText(selected_index, 0)
+            url = self.url_list.url_at(selected_index)
             if self.webview and hasattr(self.webview, 'LoadURL'):
-                 print(f"Loading {url} in WebView...")
-                pass # Decide if we want this feature and how to implement it safely
+                 log(f"Loading {url} in WebView...")
+                 pass # Decide if we want this feature and how to implement it safely
+
+    def on_check_now(self, event):
+        """Queues the selected URL in the priority lane, ahead of scheduled checks."""
+        selected_index = self.url_list.GetFirstSelected()
+        if selected_index == -1:
+            wx.MessageBox("Please select a URL to check.", "Check Now", wx.OK | wx.ICON_ERROR)
+            return
+        if not self.engine.running:
+            wx.MessageBox("Start monitoring first.", "Check Now", wx.OK | wx.ICON_INFORMATION)
+            return
+
+        url = self.url_list.url_at(selected_index)
+        if self.engine.check_now(url):
+            self.update_url_status(url, "Queued (priority)")
+
+    def on_stats_timer(self, event):
+        """Shows queue depth and wait times so a backlog is visible."""
+        parts = []
+        for name, stats in (("WebView", self.check_queue.stats()),
+                            ("HTTP", self.engine.queue_stats())):
+            if stats:
+                parts.append(f"{name} queue: {stats['depth']} ({stats['priority_depth']} priority), "
+                             f"oldest {stats['oldest_wait']:.0f}s, avg wait {stats['average_wait']:.1f}s")
+        self.GetStatusBar().SetStatusText(" | ".join(parts), 1)
+        self.check_webview_timeouts()
+        self.update_details()
+
+    def on_history(self, event):
+        url = self.url_list.selected_url()
+        if not url:
+            wx.MessageBox("Please select a URL to show its history.", "History", wx.OK | wx.ICON_INFORMATION)
+            return
+        if not self.engine.history:
+            wx.MessageBox("The change history is turned off (see Settings).", "History", wx.OK | wx.ICON_INFORMATION)
+            return
+        dialog = HistoryDialog(self, self.engine.history, url)
+        dialog.ShowModal()
+        dialog.Destroy()
+
+    def on_toggle_details(self, event):
+        self.details_text.Show(self.details_button.GetValue())
+        self.details_text.GetParent().Layout()
+        self.update_details()
+
+    def update_details(self):
+        """Refreshes the details pane, if shown, with the timings of the selected URL."""
+        if not self.details_text.IsShown():
+            return
+        text = self.engine.metrics.summary(self.url_list.selected_url())
+        if text != self.details_text.GetValue():
+            self.details_text.ChangeValue(text)
+
+    def on_settings(self, event):
+        dialog = SettingsDialog(self, self.settings)
+        if dialog.ShowModal() == wx.ID_OK:
+            self.settings.update(dialog.get_settings())
+            save_settings(self.settings)
+            self.GetStatusBar().SetStatusText("Settings saved.")
+        dialog.Destroy()
 
     def on_start_monitoring(self, event):
         if not self.webview or not hasattr(self.webview, 'LoadURL'):
-             wx.MessageBox("Monitoring requires a working WebView.", "Error", wx.OK | wx.ICON_ERROR)
-             return # Prevent starting if WebView failed
+             log("WebView not available, only HTTP fetch monitors will be checked.")
 
-        if not self.monitoring_thread or not self.monitoring_thread.is_alive():
-            print("Starting monitoring thread...")
-            self.monitoring_running = True
+        if not self.engine.running:
+            log("Starting monitoring thread...")
+            self.resize_webview_pool() # Apply a changed pool size while nothing is loading
             # Clear the queue on start to prevent processing old requests
-            self.check_queue = [] 
-            self.monitoring_thread = threading.Thread(target=self.monitor_urls_thread)
-            self.monitoring_thread.daemon = True
-            self.monitoring_thread.start()
+            self.check_queue.clear()
+        if self.engine.start(): # False while a previous monitoring thread is still alive
             self.start_button.Enable(False)
             self.stop_button.Enable(True)
             self.GetStatusBar().SetStatusText("Monitoring started...")
         else:
             self.GetStatusBar().SetStatusText("Monitoring is already running.")
-            print("Monitoring thread already running.")
+            log("Monitoring thread already running.")
 
 
     def on_stop_monitoring(self, event):
-        if self.monitoring_thread and self.monitoring_thread.is_alive():
-            print("Stopping monitoring thread...")
-            self.monitoring_running = False
-            self.check_queue = [] 
+        if self.engine.running:
+            log("Stopping monitoring thread...")
+            self.check_queue.clear()
 
-             # Wait for the thread to finish
-            self.monitoring_thread.join(timeout=5)
-
-            if self.monitoring_thread.is_alive():
-                print("Monitoring thread did not stop within timeout.")
+            # Waits for the scheduler thread to finish
+            if not self.engine.stop():
+                log("Monitoring thread did not stop within timeout.")
                 self.GetStatusBar().SetStatusText("Monitoring stopping (thread unresponsive)...")
             else:
-                print("Monitoring thread stopped.")
+                log("Monitoring thread stopped.")
                 self.GetStatusBar().SetStatusText("Monitoring stopped.")
 
             # Reset WebView state if it was loading
-            if self.webview_loading_url:
-                 print(f"Monitoring stopped while loading {self.webview_loading_url}")
-                 self.webview_loading_url = None
-                 if self.webview and hasattr(self.webview, 'Stop'):
-                      try:
-                          self.webview.Stop()
-                      except Exception as e:
-                           print(f"Error stopping webview: {e}")
+            self.stop_webview_loads()
 
 
             self.start_button.Enable(True)
             self.stop_button.Enable(False)
         else:
             self.GetStatusBar().SetStatusText("Monitoring is not running.")
-            print("Monitoring thread not running.")
+            log("Monitoring thread not running.")
 
     # --- WebView Events (Run on UI Thread) ---
 
@@ -380,359 +879,210 @@ class AppFrame(wx.Frame):
          url_to_load = event.url # Get the URL from the event object
 
          if not self.webview or not hasattr(self.webview, 'LoadURL'):
-             print(f"WebView not available, cannot load {url_to_load}.")
+             log(f"WebView not available, cannot load {url_to_load}.")
+             self.engine.record_check_failure(url_to_load, WEBVIEW_UNAVAILABLE_ERROR)
              return
 
-         if self.webview_loading_url:
-             print(f"WebView busy ({self.webview_loading_url}), queueing {url_to_load}")
-             if url_to_load not in self.check_queue: # Avoid duplicates
-                 self.check_queue.append(url_to_load)
+         if self.is_webview_loading(url_to_load):
+             return # Already in flight
+
+         slot = self.free_webview_slot()
+         if slot is None:
+             log(f"All {len(self.webview_slots)} WebViews busy, queueing {url_to_load}")
+             self.check_queue.put(url_to_load) # Ignored if already queued
          else:
-             # WebView is free, load the URL
-             print(f"Loading {url_to_load} in WebView...")
-             self.webview_loading_url = url_to_load
-             self.update_url_status(url_to_load, "Loading...") # Update status in UI
-             try:
-                 self.webview.LoadURL(url_to_load)
-             except Exception as e:
-                 print(f"Error calling LoadURL for {url_to_load}: {e}")
-                 self.webview_loading_url = None # Release the lock
-                 # Post a failure event back to self
-                 event = WebViewLoadFailedEvent(url=url_to_load, error=str(e))
-                 wx.PostEvent(self, event)
+             self.start_webview_load(slot, url_to_load)
+
+    def start_webview_load(self, slot, url_to_load):
+         """Loads a URL in a free WebView slot."""
+         log(f"Loading {url_to_load} in WebView {self.webview_slots.index(slot)}...")
+         slot.loading_url = url_to_load
+         slot.load_started_at = time.time()
+         self.engine.metrics.mark(url_to_load, 'queue_wait')
+         if url_to_load in self.urls_to_monitor:
+             self.urls_to_monitor[url_to_load].monitored_check_count += 1
+         self.update_url_status(url_to_load, "Loading...") # Update status in UI
+         try:
+             slot.webview.LoadURL(url_to_load)
+         except Exception as e:
+             log(f"Error calling LoadURL for {url_to_load}: {e}")
+             slot.loading_url = None # Release the slot
+             self.engine.record_check_failure(url_to_load, str(e))
+             wx.CallAfter(self.process_next_webview_load)
 
 
     def on_webview_load_started(self, event):
          """Event handler for when the WebView starts loading."""
          url = event.GetURL()
-         print(f"WebView started loading: {url}")
+         log(f"WebView started loading: {url}")
          pass # Status already set to "Loading..."
 
 
-    def on_webview_load_completed(self, event):
-        """Event handler for when the WebView finishes loading."""
+    def on_webview_load_completed(self, event, slot):
+        """Event handler for when a pooled WebView finishes loading."""
         loaded_url = event.GetURL()
-        print(f"WebView finished loading: {loaded_url}")
+        log(f"WebView finished loading: {loaded_url}")
+        if slot.resetting_since:
+            self.finish_slot_reset(slot, loaded_url)
+            return
  
-        original_url_requested = self.webview_loading_url
+        original_url_requested = slot.loading_url
  
         if original_url_requested not in self.urls_to_monitor:
-             print(f"Completed load for unknown or deleted URL: {original_url_requested}")
-             self.webview_loading_url = None
+             log(f"Completed load for unknown or deleted URL: {original_url_requested}")
+             slot.loading_url = None
              self.process_next_webview_load()
              return
  
         monitor = self.urls_to_monitor[original_url_requested]
  
-        status = "Processing..."
-        self.update_url_status(original_url_requested, status) # Update UI immediately to "Processing..." state
+        self.engine.metrics.mark(original_url_requested, 'fetch')
+        self.update_url_status(original_url_requested, "Processing...") # Update UI immediately to "Processing..." state
  
  
         try:
-            # Use JavaScript to retrieve the element content
-            escaped_attribute_value = self.escape_attribute_value(monitor.selector_value)
- 
-            js_script = f"""
-             (function() {{
-                 try {{
-                     // Use querySelector for robustness across id/class etc.
-                     var element = document.querySelector("{monitor.tag}[{monitor.selector_type}='{escaped_attribute_value}']");
-                     if (element) {{
-                         var text = (element.textContent || '').trim();
-                         return JSON.stringify({{ found: true, content: text }});
-                     }} else {{
-                         return JSON.stringify({{ found: false }});
-                     }}
-                 }} catch(e) {{
-                     return JSON.stringify({{ error: true, message: e.message }});
-                 }}
-             }})();
-             """
-            runscript_result = self.webview.RunScript(js_script)  # store this to inspect better later
+            # One cached script extracts every target of the monitor
+            ignore = tuple(value for kind, value in monitor.noise_rules if kind == RULE_IGNORE)
+            js_script = webview_script(monitor.extraction_targets(), ignore)
+            runscript_result = slot.webview.RunScript(js_script)  # store this to inspect better later
  
             success, js_result_str = runscript_result  # Unpack the tuple.  CRITICAL STEP.
  
             if not success:
-                print(f"WebView.RunScript failed for {original_url_requested}")
-                status = "JavaScript Error: RunScript failed"
-                self.update_url_status(original_url_requested, status)
-                self.webview_loading_url = None
-                self.process_next_webview_load()
-                return 
+                log(f"WebView.RunScript failed for {original_url_requested}")
+                self.engine.record_check_failure(original_url_requested, "RunScript failed", status="JavaScript Error: RunScript failed")
+                return # finally releases the lock
  
             try:
                 js_result = json.loads(js_result_str)
- 
- 
-                if "error" in js_result and js_result["error"]:
-                    raise Exception(f"JavaScript error: {js_result.get('message', 'Unknown error')}")
- 
-                if js_result.get("found", False):
-                    element_content = js_result.get("content", "")
-                else:
-                    element_content = None  # Element not found
-                    print(f"Element {monitor.tag}[{monitor.selector_type}='{monitor.selector_value}'] not found on {original_url_requested}")
-                    if monitor.last_source != "":
-                        # If previously found, finding nothing is potentially a change state
-                        status = "Element not found (potential change?)" # Set status here
- 
-                    else:
-                        # If never found before, just update status and finish for this URL
-                        status = "Element not found" # Set status here
-                        # Update UI explicitly here if we exit early
-                        self.update_url_status(original_url_requested, status)
-                        # Finished with this load - release lock and process next
-                        self.webview_loading_url = None
-                        self.process_next_webview_load()
-                        return # Exit this handler early
- 
- 
             except json.JSONDecodeError as e:
-                 print(f"Error decoding JSON from JavaScript: {e}.  Raw JS result: {js_result_str}")
-                 status = f"JSON Decode Error: {e}"
-                 self.update_url_status(original_url_requested, status)
-                 self.webview_loading_url = None
-                 self.process_next_webview_load()
-                 return 
- 
- 
-            monitor.last_check_time = time.time()
+                 log(f"Error decoding JSON from JavaScript: {e}.  Raw JS result: {js_result_str}")
+                 self.engine.record_check_failure(original_url_requested, str(e), status=f"JSON Decode Error: {e}")
+                 return # finally releases the lock
  
-            if element_content is None: # Element not found
-                if monitor.last_source != "":
+            if "error" in js_result and js_result["error"]:
+                raise Exception(f"JavaScript error: {js_result.get('message', 'Unknown error')}")
  
-                    print(f"Change detected (element disappeared) for {original_url_requested}")
-                    monitor.last_source = "" # Element has disappeared
- 
-                    monitor.last_change_time = monitor.last_check_time # Timestamp of the change
-                    status = "Change Detected: Element Disappeared!" # Set status here
-                    self.on_change_detected(original_url_requested) # Trigger notification and UI update
-                else:
-                    print(f"Element never found for {original_url_requested}")
-                    # Nothing to see here
-                    if status == "Processing...":
-                          status = "Ok"
- 
-            elif monitor.last_source != element_content:
-                print(f"Change detected for {original_url_requested}")
-                monitor.last_source = element_content # Store the NEW content
-                monitor.last_change_time = monitor.last_check_time # Timestamp of the change
-                status = "Change Detected!" # Set status here
-                self.on_change_detected(original_url_requested) # Trigger notification and UI update
+            values = js_result.get("values", {})
+            if monitor.targets:
+                element_content = values
             else:
-                print(f"No change detected for {original_url_requested}")
-                # If no change and status wasn't set because element wasn't found, set it to Ok
-                # The 'Element not found (potential change?)' case also falls here if last_source != ""
-                if status == "Processing..." or status == "Element not found (potential change?)":
-                    status = "Ok" # Or "No change detected." # Set status here
- 
+                element_content = values.get(SINGLE_TARGET)  # None: element not found
  
-            # Always call update_url_status with the FINAL determined status
-            # This will overwrite the initial "Processing..." status
-            self.update_url_status(original_url_requested, status)
-            self.save_data() # Save state after a check completes
+            self.engine.metrics.mark(original_url_requested, 'parse')
+            self.engine.record_check_result(original_url_requested, element_content)
  
  
         except Exception as e:
             # This outer except block would catch errors from RunScript()
             # (more likely, but good practice)
-            print(f"Unexpected error in webview load completed for {original_url_requested}: {e}")
-            status = f"Internal Error: {e}" # Set status here
-            self.update_url_status(original_url_requested, status)
+            log(f"Unexpected error in webview load completed for {original_url_requested}: {e}")
+            self.engine.record_check_failure(original_url_requested, str(e), status=f"Internal Error: {e}")
  
  
         finally:
             # This block always runs after the try/except (and inner try/except)
-            # Release the WebView lock and process the next item in the queue
-            self.webview_loading_url = None
+            # Release the WebView slot and process the next item in the queue
+            slot.loading_url = None
             self.process_next_webview_load()
             
             
 
-    def on_webview_load_failed(self, event):
-        """Event handler for WebView load errors."""
+    def on_webview_load_failed(self, event, slot):
+        """Event handler for pooled WebView load errors."""
         failed_url = event.GetURL() # Might be the URL that failed
         error_desc = event.GetErrorDescription() if hasattr(event, 'GetErrorDescription') else "Unknown error"
-        
-        url_requested = self.webview_loading_url
+        if slot.resetting_since:
+            self.finish_slot_reset(slot, failed_url)
+            return
 
-        print(f"WebView failed to load {failed_url} (requested: {url_requested}) - Error: {error_desc}")
+        url_requested = slot.loading_url
 
+        log(f"WebView failed to load {failed_url} (requested: {url_requested}) - Error: {error_desc}")
+        self.engine.metrics.mark(url_requested, 'fetch')
 
         try:
-            if url_requested in self.urls_to_monitor:
-                 monitor = self.urls_to_monitor[url_requested]
-                 monitor.last_check_time = time.time() # Record the attempt time
-                 status = f"Load Failed: {error_desc[:100]}..." # Truncate error message
-                 self.update_url_status(url_requested, status) # Update status in UI
-                 self.save_data() # Save state after an attempt
-
-            else:
-                 print(f"Load failed for unknown or deleted URL: {url_requested}")
+            self.engine.record_check_failure(url_requested, error_desc, transport=True)
         finally:
-             # Release the WebView lock regardless of success or failure
-             self.webview_loading_url = None
+             # Release the WebView slot regardless of success or failure
+             slot.loading_url = None
              self.process_next_webview_load() # Process the next item
 
-    def process_next_webview_load(self):
-         """Checks if there's a URL waiting in the queue and loads it."""
-         if self.monitoring_running and not self.webview_loading_url and self.check_queue:
-              next_url = self.check_queue.pop(0) # Get the next URL from the front of the queue
-              print(f"Processing next URL from queue: {next_url}")
-              # Request the load via CallAfter to ensure it happens correctly on the UI thread
-              event = RequestWebViewLoadEvent(url=next_url)
-              wx.PostEvent(self, event)
-         elif not self.monitoring_running:
-              print("Monitoring stopped, clearing WebView queue.")
-              self.check_queue = []
-         # If queue is empty or webview is busy, do nothing until next request or load completes
-
-
-    # --- Monitoring Thread Logic ---
-
-    def monitor_urls_thread(self):
-        """Background thread function to periodically schedule WebView checks."""
-        print("Monitor thread started.")
-        while self.monitoring_running:
-            # Find URLs that are due for a check
-            urls_due_for_check = [
-                url for url, monitor in self.urls_to_monitor.items()
-                if monitor.should_check()
-            ]
-
-            for url in urls_due_for_check:
-                 if url not in self.check_queue:
-                     self.check_queue.append(url)
-                     print(f"Added {url} to check queue.")
-
-            # This logic is slightly redundant with process_next_webview_load being called
-            # in completed/failed handlers, but ensures we start loading if the queue
-            # has items and the WebView is initially free.
-            if self.monitoring_running and not self.webview_loading_url and self.check_queue:
-                 self.process_next_webview_load()
-
-
-            # Determine the sleep time
-            # We need to wake up when any enabled monitor is due for its next check
-            next_check_time = float('inf')
-            active_monitors = [m for m in self.urls_to_monitor.values() if m.enabled]
-
-            if active_monitors:
-                current_timestamp = time.time()
-                for monitor in active_monitors:
-                   # Calculate when the monitor should be checked next based on its interval
-                   scheduled_next_check = monitor.last_check_time + monitor.interval
-                   # Time remaining until this monitor is due
-                   remaining_time = scheduled_next_check - current_timestamp
-                   # Find the minimum positive remaining time among all monitors
-                   if remaining_time > 0:
-                       next_check_time = min(next_check_time, remaining_time)
-
-                # If any monitors are due now or in the past, the smallest effective wait is very short
-                if next_check_time == float('inf'): # No future checks scheduled (all are due now or in the past)
-                    next_check_time = 1 # Check again soon
-
-            else:
-                 # No active monitors, sleep longer
-                 print("No active monitors. Sleeping longer.")
-                 next_check_time = 60 # Sleep 60 seconds if nothing is active
-
-            # Ensure sleepy time is positive and not excessively long
-            sleep_duration = max(1, min(next_check_time, 600)) # Sleep at least 1 sec, max 10 min
+    # --- HTTP Backend Results ---
 
+    def post_result(self, url, content, error):
+        """Called from HTTP worker threads. Results are batched: one CallAfter drains a whole burst."""
+        self.result_inbox.append((url, content, error))
+        if not self.result_drain_scheduled:
+            self.result_drain_scheduled = True
+            wx.CallAfter(self.drain_results)
 
-            print(f"Monitoring thread sleeping for ~{int(sleep_duration)} seconds. Queue length: {len(self.check_queue)}")
+    def drain_results(self):
+        """Records every queued HTTP result. Runs on the UI thread."""
+        self.result_drain_scheduled = False # Set first: a result appended from now on schedules another drain
+        while self.result_inbox:
+            url, content, error = self.result_inbox.popleft()
+            self.engine.record_http_result(url, content, error)
 
-            # Sleep elegantly, checking the shutdown signal frequently
-            sleep_increment = 1
-            slept_time = 0
-            while self.monitoring_running and slept_time < sleep_duration:
-                 time.sleep(sleep_increment)
-                 slept_time += sleep_increment
+    # --- WebView Check Queue (Run on UI Thread) ---
 
+    def queue_webview_check(self, monitor, priority):
+        """Called by the engine, usually from its scheduler thread. Loads are started on the UI thread."""
+        if self.is_webview_loading(monitor.url):
+            return False
+        if monitor.url not in self.check_queue:
+            self.engine.metrics.begin(monitor.url) # Before put(): the UI thread may start the load right away
+        queued = self.check_queue.put(monitor.url, priority=priority)
+        if not self.webview_drain_scheduled:
+            self.webview_drain_scheduled = True
+            wx.CallAfter(self.process_next_webview_load)
+        return queued
 
-        print("Monitor thread stopping cleanly.")
+    def process_next_webview_load(self):
+         """Starts queued URLs on every free WebView slot. Runs on the UI thread."""
+         self.webview_drain_scheduled = False
+         if not self.engine.running:
+              log("Monitoring stopped, clearing WebView queue.")
+              self.check_queue.clear()
+              return
+
+         if not self.webview_slots:
+              # No WebView at all: fail queued checks instead of leaving them queued forever
+              next_url = self.check_queue.pop()
+              while next_url is not None:
+                   self.engine.record_check_failure(next_url, WEBVIEW_UNAVAILABLE_ERROR)
+                   next_url = self.check_queue.pop()
+              return
+
+         slot = self.free_webview_slot()
+         while slot is not None:
+              next_url = self.check_queue.pop() # Priority lane first, then oldest
+              if next_url is None:
+                   break
+              log(f"Processing next URL from queue: {next_url}")
+              self.start_webview_load(slot, next_url)
+              slot = self.free_webview_slot()
+         # If queue is empty or all WebViews are busy, do nothing until next request or load completes
 
 
     def update_url_status(self, url, status_text):
-        """Update the status column for a specific URL row."""
-        for i in range(self.url_list.GetItemCount()):
-            if self.url_list.GetItemText(i, 0) == url:
-                monitor = self.urls_to_monitor.get(url) # Get URLMonitor object
-
-                # Ensure monitor exists before accessing attributes
-                if monitor:
-                     last_check_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(monitor.last_check_time)) if monitor.last_check_time else "Never"
-                     last_change_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(monitor.last_change_time)) if monitor.last_change_time else "None"
-
-                     self.url_list.SetItem(i, 4, last_check_str)
-                     self.url_list.SetItem(i, 5, last_change_str)
-                     self.url_list.SetItem(i, 6, status_text)
-                break # Found the URL, exit loop
+        """Update the status (and check times) shown for a specific URL row."""
+        self.url_list.set_status(url, status_text)
 
 
     def update_list_ctrl(self):
-        """Clears and repopulates the ListCtrl from urls_to_monitor."""
-        # Store selected index if any to re-select after update
-        selected_url = None
-        selected_index = self.url_list.GetFirstSelected()
-        if selected_index != -1:
-             selected_url = self.url_list.GetItemText(selected_index, 0)
+        """Rebinds the virtual list to urls_to_monitor, e.g. after loading data."""
+        selected_url = self.url_list.selected_url() # Re-select after update
 
+        self.url_list.set_monitors(self.urls_to_monitor)
 
-        self.url_list.DeleteAllItems()
-        index = 0
-        for url, monitor in self.urls_to_monitor.items():
-            monitored_element_info = ""
-            if monitor.tag and monitor.selector_type and monitor.selector_value:
-                 monitored_element_info = f"{monitor.selector_type}={monitor.selector_value} ({monitor.tag})"
-            else:
-                 monitored_element_info = "Entire Page"
-
-            self.url_list.InsertItem(index, url)
-            self.url_list.SetItem(index, 1, str(monitor.interval))
-            self.url_list.SetItem(index, 2, "Yes" if monitor.enabled else "No")
-            self.url_list.SetItem(index, 3, monitored_element_info)
-            # Use existing monitor data if available, otherwise default display
-            last_check_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(monitor.last_check_time)) if monitor.last_check_time else "Never"
-            last_change_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(monitor.last_change_time)) if monitor.last_change_time else "None"
-            self.url_list.SetItem(index, 4, last_check_str)
-            self.url_list.SetItem(index, 5, last_change_str)
-             # Initial status or loaded status
-            status = "Idle"
-            if url in self.urls_to_monitor and self.urls_to_monitor[url].last_check_time > 0:
-                 pass # Status will be updated by monitoring process
-            self.url_list.SetItem(index, 6, status)
-            index += 1
-
-        # Re-select the item if one was selected before update
-        if selected_url:
-             for i in range(self.url_list.GetItemCount()):
-                  if self.url_list.GetItemText(i, 0) == selected_url:
-                       self.url_list.Select(i)
-                       break
+        if selected_url in self.url_list.row_of:
+             self.url_list.Select(self.url_list.row_of[selected_url])
 
 
     def update_list_ctrl_row(self, url):
-         """Updates a specific row in the ListCtrl for a given URL."""
-         for i in range(self.url_list.GetItemCount()):
-             if self.url_list.GetItemText(i, 0) == url:
-                 monitor = self.urls_to_monitor.get(url)
-                 if monitor:
-                    monitored_element_info = ""
-                    if monitor.tag and monitor.selector_type and monitor.selector_value:
-                         monitored_element_info = f"{monitor.selector_type}={monitor.selector_value} ({monitor.tag})"
-                    else:
-                         monitored_element_info = "Entire Page"
-
-                    self.url_list.SetItem(i, 1, str(monitor.interval))
-                    self.url_list.SetItem(i, 2, "Yes" if monitor.enabled else "No")
-                    self.url_list.SetItem(i, 3, monitored_element_info)
-                    last_check_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(monitor.last_check_time)) if monitor.last_check_time else "Never"
-                    last_change_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(monitor.last_change_time)) if monitor.last_change_time else "None"
-                    self.url_list.SetItem(i, 4, last_check_str)
-                    self.url_list.SetItem(i, 5, last_change_str)
-                break 
+         """Repaints the row for a given URL if it is visible."""
+         self.url_list.refresh_url(url)
 
     def on_change_detected(self, url):
         """Method called by the monitoring thread or WebView handler via wx.CallAfter on change."""
@@ -742,70 +1092,29 @@ class AppFrame(wx.Frame):
             self.show_notification(f"Change Detected on {url}", f"The monitored content on {url} has changed.")
 
 
-    def load_data(self):
-        """Loads URLs and settings from a pickle file."""
-        if os.path.exists(DATA_FILE):
-            try:
-                with open(DATA_FILE, 'rb') as f:
-                    data = pickle.load(f)
-                    if isinstance(data, dict):
-                        self.urls_to_monitor = {url: monitor for url, monitor in data.items() if isinstance(monitor, URLMonitor)}
-                        print(f"Loaded {len(self.urls_to_monitor)} URLs from {DATA_FILE}")
-                    else:
-                        print(f"Data in {DATA_FILE} is not a dictionary, starting fresh.")
-                        self.urls_to_monitor = {}
-
-            except Exception as e:
-                print(f"Error loading data from {DATA_FILE}: {e}")
-                self.urls_to_monitor = {}
-        else:
-            print(f"No data file found at {DATA_FILE}")
-
-
-    def save_data(self):
-        """Saves current URLs and settings to a pickle file."""
-        try:
-            with open(DATA_FILE, 'wb') as f:
-                pickle.dump(self.urls_to_monitor, f)
-            print(f"Saved {len(self.urls_to_monitor)} URLs to {DATA_FILE}")
-        except Exception as e:
-            print(f"Error saving data to {DATA_FILE}: {e}")
-
-
     def show_notification(self, title, message):
         """Displays a native desktop notification."""
         try:
+           import wx.adv
            # Check for availability of NotificationMessage before using it
            notification = wx.adv.NotificationMessage(title, message)
            notification.Show()            
         except Exception as e:
-             print(f"Error showing notification: {e}")
+             log(f"Error showing notification: {e}")
 
 
     def on_close(self, event):
         """Handler for the window close event."""
-        print("Main frame closing.")
-        self.monitoring_running = False
+        log("Main frame closing.")
 
         # Clear queue and WebView state on close
-        self.check_queue = []
-        self.webview_loading_url = None
-         # Attempt to stop current webview load if any
-        if self.webview and hasattr(self.webview, 'Stop'):
-            try:
-                self.webview.Stop()
-            except Exception as e:
-                print(f"Error stopping webview on close: {e}")
-
-
-        if self.monitoring_thread and self.monitoring_thread.is_alive():
-             print("Waiting for monitoring thread to join...")
-             self.monitoring_thread.join(timeout=5)
-
-             if self.monitoring_thread.is_alive():
-                print("Monitoring thread did not exit gracefully.")
+        self.stats_timer.Stop()
+        self.check_queue.clear()
+         # Attempt to stop current webview loads if any
+        self.stop_webview_loads()
 
-        self.save_data()
+        # Stops the monitoring thread and HTTP workers, then saves every URL
+        self.engine.close(save_all=True)
         self.Destroy()
 
 